@@ -1,64 +1,111 @@
-import requests
-import logging
+import http_session
 import sys
 import json
 import os
-from datetime import datetime
+import fcntl
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from logging_config import load_log_config
-import pytz
+from endpoint_registry import get_endpoint
+import metrics
 import time
 
 # Carregar a configuração de log para este script
-load_log_config(script_name="access_manager")
+logger = load_log_config(script_name="access_manager")
 
 # Caminho para o arquivo de token geral e de tenant
 TOKEN_FILE = os.path.join(os.getcwd(), "config", "token.json")
 TENANT_TOKEN_FILE_TEMPLATE = os.path.join(os.getcwd(), "config", "tenant_token_{tenant_id}.json")
 LOCK_WAIT_TIME = 5  # Tempo de espera entre tentativas
 MAX_ATTEMPTS = 3  # Número máximo de tentativas
-LOCK_TIMEOUT = 60  # Tempo limite para considerar um lock travado
+LOCK_TIMEOUT = 60  # Tempo limite para obter o lock do arquivo de token
+LOCK_POLL_INTERVAL = 0.1  # Intervalo entre tentativas de obter o lock
+EXPIRY_SAFETY_MARGIN = 30  # Segundos antes da expiração a partir dos quais o token não é mais usado
+REFRESH_MARGIN = 300  # Segundos antes da expiração em que o token é renovado em segundo plano
+REFRESH_CHECK_INTERVAL = 30  # Intervalo entre verificações da renovação em segundo plano
+IDLE_TIMEOUT = 3600  # Tokens sem uso há mais que isso não são renovados e saem do cache (ex.: tenant removido ou de outro nó)
 
-# Função para carregar a configuração de endpoints
-def load_endpoints_config():
-    config_path = os.path.join(os.getcwd(), 'config', 'endpoints_config.json')
-    with open(config_path, 'r', encoding='utf-8') as file:
-        return json.load(file)
+class TokenError(Exception):
+    """Falha ao obter um token do controlador."""
+
+# Função para mudar o diretório dos arquivos de token (ex.: um por nó coletor, ver sharding.py)
+def set_token_dir(directory):
+    global TOKEN_FILE, TENANT_TOKEN_FILE_TEMPLATE
+    directory = os.path.join(os.getcwd(), directory)
+    os.makedirs(directory, exist_ok=True)
+    TOKEN_FILE = os.path.join(directory, "token.json")
+    TENANT_TOKEN_FILE_TEMPLATE = os.path.join(directory, "tenant_token_{tenant_id}.json")
+
+# Função para converter o expiredDate (GMT, "%Y-%m-%d %H:%M:%S") em timestamp
+def parse_expired_date(expired_date_str):
+    expired_date = datetime.strptime(expired_date_str, "%Y-%m-%d %H:%M:%S")
+    return expired_date.replace(tzinfo=timezone.utc).timestamp()
 
 # Função para verificar se o token expirou
 def is_token_expired(expired_date_str):
-    gmt = pytz.timezone('GMT')
-    expired_date = datetime.strptime(expired_date_str, "%Y-%m-%d %H:%M:%S")
-    expired_date = gmt.localize(expired_date)
-    now = datetime.now(pytz.utc)
-    return now > expired_date
+    return time.time() > parse_expired_date(expired_date_str)
+
+# Função para ler um arquivo de token; devolve None se não existir ou estiver corrompido
+def read_token_file(path):
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        logger.warning("Arquivo de token corrompido ignorado: %s", path)
+        return None
+
+# Função para gravar o arquivo de token de forma atômica (arquivo temporário + rename)
+def write_token_file(path, token_data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_token_")
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(token_data, file, indent=4)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+# Lock entre processos sobre o arquivo de token (fcntl), liberado automaticamente se o processo morrer
+@contextmanager
+def token_file_lock(path, timeout=LOCK_TIMEOUT):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise TokenError(f"Tempo limite de {timeout}s excedido aguardando o lock de {path}")
+                time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# Função para fazer a requisição de token, com novas tentativas em caso de falha
+def request_with_attempts(request_function, execution_id, *args):
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return request_function(*args, execution_id)
+        except TokenError as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            logger.warning("[Execution ID: %s] Tentativa %d de %d falhou: %s", execution_id, attempt, MAX_ATTEMPTS, e)
+            time.sleep(LOCK_WAIT_TIME)
+
+# Função para requisitar um novo token MSP ao controlador; devolve (token, expiredDate)
+def request_msp_token(url, username, password, execution_id):
+    # Caminho do endpoint no registro (endpoints_config.json, lido uma vez por processo)
+    endpoint = f"{http_session.build_base_url(url)}{get_endpoint('get_token').path}"
 
-# Função para obter o token de autenticação
-def get_huawei_nce_token(url, username, password, execution_id, force_new_token=False):
-    logging.info(f"[Execution ID: {execution_id}] Iniciando a obtenção do token")
-
-    # Verificar se já existe um token e se ele é válido
-    if os.path.exists(TOKEN_FILE) and not force_new_token:
-        with open(TOKEN_FILE, "r") as file:
-            token_data = json.load(file)
-
-        # Se não existir expiredDate ou o token for inválido, forçar nova geração
-        if "expiredDate" not in token_data or is_token_expired(token_data["expiredDate"]):
-            logging.warning(f"[Execution ID: {execution_id}] Token inválido ou expiredDate ausente. Forçando nova obtenção.")
-            return get_huawei_nce_token(url, username, password, execution_id, force_new_token=True)
-
-        if not token_data.get("locked"):
-            logging.info(f"[Execution ID: {execution_id}] Token válido encontrado.")
-            return token_data["token_id"]
-
-    # Bloquear o token antes de fazer a requisição
-    token_data = {"locked": True, "lockedSince": datetime.now(pytz.utc).strftime("%Y-%m-%d %H:%M:%S")}
-    with open(TOKEN_FILE, "w") as file:
-        json.dump(token_data, file, indent=4)
-
-    # Carregar o endpoint do arquivo endpoints_config.json
-    endpoints_config = load_endpoints_config()
-    endpoint = f"https://{url}{endpoints_config['endpoints']['get_token']['endpoint']}"
-    
     payload = {
         "userName": username,
         "password": password
@@ -66,64 +113,32 @@ def get_huawei_nce_token(url, username, password, execution_id, force_new_token=
     headers = {"Content-Type": "application/json"}
 
     try:
-        logging.info(f"[Execution ID: {execution_id}] Fazendo requisição para: {endpoint}")
-        response = requests.post(endpoint, json=payload, headers=headers)
-
-        # DEBUG: Detalhes da resposta
-        logging.debug(f"[Execution ID: {execution_id}] Response received: Status code {response.status_code}, Content: {response.text}")
-
-        if response.status_code != 200:
-            logging.error(f"[Execution ID: {execution_id}] Erro HTTP: {response.status_code} - {response.text}")
-            sys.exit(1)
-
-        response_json = response.json()
-
-        if response_json.get('errcode') == "0":
-            token = response_json['data']['token_id']
-            expired_date = response_json['data']['expiredDate']
-            token_data = {
-                "token_id": token,
-                "expiredDate": expired_date,
-                "locked": False,
-                "lockedSince": None  # Definir lockedSince como None após a obtenção bem-sucedida do token
-            }
-            with open(TOKEN_FILE, "w") as file:
-                json.dump(token_data, file, indent=4)
-            logging.info(f"[Execution ID: {execution_id}] Token obtido com sucesso e salvo.")
-            return token
-        else:
-            logging.error(f"[Execution ID: {execution_id}] Erro na obtenção do token: {response_json['errmsg']}")
-            sys.exit(1)
+        logger.info("[Execution ID: %s] Fazendo requisição para: %s", execution_id, endpoint)
+        response = http_session.request("POST", endpoint, json=payload, headers=headers, rate_limit="msp")
     except Exception as e:
-        logging.critical(f"[Execution ID: {execution_id}] Erro ao tentar obter o token: {e}")
-        sys.exit(1)
-
-# Função para obter o token com Tenant ID
-def get_tenant_token(url, tenant_id, access_token, execution_id, force_new_token=False):
-    tenant_file = TENANT_TOKEN_FILE_TEMPLATE.format(tenant_id=tenant_id)
-    
-    logging.info(f"[Execution ID: {execution_id}] Iniciando a obtenção do tenant token para tenant {tenant_id}")
+        raise TokenError(f"Erro ao tentar obter o token: {e}") from e
 
-    if os.path.exists(tenant_file) and not force_new_token:
-        with open(tenant_file, "r") as file:
-            tenant_token_data = json.load(file)
+    # DEBUG: Detalhes da resposta
+    logger.debug("[Execution ID: %s] Response received: Status code %s, Content: %s", execution_id, response.status_code, response.text)
 
-        # Se não existir expiredDate ou o token for inválido, forçar nova geração
-        if "expiredDate" not in tenant_token_data or is_token_expired(tenant_token_data["expiredDate"]):
-            logging.warning(f"[Execution ID: {execution_id}] Tenant token inválido ou expiredDate ausente. Forçando nova obtenção.")
-            return get_tenant_token(url, tenant_id, access_token, execution_id, force_new_token=True)
+    if response.status_code != 200:
+        raise TokenError(f"Erro HTTP: {response.status_code} - {response.text}")
 
-        if not tenant_token_data.get("locked"):
-            logging.info(f"[Execution ID: {execution_id}] Token válido para tenant {tenant_id}.")
-            return tenant_token_data["tokenId"]
-
-    tenant_token_data = {"locked": True, "lockedSince": datetime.now(pytz.utc).strftime("%Y-%m-%d %H:%M:%S")}
-    with open(tenant_file, "w") as file:
-        json.dump(tenant_token_data, file, indent=4)
+    # Resposta 200 malformada (JSON inválido ou sem os campos) também é TokenError: tentada de novo por request_with_attempts
+    try:
+        response_json = response.json()
+        if response_json.get('errcode') != "0":
+            raise TokenError(f"Erro na obtenção do token: {response_json.get('errmsg')}")
+        token, expired_date = response_json['data']['token_id'], response_json['data']['expiredDate']
+        parse_expired_date(expired_date)
+        return token, expired_date
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise TokenError(f"Resposta inválida na obtenção do token: {e!r} - {response.text[:200]}") from e
 
-    # Carregar o endpoint do arquivo endpoints_config.json
-    endpoints_config = load_endpoints_config()
-    endpoint = f"https://{url}{endpoints_config['endpoints']['get_tenant_token']['endpoint']}"
+# Função para requisitar um novo token de tenant ao controlador; devolve (token, expiredDate)
+def request_tenant_token(url, tenant_id, access_token, execution_id):
+    # Caminho do endpoint no registro (endpoints_config.json, lido uma vez por processo)
+    endpoint = f"{http_session.build_base_url(url)}{get_endpoint('get_tenant_token').path}"
 
     payload = {
         "identity": {
@@ -137,35 +152,205 @@ def get_tenant_token(url, tenant_id, access_token, execution_id, force_new_token
     }
 
     try:
-        logging.info(f"[Execution ID: {execution_id}] Fazendo requisição para: {endpoint}")
-        response = requests.post(endpoint, json=payload, headers=headers)
+        logger.info("[Execution ID: %s] Fazendo requisição para: %s", execution_id, endpoint)
+        response = http_session.request("POST", endpoint, json=payload, headers=headers, rate_limit="msp")
+    except Exception as e:
+        raise TokenError(f"Erro ao tentar obter o tenant token: {e}") from e
 
-        # DEBUG: Detalhes da resposta
-        logging.debug(f"[Execution ID: {execution_id}] Response received: Status code {response.status_code}, Content: {response.text}")
+    # DEBUG: Detalhes da resposta
+    logger.debug("[Execution ID: %s] Response received: Status code %s, Content: %s", execution_id, response.status_code, response.text)
 
-        if response.status_code != 200:
-            logging.error(f"[Execution ID: {execution_id}] Erro HTTP: {response.status_code} - {response.text}")
-            sys.exit(1)
+    if response.status_code != 200:
+        raise TokenError(f"Erro HTTP: {response.status_code} - {response.text}")
 
+    try:
         response_json = response.json()
+        if 'data' not in response_json or 'tokenId' not in response_json['data']:
+            raise TokenError(f"Erro na obtenção do tenant token: {response_json}")
+        token, expired_date = response_json['data']['tokenId'], response_json['data']['expiredDate']
+        parse_expired_date(expired_date)
+        return token, expired_date
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise TokenError(f"Resposta inválida na obtenção do tenant token: {e!r} - {response.text[:200]}") from e
 
-        if 'data' in response_json and 'tokenId' in response_json['data']:
-            tenant_token = response_json['data']['tokenId']
-            expired_date = response_json['data']['expiredDate']
-
-            tenant_token_data = {
-                "tokenId": tenant_token,
-                "expiredDate": expired_date,
-                "locked": False,
-                "lockedSince": None
-            }
-            with open(tenant_file, "w") as file:
-                json.dump(tenant_token_data, file, indent=4)
-            logging.info(f"[Execution ID: {execution_id}] Tenant token obtido e salvo com sucesso para tenant {tenant_id}.")
-            return tenant_token
-        else:
-            logging.error(f"[Execution ID: {execution_id}] Erro na obtenção do tenant token: {response_json}")
-            sys.exit(1)
-    except Exception as e:
-        logging.critical(f"[Execution ID: {execution_id}] Erro ao tentar obter o tenant token: {e}")
+# Cache em memória dos tokens MSP e de tenant, com renovação antecipada e lock real entre processos
+class TokenManager:
+    def __init__(self, refresh_margin=REFRESH_MARGIN, check_interval=REFRESH_CHECK_INTERVAL, idle_timeout=IDLE_TIMEOUT):
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        self.idle_timeout = idle_timeout
+        self.counters = {"hits": 0, "misses": 0, "file_hits": 0, "refreshes": 0, "background_refreshes": 0, "errors": 0,
+                         "evictions": 0}
+        self._reset_process_state()
+
+    def _reset_process_state(self):
+        # Locks e a thread de renovação não sobrevivem a um fork; o cache de tokens sim
+        self._pid = os.getpid()
+        self._tokens = getattr(self, "_tokens", {})  # chave -> {"token", "expires_at", "path", "fetch", "last_used"}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._refresher = None
+
+    def _check_process(self):
+        if self._pid != os.getpid():
+            self._reset_process_state()
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _usable(self, entry):
+        return entry is not None and time.time() < entry["expires_at"] - EXPIRY_SAFETY_MARGIN
+
+    def _entry_from_file(self, path, token_field):
+        token_data = read_token_file(path)
+        # Arquivos sem expiredDate (ex.: o antigo {"locked": true}) são tratados como inválidos
+        if not token_data or token_field not in token_data or "expiredDate" not in token_data:
+            return None
+        return {"token": token_data[token_field], "expires_at": parse_expired_date(token_data["expiredDate"])}
+
+    def _get(self, key, path, token_field, fetch, execution_id, force_new_token=False, background=False):
+        # Tempo de obtenção por tipo de token e origem (cache, espera por outra thread, arquivo ou controlador)
+        started = time.perf_counter()
+        try:
+            token, source = self._acquire(key, path, token_field, fetch, execution_id, force_new_token, background)
+        except TokenError:
+            metrics.inc("errors_total", phase="token", token_type=key[0])
+            raise
+        # Só o uso pela coleta conta: a renovação em segundo plano não mantém vivo um token que ninguém mais pede
+        if not background:
+            with self._lock:
+                if key in self._tokens:
+                    self._tokens[key]["last_used"] = time.monotonic()
+        metrics.observe("token_seconds", time.perf_counter() - started, token_type=key[0], source=source)
+        return token
+
+    def _acquire(self, key, path, token_field, fetch, execution_id, force_new_token, background):
+        self._check_process()
+        current = self._tokens.get(key)
+        if not force_new_token and self._usable(current):
+            self._count("hits")
+            return current["token"], "cache"
+
+        if not background:
+            self._count("misses")
+        # Uma única busca por chave dentro do processo; as demais threads aguardam e reutilizam o resultado
+        with self._key_lock(key):
+            entry = self._tokens.get(key)
+            if self._usable(entry) and (not force_new_token or entry is not current):
+                return entry["token"], "wait"
+
+            if not force_new_token:
+                entry = self._entry_from_file(path, token_field)
+                if self._usable(entry):
+                    self._count("file_hits")
+                    return self._store(key, entry, path, fetch)["token"], "file"
+
+            with token_file_lock(path):
+                # Outro processo pode ter renovado o token enquanto aguardávamos o lock
+                entry = self._entry_from_file(path, token_field)
+                stale_token = current["token"] if current else None
+                if self._usable(entry) and (not force_new_token or entry["token"] != stale_token):
+                    self._count("file_hits")
+                    return self._store(key, entry, path, fetch)["token"], "file"
+
+                try:
+                    token, expired_date = fetch(execution_id)
+                except TokenError:
+                    self._count("errors")
+                    raise
+                write_token_file(path, {token_field: token, "expiredDate": expired_date})
+                self._count("refreshes")
+                entry = {"token": token, "expires_at": parse_expired_date(expired_date)}
+                return self._store(key, entry, path, fetch)["token"], "network"
+
+    def _store(self, key, entry, path, fetch):
+        entry.update({"path": path, "fetch": fetch})
+        with self._lock:
+            entry["last_used"] = self._tokens[key]["last_used"] if key in self._tokens else time.monotonic()
+            self._tokens[key] = entry
+        self._start_refresher()
+        return entry
+
+    def get_msp_token(self, url, username, password, execution_id, force_new_token=False):
+        fetch = lambda eid: request_with_attempts(request_msp_token, eid, url, username, password)
+        return self._get(("msp", url, username), TOKEN_FILE, "token_id", fetch, execution_id, force_new_token)
+
+    def get_tenant_token(self, url, tenant_id, access_token, execution_id, force_new_token=False, msp_credentials=None):
+        def fetch(eid):
+            # Na renovação em segundo plano o token MSP original pode ter expirado; obtém um atual
+            token = self.get_msp_token(url, *msp_credentials, eid) if msp_credentials else access_token
+            return request_with_attempts(request_tenant_token, eid, url, tenant_id, token)
+        path = TENANT_TOKEN_FILE_TEMPLATE.format(tenant_id=tenant_id)
+        return self._get(("tenant", url, tenant_id), path, "tokenId", fetch, execution_id, force_new_token)
+
+    def _start_refresher(self):
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, name="token-refresher", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            if self._pid != os.getpid():
+                return
+            self.refresh_expiring()
+
+    def _evict(self, key):
+        with self._lock:
+            self._tokens.pop(key, None)
+            lock = self._key_locks.get(key)
+            if lock is not None and not lock.locked():
+                del self._key_locks[key]
+            self.counters["evictions"] += 1
+
+    def refresh_expiring(self, execution_id="token-refresher"):
+        # Renova, antes da expiração, os tokens que vencem dentro de refresh_margin e foram usados nos últimos
+        # idle_timeout segundos; os sem uso saem do cache (se voltarem a ser pedidos, são obtidos na hora)
+        now = time.monotonic()
+        with self._lock:
+            idle = [key for key, entry in self._tokens.items() if now - entry["last_used"] > self.idle_timeout]
+            expiring = [(key, entry) for key, entry in self._tokens.items()
+                        if key not in idle and entry["expires_at"] - time.time() < self.refresh_margin]
+        for key in idle:
+            self._evict(key)
+        for key, entry in expiring:
+            token_field = "token_id" if key[0] == "msp" else "tokenId"
+            try:
+                self._get(key, entry["path"], token_field, entry["fetch"], execution_id, force_new_token=True, background=True)
+                self._count("background_refreshes")
+            except Exception as e:
+                # Sem novas tentativas a cada verificação: o token volta a ser obtido quando a coleta o pedir
+                self._evict(key)
+                logger.warning("[Execution ID: %s] Falha ao renovar o token %s em segundo plano: %s", execution_id, key[0], e)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, cached_tokens=len(self._tokens))
+
+# Gerenciador de tokens compartilhado pelo processo
+token_manager = TokenManager()
+
+# Função para obter o token de autenticação
+def get_huawei_nce_token(url, username, password, execution_id, force_new_token=False):
+    logger.info("[Execution ID: %s] Iniciando a obtenção do token", execution_id)
+    try:
+        return token_manager.get_msp_token(url, username, password, execution_id, force_new_token)
+    except TokenError as e:
+        logger.critical("[Execution ID: %s] Erro ao tentar obter o token: %s", execution_id, e)
+        sys.exit(1)
+
+# Função para obter o token com Tenant ID
+def get_tenant_token(url, tenant_id, access_token, execution_id, force_new_token=False, msp_credentials=None):
+    logger.info("[Execution ID: %s] Iniciando a obtenção do tenant token para tenant %s", execution_id, tenant_id)
+    try:
+        return token_manager.get_tenant_token(url, tenant_id, access_token, execution_id, force_new_token, msp_credentials)
+    except TokenError as e:
+        logger.critical("[Execution ID: %s] Erro ao tentar obter o tenant token: %s", execution_id, e)
         sys.exit(1)
@@ -0,0 +1,320 @@
+import sys
+import argparse
+import traceback
+from datetime import datetime, timezone
+
+import logging_config
+import metrics
+
+# Carregar a configuração de log para os rollups de alarmes
+logger = logging_config.load_log_config('alarm_rollups')
+
+# Rollups de alarmes mantidos na ingestão: o AlarmStateOutputHandler converte as transições gravadas na tabela de
+# eventos em variações de contadores por balde (hora e dia, em UTC) e grupo (tenant, severidade, ne-name e
+# native-probable-cause), somadas com upsert na mesma transação dos eventos. Os painéis consultam as tabelas de
+# rollup pela chave primária (tenant_id, bucket, ...) em vez de varrer o JSONB de alarms_huawei.
+#   - raised/cleared/reraised/acked: transições ocorridas no balde (pela hora de last-changed do alarme)
+#   - active_delta: variação de alarmes ativos no balde; a view {tabela}_active traz o acumulado (ativos ao fim do balde)
+#   - tabela active_table: alarmes ativos agora, por grupo
+# A retenção remove da tabela bruta os alarmes encerrados sem alteração há mais de raw_retention_days (descartando as
+# partições antigas que ficarem vazias, e deixando um evento "purged" por alarme) e os eventos mais antigos que
+# events_retention_days; os rollups são mantidos.
+# Configuração na chave "rollups" do state_tracking (output_handler_config.json).
+# Uso: python alarm_rollups.py (resumo) | --retention | --rebuild [--endpoints get_alarms] [--db_connection ...]
+# Rodar a retenção periodicamente (ex.: cron diário): python alarm_rollups.py --retention
+
+DEFAULT_ROLLUP_SETTINGS = {
+    "enabled": True,
+    "hourly_table": "{table}_rollup_hourly",
+    "daily_table": "{table}_rollup_daily",
+    "active_table": "{table}_active_counts",
+    "raw_retention_days": 90,       # deve ser maior que a janela de alarmes consultada no controlador
+    "events_retention_days": 365,   # deve ser maior que raw_retention_days: inclui os tombstones dos alarmes removidos
+    "delete_batch_size": 10000
+}
+
+# Tabelas de rollup e a unidade do balde de cada uma
+BUCKET_TABLES = {"hourly_table": "hour", "daily_table": "day"}
+GROUP_COLUMNS = ("tenant_id", "severity", "ne_name", "probable_cause")
+COUNTER_COLUMNS = ("raised", "cleared", "reraised", "acked", "active_delta")
+
+# Função para obter a configuração de rollups do state_tracking; None se desligados
+def rollup_settings(state_tracking, table):
+    settings = (state_tracking or {}).get("rollups")
+    if not settings or not settings.get("enabled", True):
+        return None
+    settings = {**DEFAULT_ROLLUP_SETTINGS, **settings}
+    for name in ("hourly_table", "daily_table", "active_table"):
+        settings[name] = settings[name].format(table=table)
+    return settings
+
+# Função para montar os comandos que criam as tabelas de rollup, suas views de ativos e a tabela de ativos atuais
+def rollup_tables_sql(settings):
+    groups = ", ".join(GROUP_COLUMNS)
+    group_definitions = ",\n            ".join(f"{column} text NOT NULL" for column in GROUP_COLUMNS)
+    statements = []
+    for name in BUCKET_TABLES:
+        table = settings[name]
+        counters = ",\n            ".join(f"{column} integer NOT NULL DEFAULT 0" for column in COUNTER_COLUMNS)
+        statements += [
+            f"""CREATE TABLE IF NOT EXISTS {table} (
+            bucket timestamptz NOT NULL,
+            {group_definitions},
+            {counters},
+            updated_at timestamptz NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (tenant_id, bucket, severity, ne_name, probable_cause)
+        );""",
+            f"CREATE INDEX IF NOT EXISTS {table}_bucket_idx ON {table} (bucket);",
+            f"""CREATE OR REPLACE VIEW {table}_active AS
+            SELECT bucket, {groups}, {", ".join(COUNTER_COLUMNS)},
+                   SUM(active_delta) OVER (PARTITION BY {groups} ORDER BY bucket) AS active
+            FROM {table};""",
+        ]
+    statements.append(f"""CREATE TABLE IF NOT EXISTS {settings['active_table']} (
+            {group_definitions},
+            active integer NOT NULL DEFAULT 0,
+            updated_at timestamptz NOT NULL DEFAULT NOW(),
+            PRIMARY KEY ({groups})
+        );""")
+    return statements
+
+# Função para normalizar um valor booleano vindo da página ("true"/"false") ou do banco (bool)
+def flag(value):
+    return value is True or value == "true"
+
+# Função para obter o início da hora (UTC) de um evento; sem data válida, a hora atual
+def event_hour(value):
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            value = None
+    if not isinstance(value, datetime):
+        value = datetime.now(timezone.utc)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+# Variações de contadores de um conjunto de eventos, por balde horário e grupo
+class RollupAccumulator:
+    def __init__(self):
+        self.hourly = {}   # (hora, grupo) -> [raised, cleared, reraised, acked, active_delta]
+        self.events = 0
+
+    def bump(self, hour, group, counter, amount=1):
+        counters = self.hourly.setdefault((hour, group), [0] * len(COUNTER_COLUMNS))
+        counters[COUNTER_COLUMNS.index(counter)] += amount
+
+    # event: tenant_id, event_type, severity, previous_severity, is_cleared, previous_is_cleared (None para
+    # alarme novo), last_changed, time_created, ne_name, probable_cause e, opcionalmente, recorded_at
+    def add(self, event):
+        # Tombstones da retenção (compact_raw) não são transições do alarme
+        if event["event_type"] == "purged":
+            return
+        self.events += 1
+        hour = event_hour(event["last_changed"] or event["time_created"] or event.get("recorded_at"))
+        tenant_id, ne_name, probable_cause = event["tenant_id"] or "", event["ne_name"] or "", event["probable_cause"] or ""
+        group = (tenant_id, event["severity"] or "", ne_name, probable_cause)
+        new = event["previous_is_cleared"] is None
+        event_type = event["event_type"]
+        if event_type in ("raised", "reraised") or (new and event_type == "cleared"):
+            self.bump(hour, group, "raised")
+        if event_type in ("cleared", "reraised", "acked"):
+            self.bump(hour, group, event_type)
+        # Ativos: sai do grupo da severidade anterior se estava ativo, entra no grupo atual se continua ativo
+        if not new and not flag(event["previous_is_cleared"]):
+            self.bump(hour, (tenant_id, event["previous_severity"] or "", ne_name, probable_cause), "active_delta", -1)
+        if not flag(event["is_cleared"]):
+            self.bump(hour, group, "active_delta")
+
+    def rows(self, unit):
+        merged = {}
+        for (hour, group), counters in self.hourly.items():
+            bucket = hour.replace(hour=0) if unit == "day" else hour
+            totals = merged.setdefault((group[0], bucket) + group[1:], [0] * len(COUNTER_COLUMNS))
+            for position, value in enumerate(counters):
+                totals[position] += value
+        # Ordenadas pela chave primária: gravadores concorrentes bloqueiam as mesmas linhas na mesma ordem, sem deadlock
+        return [(key[1], key[0]) + key[2:] + tuple(counters) for key, counters in sorted(merged.items()) if any(counters)]
+
+    def active_rows(self):
+        merged = {}
+        for (_, group), counters in self.hourly.items():
+            merged[group] = merged.get(group, 0) + counters[-1]
+        return sorted((group + (delta,)) for group, delta in merged.items() if delta)
+
+    # Soma as variações nas tabelas de rollup; o commit fica com quem gravou os eventos
+    def save(self, cursor, settings, active=True):
+        from psycopg2.extras import execute_values
+        written = 0
+        columns = ("bucket",) + GROUP_COLUMNS + COUNTER_COLUMNS
+        updates = ", ".join(f"{column} = r.{column} + EXCLUDED.{column}" for column in COUNTER_COLUMNS)
+        for name, unit in BUCKET_TABLES.items():
+            rows = self.rows(unit)
+            if not rows:
+                continue
+            table = settings[name]
+            execute_values(cursor, f"""
+                INSERT INTO {table} AS r ({", ".join(columns)}) VALUES %s
+                ON CONFLICT (tenant_id, bucket, severity, ne_name, probable_cause)
+                DO UPDATE SET {updates}, updated_at = NOW();""", rows, page_size=1000)
+            metrics.inc("alarm_rollup_rows_total", len(rows), table=table)
+            written += len(rows)
+        rows = self.active_rows() if active else []
+        if rows:
+            execute_values(cursor, f"""
+                INSERT INTO {settings['active_table']} AS r ({", ".join(GROUP_COLUMNS)}, active) VALUES %s
+                ON CONFLICT ({", ".join(GROUP_COLUMNS)}) DO UPDATE SET active = r.active + EXCLUDED.active, updated_at = NOW();""",
+                           rows, page_size=1000)
+            metrics.inc("alarm_rollup_rows_total", len(rows), table=settings["active_table"])
+        return written
+
+# Função para listar as partições de uma tabela com o limite inferior de cada uma (None na partição padrão)
+def partition_bounds(cursor, table):
+    cursor.execute("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                   "WHERE i.inhparent = %s::regclass ORDER BY c.relname", (table,))
+    bounds = []
+    for name, expression in cursor.fetchall():
+        lower = upper = None
+        if "FROM (" in expression:
+            lower, upper = (part.split(")")[0].strip("'") for part in expression.split("(")[1:3])
+        bounds.append((name, lower, upper))
+    return bounds
+
+# Função para remover da tabela bruta os alarmes encerrados e sem alteração há mais de raw_retention_days. Cada alarme
+# removido deixa um evento "purged" (tombstone) na tabela de eventos, na mesma transação: se o controlador voltar a
+# reportá-lo, o rastreamento de estado o reconhece em vez de contá-lo como alarme novo (ver AlarmStateOutputHandler)
+def compact_raw(conn, table, events_table, expressions, settings):
+    from output_handler import ALARM_EVENT_COLUMNS, TIMESTAMP_FUNCTION
+    days = settings["raw_retention_days"]
+    summary = {"deleted": 0, "partitions_dropped": 0}
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT relkind = 'p', NOW() - %s * interval '1 day' FROM pg_class WHERE oid = %s::regclass", (days, table))
+        partitioned, cutoff = cursor.fetchone()
+        # Alarmes criados depois do corte não podem estar sem alteração há mais tempo: essas partições nem são lidas
+        parts = [(name, lower, upper) for name, lower, upper in partition_bounds(cursor, table)
+                 if lower is None or datetime.fromisoformat(lower) < cutoff] if partitioned else [(table, None, None)]
+    conn.commit()
+    # Colunas do tombstone: o último estado do alarme, lido do JSONB das linhas removidas
+    values = {column: expressions.get(column, "NULL") for column in ALARM_EVENT_COLUMNS}
+    values.update(event_type="'purged'", previous_severity="NULL", previous_is_cleared="true",
+                  is_cleared=f"({values['is_cleared']})::boolean", is_acked=f"({values['is_acked']})::boolean",
+                  last_changed=f"{TIMESTAMP_FUNCTION}({values['last_changed']})",
+                  time_created=f"{TIMESTAMP_FUNCTION}({values['time_created']})")
+    for name, lower, upper in parts:
+        # Uma transação por partição: os alarmes ativos continuam (o rastreamento de estado depende deles)
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                WITH purged AS (
+                    DELETE FROM {name} WHERE ({expressions['is_cleared']}) = 'true' AND collected_at < %s RETURNING data)
+                INSERT INTO {events_table} ({", ".join(ALARM_EVENT_COLUMNS)})
+                SELECT {", ".join(values[column] for column in ALARM_EVENT_COLUMNS)} FROM purged""", (cutoff,))
+            summary["deleted"] += cursor.rowcount
+            metrics.inc("alarm_retention_rows_total", cursor.rowcount, table=table)
+            if upper is not None and datetime.fromisoformat(upper) <= cutoff:
+                cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {name})")
+                if not cursor.fetchone()[0]:
+                    cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                    cursor.execute(f"DROP TABLE {name}")
+                    summary["partitions_dropped"] += 1
+                    metrics.inc("alarm_retention_partitions_total", table=table)
+        conn.commit()
+    return summary
+
+# Função para remover, em lotes pelo índice de recorded_at, os eventos mais antigos que events_retention_days
+def prune_events(conn, events_table, settings):
+    deleted = 0
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                DELETE FROM {events_table} WHERE id IN (
+                    SELECT id FROM {events_table} WHERE recorded_at < NOW() - %s * interval '1 day' LIMIT %s)""",
+                           (settings["events_retention_days"], settings["delete_batch_size"]))
+            count = cursor.rowcount
+        conn.commit()
+        deleted += count
+        metrics.inc("alarm_retention_rows_total", count, table=events_table)
+        if count < settings["delete_batch_size"]:
+            return deleted
+
+# Função para recalcular os rollups a partir da tabela de eventos e os ativos atuais a partir da tabela bruta.
+# Os eventos anteriores aos rollups não têm ne_name/probable_cause (vão para o grupo vazio); os já removidos pela
+# retenção deixam de ser contados. As tabelas de rollup ficam bloqueadas (gravação aguarda) até o fim.
+def rebuild(conn, table, events_table, settings, expressions):
+    accumulator = RollupAccumulator()
+    names = ("tenant_id", "event_type", "severity", "previous_severity", "is_cleared", "previous_is_cleared",
+             "last_changed", "time_created", "ne_name", "probable_cause", "recorded_at")
+    with conn.cursor() as cursor:
+        cursor.execute(f"TRUNCATE {settings['hourly_table']}, {settings['daily_table']}, {settings['active_table']}")
+        with conn.cursor(name=f"rebuild_{events_table}") as events:
+            events.itersize = 10000
+            events.execute(f"SELECT {', '.join(names)} FROM {events_table} ORDER BY id")
+            for row in events:
+                accumulator.add(dict(zip(names, row)))
+        accumulator.save(cursor, settings, active=False)
+        groups = ", ".join(f"COALESCE({expressions[column]}, '')" for column in GROUP_COLUMNS)
+        cursor.execute(f"""
+            INSERT INTO {settings['active_table']} ({", ".join(GROUP_COLUMNS)}, active)
+            SELECT {groups}, COUNT(*) FROM {table} WHERE ({expressions['is_cleared']}) IS DISTINCT FROM 'true'
+            GROUP BY {groups}""")
+    conn.commit()
+    return accumulator.events
+
+# Função para resumir o tamanho (estimado, somando as partições) das tabelas brutas, de eventos e de rollup
+def table_sizes(cursor, tables):
+    cursor.execute("SELECT t.name, SUM(GREATEST(c.reltuples, 0))::bigint, SUM(pg_total_relation_size(c.oid)) "
+                   "FROM unnest(%s::text[]) AS t (name) LEFT JOIN pg_partition_tree(to_regclass(t.name)) p ON true "
+                   "JOIN pg_class c ON c.oid = COALESCE(p.relid, to_regclass(t.name)) WHERE p.isleaf IS NOT FALSE GROUP BY t.name", (list(tables),))
+    return {name: (rows, size) for name, rows, size in cursor.fetchall()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retenção e reconstrução dos rollups de alarmes (state_tracking.rollups)")
+    parser.add_argument('--endpoints', help="Endpoints cujas tabelas serão tratadas (use vírgula para separar valores; padrão: todos)")
+    parser.add_argument('--db_connection', help="String de conexão que substitui a do output_handler_config.json")
+    parser.add_argument('--retention', action='store_true', help="Remover alarmes encerrados e eventos antigos, mantendo os rollups")
+    parser.add_argument('--rebuild', action='store_true', help="Recalcular os rollups a partir da tabela de eventos")
+    args = parser.parse_args()
+
+    import psycopg2
+    from output_handler import (load_output_config, encode_db_connection, field_expression, ALARM_KEY_FIELDS,
+                                ALARM_STATE_FIELDS, ALARM_EVENT_FIELDS)
+    from schema_manager import configured_tables
+
+    output_config = load_output_config()
+    failed = False
+    for db_name, tables in configured_tables(output_config, args.endpoints.split(",") if args.endpoints else None).items():
+        conn = psycopg2.connect(encode_db_connection(args.db_connection or output_config["databases"][db_name]["db_connection"]))
+        try:
+            for table, database_settings in tables.items():
+                state_tracking = database_settings.get("state_tracking") or {}
+                settings = rollup_settings(state_tracking, table) if state_tracking.get("enabled", True) else None
+                if settings is None:
+                    continue
+                events_table = state_tracking.get("events_table", f"{table}_events")
+                fields = {**ALARM_KEY_FIELDS, **ALARM_STATE_FIELDS, **ALARM_EVENT_FIELDS,
+                          **state_tracking.get("key_fields", {}), **state_tracking.get("state_fields", {})}
+                expressions = {name: field_expression(field) for name, field in fields.items()}
+                try:
+                    if args.rebuild:
+                        print(f"{table}: rollups recalculados a partir de {rebuild(conn, table, events_table, settings, expressions)} eventos")
+                    if args.retention:
+                        summary = compact_raw(conn, table, events_table, expressions, settings)
+                        summary["events_deleted"] = prune_events(conn, events_table, settings)
+                        logger.info("Retenção de %s: %s", table, summary)
+                        print(f"{table}: {summary}")
+                    if not args.rebuild and not args.retention:
+                        with conn.cursor() as cursor:
+                            sizes = table_sizes(cursor, [table, events_table, settings["hourly_table"], settings["daily_table"],
+                                                         settings["active_table"]])
+                        conn.rollback()
+                        for name, (rows, size) in sizes.items():
+                            print(f"{name}: ~{rows} linhas, {size / 2**20:.1f} MB")
+                except Exception as e:
+                    conn.rollback()
+                    failed = True
+                    logger.error("Falha nos rollups de %s: %s", table, e)
+                    logger.debug(traceback.format_exc())
+                    print(f"{table}: FALHA: {e}", file=sys.stderr)
+        finally:
+            conn.close()
+    sys.exit(1 if failed else 0)
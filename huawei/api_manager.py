@@ -1,13 +1,16 @@
-import requests
-import json
-import os
 import logging
 import logging_config
-from output_handler import get_output_handler, load_output_config
+import http_session
+import metrics
+import response_cache
+from output_handler import get_output_handler, load_output_config, get_nested_field
 from access_manager import get_huawei_nce_token, get_tenant_token
+from json_stream import StreamedPage, streaming_available, page_items_summary
+from endpoint_registry import load_endpoints_config, get_endpoint
 import argparse
 import uuid  # Importar UUID para gerar e controlar o UUID
 import sys
+import time
 import traceback  # Importar para capturar o traceback
 
 # Gerar um UUID único para esta execução
@@ -23,173 +26,356 @@ for handler in logging.root.handlers[:]:
 # Carregar a configuração de saída (output_handler_config.json)
 output_config = load_output_config()
 
-# Função para carregar a configuração de endpoints
-def load_endpoints_config():
-    config_path = os.path.join(os.path.dirname(__file__), 'config', 'endpoints_config.json')
-    with open(config_path, 'r', encoding='utf-8') as file:
-        return json.load(file)
-
-# Substituir placeholders no dicionário por valores reais passados em kwargs
-def parse_placeholders(data, execution_id, **kwargs):
-    if isinstance(data, dict):
-        return {k: parse_placeholders(v, execution_id, **kwargs) for k, v in data.items()}
-    elif isinstance(data, str):
-        return data.format(**kwargs)
-    return data
+# Aplicar a configuração de métricas (buckets e rótulo por tenant) antes das primeiras medições
+metrics.configure(load_endpoints_config().get("metrics", {}))
+
+# Função para exportar as métricas da execução (arquivo do textfile collector e resumo JSON); cumulative=True no daemon,
+# cujo registro já acumula as execuções desde o início do processo
+def export_metrics(execution_id, summary=True, cumulative=False):
+    try:
+        summary_path = metrics.export(load_endpoints_config().get("metrics", {}), execution_id, summary, cumulative)
+        logger.info("[UUID: %s] Métricas exportadas (resumo: %s)", execution_id, summary_path)
+    except Exception as e:
+        logger.error("[UUID: %s] Erro ao exportar as métricas: %s", execution_id, e)
 
 # Função para obter o token correto
 def get_token(token_type, url_base, username, password, execution_id, tenant_id=None):
-    logger.info(f"[UUID: {execution_id}] Obtendo token {token_type}")
+    logger.info("[UUID: %s] Obtendo token %s", execution_id, token_type)
     if token_type == "msp":
         return get_huawei_nce_token(url_base, username, password, execution_id)
     elif token_type == "tenant":
         if not tenant_id:
             raise ValueError("O 'tenant_id' é obrigatório para chamadas com token do tipo 'tenant'")
         msp_token = get_huawei_nce_token(url_base, username, password, execution_id)
-        return get_tenant_token(url_base, tenant_id, msp_token, execution_id)
+        return get_tenant_token(url_base, tenant_id, msp_token, execution_id, msp_credentials=(username, password))
     else:
         raise ValueError(f"Tipo de token {token_type} desconhecido")
 
 # Função para construir os parâmetros da URL
 def build_url_params(endpoint_config, execution_id, **kwargs):
-    url_params = {}
-    for param in endpoint_config.get('url_params', []):
-        if param['name'] in kwargs and kwargs[param['name']] is not None:
-            url_params[param['name']] = kwargs[param['name']]
-    return url_params
+    return {name: kwargs[name] for name in endpoint_config.url_param_names if kwargs.get(name) is not None}
 
 # Função para construir o corpo da requisição
 def build_body_params(endpoint_config, execution_id, **kwargs):
-    body_params = {}
-    for param in endpoint_config.get('body_params', []):
-        if param['name'] in kwargs and kwargs[param['name']] is not None:
-            body_params[param['name']] = kwargs[param['name']]
-    return body_params
+    return {name: kwargs[name] for name in endpoint_config.body_param_names if kwargs.get(name) is not None}
 
 # Função para tratar argumentos do tipo array
 def convert_array_args(endpoint_config, execution_id, **kwargs):
-    for param in endpoint_config.get('body_params', []):
-        if param['type'] == 'array' and param['name'] in kwargs and isinstance(kwargs[param['name']], str):
-            kwargs[param['name']] = kwargs[param['name']].split(",")
+    for name in endpoint_config.array_params:
+        if isinstance(kwargs.get(name), str):
+            kwargs[name] = kwargs[name].split(",")
     return kwargs
 
 # Função para adicionar dinamicamente argumentos no argparse
 def add_arguments_dynamically(parser, endpoint_config, execution_id):
-    for param in endpoint_config.get('url_params', []) + endpoint_config.get('body_params', []):
-        arg_name = f"--{param['name']}"
-        if param['type'] == 'int':
-            parser.add_argument(arg_name, type=int, help=param.get('description', ''))
-        elif param['type'] == 'array':
-            parser.add_argument(arg_name, help=f"{param.get('description', '')} (use vírgula para separar valores)")
+    for param in endpoint_config.url_params + endpoint_config.body_params:
+        arg_name = f"--{param.name}"
+        if param.type == 'int':
+            parser.add_argument(arg_name, type=int, help=param.description)
+        elif param.type == 'array':
+            parser.add_argument(arg_name, help=f"{param.description} (use vírgula para separar valores)")
         else:
-            parser.add_argument(arg_name, type=str, help=param.get('description', ''))
+            parser.add_argument(arg_name, type=str, help=param.description)
 
-# Função centralizada para fazer chamadas
-def make_api_call(endpoint_name, url_base, username, password, execution_id, tenant_id=None, **kwargs):
-    config = load_endpoints_config()
-    endpoint_config = config['endpoints'].get(endpoint_name)
+# Função para obter um endpoint do registro (ver endpoint_registry.py), com erro claro se não existir
+def get_endpoint_config(endpoint_name, execution_id):
+    endpoint_config = get_endpoint(endpoint_name)
 
     if not endpoint_config:
         logger.error(f"[UUID: {execution_id}] Endpoint {endpoint_name} não encontrado na configuração.")
         raise ValueError(f"Endpoint {endpoint_name} não encontrado na configuração.")
+    return endpoint_config
+
+# Função para resolver o tipo e as configurações do output handler de um endpoint
+def resolve_handler_settings(endpoint_name, execution_id):
+    # Carregar a configuração de saída específica para o endpoint
+    handler_config = output_config.get(endpoint_name, output_config.get("default", {}))
+
+    # Definir o tipo de handler a partir da configuração
+    handler_type = handler_config.get("type", "file")  # Valor padrão é "file" se não especificado
+    file_settings = handler_config.get("file_settings", {})
+
+    # Para database, pegar o db_name e mapear com o db_connection correto
+    if handler_type == "database":
+        db_settings = dict(handler_config.get("database_settings", {}))
+        db_name = db_settings.get("db_name")
+        if not db_name:
+            raise ValueError(f"[UUID: {execution_id}] db_name não encontrado na configuração.")
+
+        # Carregar a string de conexão correta a partir do db_name
+        database_config = output_config['databases'].get(db_name, {})
+        db_connection = database_config.get('db_connection')
+        if not db_connection:
+            raise ValueError(f"[UUID: {execution_id}] db_connection não encontrado para o db_name: {db_name}")
+
+        # Passar as configurações do banco de dados (e do pool e do spool, se houver) para o handler
+        db_settings['db_connection'] = db_connection
+        db_settings['pool_settings'] = database_config.get('pool')
+        db_settings['spool_settings'] = database_config.get('spool')
+        file_settings = db_settings  # Agora file_settings contém as configurações de banco de dados
+
+    return handler_type, file_settings
+
+# Função para instanciar o output handler configurado para o endpoint
+def resolve_output_handler(endpoint_name, execution_id):
+    handler_type, file_settings = resolve_handler_settings(endpoint_name, execution_id)
+
+    # Log para verificar os parâmetros
+    logger.info("[UUID: %s] handler_type: %s, file_settings: %s", execution_id, handler_type, file_settings)
+
+    # Obter o handler para a saída com base no tipo e configurações, passando o UUID
+    output_handler = get_output_handler(handler_type, execution_id=execution_id, **file_settings)
+
+    # Verificar se o output_handler foi criado corretamente
+    if output_handler is None:
+        logger.error("[UUID: %s] Falha ao instanciar o output_handler. Verifique os parâmetros passados: %s", execution_id, file_settings)
+    else:
+        logger.info("[UUID: %s] Output handler criado com sucesso.", execution_id)
+    return output_handler
 
-    # Converter automaticamente todos os argumentos de array
-    kwargs = convert_array_args(endpoint_config, execution_id, **kwargs)
+# Função para montar URL, headers e corpo de uma requisição a partir da configuração do endpoint
+def build_request(endpoint_config, url_base, token, execution_id, **kwargs):
+    # Preparar headers e corpo
+    headers = endpoint_config.headers(token=token, **kwargs)
+    body = build_body_params(endpoint_config, execution_id, **kwargs)
+
+    # Construir URL com parâmetros de query
+    url_params = build_url_params(endpoint_config, execution_id, **kwargs)
+    url = f"{http_session.build_base_url(url_base)}{endpoint_config.path}"
 
+    if url_params:
+        url += "?" + "&".join([f"{key}={value}" for key, value in url_params.items()])
+    return url, headers, body
+
+# Função para executar uma única requisição e devolver o JSON da resposta (ou None em caso de erro)
+# Com stream=True (e ijson instalado), devolve uma StreamedPage cujos itens de response_key são decodificados sob demanda
+def fetch_page(endpoint_name, endpoint_config, url_base, username, password, execution_id, tenant_id=None, stream=False, **kwargs):
     # Obter o token necessário
-    token_type = endpoint_config.get("token_type")
+    token_type = endpoint_config.token_type
 
     # Só exige tenant_id se o token_type for "tenant"
     if token_type == "tenant" and not tenant_id:
         raise ValueError(f"O endpoint {endpoint_name} requer 'tenant_id' pois utiliza token Tenant.")
 
+    # Endpoints com "cache" (ver response_cache.py): página ainda válida no cache dispensa token e requisição
+    cached = response_cache.lookup(endpoint_name, endpoint_config, f"{http_session.build_base_url(url_base)}{endpoint_config.path}",
+                                   build_url_params(endpoint_config, execution_id, **kwargs),
+                                   build_body_params(endpoint_config, execution_id, **kwargs), tenant_id)
+    if cached is not None:
+        if cached.fresh:
+            logger.info("[UUID: %s] %s: página obtida do cache", execution_id, endpoint_name)
+            return cached.hit()
+        # A página inteira é guardada no cache: sem decodificação incremental
+        stream = False
+
     token = get_token(token_type, url_base, username, password, execution_id, tenant_id)
+    url, headers, body = build_request(endpoint_config, url_base, token, execution_id, **kwargs)
+    if cached is not None:
+        headers.update(cached.conditional_headers())
+
+    # Logar a requisição (formatação adiada: só acontece se o nível estiver habilitado; token mascarado na escrita)
+    logger.info("[UUID: %s] Requisição para URL: %s", execution_id, url)
+    logger.debug("[UUID: %s] Headers: %s", execution_id, headers)
+    logger.debug("[UUID: %s] Body: %s", execution_id, body)
+
+    # Realizar a chamada HTTP (o requests só é importado aqui: páginas do cache e --help não precisam dele)
+    from requests.exceptions import RequestException
+    labels = {"endpoint": endpoint_name, "tenant": tenant_id}
+    started = time.perf_counter()
+    try:
+        # Timeout por endpoint (opcional); sem ele vale o timeout padrão da camada HTTP
+        timeout = endpoint_config.timeout
+        stream = stream and streaming_available()
+        if endpoint_config.method == "GET":
+            response = http_session.request("GET", url, headers=headers, params=kwargs.get('params', {}), timeout=timeout,
+                                            stream=stream, rate_limit=token_type)
+        elif endpoint_config.method == "POST":
+            response = http_session.request("POST", url, headers=headers, json=body, timeout=timeout,
+                                            stream=stream, rate_limit=token_type)
+        else:
+            logger.error(f"[UUID: {execution_id}] Método {endpoint_config.method} não suportado.")
+            raise ValueError(f"Método {endpoint_config.method} não suportado.")
+    except RequestException as e:
+        metrics.inc("errors_total", phase="http", reason=type(e).__name__, **labels)
+        logger.error("[UUID: %s] Erro ao fazer a chamada API: %s", execution_id, e)
+        return None
+    # Com stream=True, o tempo medido vai até os cabeçalhos; o corpo é lido durante a gravação
+    metrics.observe("http_request_seconds", time.perf_counter() - started, **labels)
+
+    # 304: o conteúdo guardado no cache ainda é o atual
+    if cached is not None and response.status_code == 304:
+        logger.info("[UUID: %s] %s: página revalidada no cache", execution_id, endpoint_name)
+        return cached.revalidated()
+
+    # Verificar se a resposta foi bem-sucedida
+    if response.status_code != 200:
+        metrics.inc("errors_total", phase="http", reason=str(response.status_code), **labels)
+        logger.error("[UUID: %s] Erro na resposta: %s - %s", execution_id, response.status_code, response.text)
+        return None
 
-    # Preparar headers e corpo
-    headers = parse_placeholders(endpoint_config['headers'], execution_id, token=token, **kwargs)
-    body = build_body_params(endpoint_config, execution_id, **kwargs)
+    response_key = endpoint_config.response_key
+    if stream:
+        # A conexão só volta ao pool depois que os itens forem consumidos (ou a página drenada)
+        response.raw.decode_content = True
+        logger.info("[UUID: %s] Resposta recebida; decodificando '%s' de forma incremental", execution_id, response_key)
+        pagination = endpoint_config.pagination or {}
+        meta_keys = [pagination[key] for key in ("total_key", "marker_key") if key in pagination]
+        metrics.inc("http_response_bytes_total", int(response.headers.get("Content-Length") or 0), **labels)
+        return StreamedPage(response.raw, response_key, meta_keys=meta_keys, on_close=response.close)
+
+    # Decodifica a resposta uma única vez; o log traz só um resumo, não o corpo inteiro
+    metrics.inc("http_response_bytes_total", len(response.content), **labels)
+    try:
+        with metrics.timer("decode_seconds", endpoint=endpoint_name):
+            data = response.json()
+    except ValueError:
+        metrics.inc("errors_total", phase="decode", **labels)
+        raise
+    items = data.get(response_key) if isinstance(data, dict) else None
+    logger.info("[UUID: %s] Resposta recebida: %d bytes, %d itens em '%s'", execution_id, len(response.content),
+                len(items) if isinstance(items, list) else 0, response_key)
+    logger.debug("[UUID: %s] Conteúdo da resposta: %s", execution_id, response.content)
+    if cached is not None:
+        return cached.store(data, response.content, response.headers)
+    return data
 
-    # Construir URL com parâmetros de query
-    url_params = build_url_params(endpoint_config, execution_id, **kwargs)
-    url = f"https://{url_base}{endpoint_config['endpoint']}"
-    
-    if url_params:
-        url += "?" + "&".join([f"{key}={value}" for key, value in url_params.items()])
+# Função para calcular os parâmetros da próxima página; devolve None quando não há mais páginas
+def next_page_kwargs(pagination, page, page_kwargs, item_count, last_item):
+    if not item_count:
+        return None
+    page_size = page_kwargs.get(pagination.get("size_param", "pageSize"))
+    short_page = bool(page_size) and item_count < page_size
+
+    if pagination["type"] == "page_index":
+        index_param = pagination.get("index_param", "pageIndex")
+        page_index = page_kwargs[index_param]
+        # Com o total informado pelo controlador, não depender do tamanho da página (ele pode limitar o pageSize)
+        total = page.get(pagination.get("total_key", "totalRecords"))
+        if total is not None and page_size:
+            if (page_index - pagination.get("first_index", 1) + 1) * page_size >= int(total):
+                return None
+        elif short_page:
+            return None
+        return {**page_kwargs, index_param: page_index + 1}
 
-    # Logar a requisição
-    logger.info(f"[UUID: {execution_id}] Requisição para URL: {url}")
-    logger.info(f"[UUID: {execution_id}] Headers: {headers}")
-    logger.info(f"[UUID: {execution_id}] Body: {body}")
+    if pagination["type"] == "marker":
+        if short_page:
+            return None
+        marker_param = pagination.get("marker_param", "marker")
+        # O marcador vem na resposta, se o controlador o informar, ou do último item da página
+        marker = page.get(pagination.get("marker_key", "marker"))
+        if marker is None and pagination.get("marker_item_field"):
+            marker = get_nested_field(last_item, pagination["marker_item_field"])
+        if marker is None or marker == page_kwargs.get(marker_param):
+            return None
+        return {**page_kwargs, marker_param: marker}
 
-    # Realizar a chamada HTTP
-    try:
-        if endpoint_config['method'] == "GET":
-            response = requests.get(url, headers=headers, params=kwargs.get('params', {}))
-        elif endpoint_config['method'] == "POST":
-            response = requests.post(url, headers=headers, json=body)
-        else:
-            logger.error(f"[UUID: {execution_id}] Método {endpoint_config['method']} não suportado.")
-            raise ValueError(f"Método {endpoint_config['method']} não suportado.")
-
-        # Verificar se a resposta foi bem-sucedida
-        if response.status_code == 200:
-            # Carregar a configuração de saída específica para o endpoint
-            handler_config = output_config.get(endpoint_name, output_config.get("default", {}))
-
-            # Definir o tipo de handler a partir da configuração
-            handler_type = handler_config.get("type", "file")  # Valor padrão é "file" se não especificado
-            file_settings = handler_config.get("file_settings", {})
-
-            # Para database, pegar o db_name e mapear com o db_connection correto
-            if handler_type == "database":
-                db_settings = handler_config.get("database_settings", {})
-                db_name = db_settings.get("db_name")
-                if not db_name:
-                    raise ValueError(f"[UUID: {execution_id}] db_name não encontrado na configuração.")
-                
-                # Carregar a string de conexão correta a partir do db_name
-                db_connection = output_config['databases'].get(db_name, {}).get('db_connection')
-                if not db_connection:
-                    raise ValueError(f"[UUID: {execution_id}] db_connection não encontrado para o db_name: {db_name}")
-                
-                # Passar as configurações do banco de dados para o handler
-                db_settings['db_connection'] = db_connection
-                file_settings = db_settings  # Agora file_settings contém as configurações de banco de dados
-
-            # Log para verificar os parâmetros
-            logger.info(f"[UUID: {execution_id}] handler_type: {handler_type}, file_settings: {file_settings}")
-
-            # Obter o handler para a saída com base no tipo e configurações, passando o UUID
-            output_handler = get_output_handler(handler_type, execution_id=execution_id, **file_settings)
-
-            # Verificar se o output_handler foi criado corretamente
-            if output_handler is None:
-                logger.error(f"[UUID: {execution_id}] Falha ao instanciar o output_handler. Verifique os parâmetros passados: {file_settings}")
-            else:
-                logger.info(f"[UUID: {execution_id}] Output handler criado com sucesso.")
-
-            # Obter a chave `response_key` do endpoints_config.json
-            response_key = endpoint_config.get('response_key', 'data')  # Padrão é 'data' se não for definido
-
-            # Salvar a resposta usando o handler configurado dinamicamente
-            output_handler.save(endpoint_name, response.json(), tenant_id=tenant_id or "", execution_id=execution_id, response_key=response_key, **kwargs)
-            logger.info(f"[UUID: {execution_id}] Resposta recebida: {response.json()}")
-            return response.json()
-        else:
-            logger.error(f"[UUID: {execution_id}] Erro na resposta: {response.status_code} - {response.text}")
+    raise ValueError(f"Tipo de paginação {pagination['type']} desconhecido")
+
+# Gerador que busca as páginas de um endpoint, uma de cada vez, conforme a estratégia de paginação
+def iter_api_pages(endpoint_name, url_base, username, password, execution_id, tenant_id=None, **kwargs):
+    endpoint_config = get_endpoint_config(endpoint_name, execution_id)
+
+    # Converter automaticamente todos os argumentos de array
+    kwargs = convert_array_args(endpoint_config, execution_id, **kwargs)
+
+    pagination = endpoint_config.pagination
+    response_key = endpoint_config.response_key
+
+    if pagination:
+        size_param = pagination.get("size_param", "pageSize")
+        kwargs.setdefault(size_param, pagination.get("page_size"))
+        if pagination["type"] == "page_index":
+            kwargs.setdefault(pagination.get("index_param", "pageIndex"), pagination.get("first_index", 1))
+    max_pages = (pagination or {}).get("max_pages", 1000)
+    stream = endpoint_config.stream
+
+    page_number, previous_first = 0, None
+    while kwargs is not None and page_number < max_pages:
+        page = fetch_page(endpoint_name, endpoint_config, url_base, username, password, execution_id, tenant_id, stream=stream, **kwargs)
+        if page is None:
+            raise RuntimeError(f"[UUID: {execution_id}] Falha ao obter a página {page_number + 1} de {endpoint_name}")
+
+        page_number += 1
+        yield page_number, page, kwargs
+
+        # Em páginas decodificadas de forma incremental, os itens já foram consumidos por quem recebeu a página
+        item_count, first_item, last_item = page_items_summary(page, response_key)
+        metrics.inc("pages_total", endpoint=endpoint_name, tenant=tenant_id)
+        metrics.inc("items_total", item_count, endpoint=endpoint_name, tenant=tenant_id)
+        if not pagination:
+            return
+        # Proteção contra controladores que ignoram o parâmetro de página e repetem o mesmo conteúdo
+        if item_count and first_item == previous_first:
+            logger.warning("[UUID: %s] Página %d de %s repetiu a anterior; encerrando paginação.", execution_id, page_number, endpoint_name)
+            return
+        previous_first = first_item
+        kwargs = next_page_kwargs(pagination, page, kwargs, item_count, last_item)
+
+    if kwargs is not None:
+        logger.warning("[UUID: %s] Limite de %d páginas atingido para %s.", execution_id, max_pages, endpoint_name)
+
+# Função centralizada para fazer chamadas
+# Com pipeline (ver pipeline.py), as páginas são enfileiradas para os gravadores e a busca segue para a próxima página
+def make_api_call(endpoint_name, url_base, username, password, execution_id, tenant_id=None, paginate=False, pipeline=None, **kwargs):
+    endpoint_config = get_endpoint_config(endpoint_name, execution_id)
+
+    if not paginate:
+        # Converter automaticamente todos os argumentos de array
+        kwargs = convert_array_args(endpoint_config, execution_id, **kwargs)
+        data = fetch_page(endpoint_name, endpoint_config, url_base, username, password, execution_id, tenant_id, **kwargs)
+        if data is None:
             return None
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"[UUID: {execution_id}] Erro ao fazer a chamada API: {e}")
+        output_handler = resolve_output_handler(endpoint_name, execution_id)
+
+        # Obter a chave `response_key` do endpoints_config.json
+        response_key = endpoint_config.response_key  # Padrão é 'data' se não for definido
+
+        # Salvar a resposta usando o handler configurado dinamicamente (páginas vindas do cache já foram gravadas)
+        if response_cache.needs_save(data):
+            if output_handler.save(endpoint_name, data, tenant_id=tenant_id or "", execution_id=execution_id, response_key=response_key, **kwargs) is None:
+                response_cache.discard(data)
+        metrics.inc("pages_total", endpoint=endpoint_name, tenant=tenant_id)
+        metrics.inc("items_total", page_items_summary(data, response_key)[0], endpoint=endpoint_name, tenant=tenant_id)
+        return data
+
+    # Modo paginado: cada página é salva assim que chega, sem acumular a resposta completa em memória
+    output_handler = resolve_output_handler(endpoint_name, execution_id) if pipeline is None else None
+    response_key = endpoint_config.response_key
+    summary = {"pages": 0, "items": 0}
+    pending = []
+    try:
+        for page_number, page, page_kwargs in iter_api_pages(endpoint_name, url_base, username, password, execution_id, tenant_id, **kwargs):
+            if not response_cache.needs_save(page):
+                pass
+            elif pipeline is not None:
+                pending.append(pipeline.submit(endpoint_name, page, response_key, tenant_id=tenant_id or "",
+                                               page=page_number, **page_kwargs))
+            elif output_handler.save(endpoint_name, page, tenant_id=tenant_id or "", execution_id=execution_id,
+                                     response_key=response_key, page=page_number, **page_kwargs) is None:
+                response_cache.discard(page)
+            summary["pages"] = page_number
+            summary["items"] += page_items_summary(page, response_key)[0]
+    except RuntimeError as e:
+        logger.error(str(e))
         return None
+    finally:
+        # As páginas já enfileiradas são gravadas mesmo se a paginação falhar no meio
+        saved = all([future.result() for future in pending])
+    if not saved:
+        logger.error("[UUID: %s] %s: falha na gravação de páginas do tenant %s", execution_id, endpoint_name, tenant_id)
+        return None
+
+    logger.info("[UUID: %s] %s: %d páginas, %d itens salvos", execution_id, endpoint_name, summary['pages'], summary['items'])
+    return summary
 
 # Exemplo de uso
 if __name__ == "__main__":
     try:
-        config = load_endpoints_config()
         endpoint_name = sys.argv[sys.argv.index('--endpoint_name') + 1] if '--endpoint_name' in sys.argv else None
 
-        endpoint_config = config['endpoints'].get(endpoint_name) if endpoint_name else None
+        endpoint_config = get_endpoint(endpoint_name) if endpoint_name else None
 
         parser = argparse.ArgumentParser(description="Fazer chamadas para a API Huawei NCE")
         parser.add_argument('--username', required=True, help="Username para autenticação")
@@ -197,6 +383,7 @@ if __name__ == "__main__":
         parser.add_argument('--url_base', required=True, help="URL base da API")
         parser.add_argument('--tenant_id', help="Tenant ID para chamadas com token Tenant")
         parser.add_argument('--endpoint_name', required=True, help="Nome do endpoint a ser chamado, ex: get_tenants")
+        parser.add_argument('--paginate', action='store_true', help="Percorrer todas as páginas conforme a paginação configurada do endpoint")
 
         if endpoint_config:
             add_arguments_dynamically(parser, endpoint_config, execution_id)
@@ -210,7 +397,7 @@ if __name__ == "__main__":
 
         logger.info(f"[UUID: {execution_id}] Argumentos recebidos: {masked_args}")
 
-        body = {key: value for key, value in vars(args).items() if value is not None and key not in ['username', 'password', 'url_base', 'endpoint_name', 'tenant_id']}
+        body = {key: value for key, value in vars(args).items() if value is not None and key not in ['username', 'password', 'url_base', 'endpoint_name', 'tenant_id', 'paginate']}
 
         response = make_api_call(
             args.endpoint_name,
@@ -219,9 +406,12 @@ if __name__ == "__main__":
             args.password,
             execution_id,
             tenant_id=args.tenant_id,
+            paginate=args.paginate,
             **body
         )
 
+        export_metrics(execution_id)
+
         # Se a resposta foi bem-sucedida, retorna exit code 0
         if response:
             sys.exit(0)  # OK
@@ -231,4 +421,5 @@ if __name__ == "__main__":
     except Exception as e:
         logger.error(f"[UUID: {execution_id}] Erro ao processar os argumentos ou executar o script: {str(e)}")
         logger.error(traceback.format_exc())  # Adiciona o rastreamento completo ao log
+        export_metrics(execution_id)
         sys.exit(3)  # Erro na execução
\ No newline at end of file
@@ -0,0 +1,356 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import traceback
+import uuid
+from collections import defaultdict
+
+import logging_config
+import http_session
+import metrics
+import rate_limiter
+import response_cache
+from api_manager import (load_endpoints_config, get_endpoint_config, convert_array_args, build_request, build_url_params,
+                         build_body_params, next_page_kwargs, resolve_handler_settings, export_metrics)
+from access_manager import token_manager
+from output_handler import DatabaseOutputHandler, FileOutputHandler, encode_db_connection, get_output_handler
+from collector import DEFAULT_TENANT_ENDPOINTS, TENANT_SCOPED_ARGS
+from spool import get_spool
+from watermarks import open_window, track_newest, close_window
+
+# Dependências opcionais: só são necessárias para o motor assíncrono
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+# Carregar a configuração de log para o coletor assíncrono
+logger = logging_config.load_log_config('async_collector')
+
+# Limites padrão de concorrência; podem ser sobrescritos pela chave "async_engine" do endpoints_config.json
+DEFAULT_ASYNC_SETTINGS = {
+    "global_concurrency": 200,
+    "tenant_concurrency": 4,
+    "endpoint_concurrency": {},
+    "db_pool_max_size": 10
+}
+
+class ApiCallError(Exception):
+    """Falha definitiva em uma chamada assíncrona à API."""
+
+# Motor de coleta assíncrono: várias requisições tenant/endpoint simultâneas em um único event loop
+class AsyncCollector:
+    def __init__(self, url_base, username, password, execution_id, settings=None):
+        if aiohttp is None:
+            raise RuntimeError("O coletor assíncrono requer o pacote 'aiohttp' (pip install aiohttp)")
+        self.url_base = url_base
+        self.username = username
+        self.password = password
+        self.execution_id = execution_id
+        self.settings = {**DEFAULT_ASYNC_SETTINGS, **load_endpoints_config().get("async_engine", {}), **(settings or {})}
+        self.http_settings = http_session.load_http_settings()
+
+        # Semáforos de concorrência: global, por endpoint e por tenant
+        self.global_semaphore = asyncio.Semaphore(self.settings["global_concurrency"])
+        self.endpoint_semaphores = {
+            name: asyncio.Semaphore(limit) for name, limit in self.settings["endpoint_concurrency"].items()
+        }
+        self.tenant_semaphores = defaultdict(lambda: asyncio.Semaphore(self.settings["tenant_concurrency"]))
+
+        self.session = None
+        self.db_pools = {}
+        self.db_pools_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        timeout = self.http_settings["timeout"]
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.settings["global_concurrency"]),
+            timeout=aiohttp.ClientTimeout(sock_connect=timeout["connect"], sock_read=timeout["read"]),
+            auto_decompress=True,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        for pool in self.db_pools.values():
+            await pool.close()
+
+    async def get_token(self, token_type, tenant_id=None):
+        # O TokenManager é síncrono, mas responde da memória; só vai à rede (em thread) quando precisa renovar
+        msp_token = await asyncio.to_thread(token_manager.get_msp_token, self.url_base, self.username, self.password, self.execution_id)
+        if token_type == "msp":
+            return msp_token
+        if token_type == "tenant":
+            if not tenant_id:
+                raise ValueError("O 'tenant_id' é obrigatório para chamadas com token do tipo 'tenant'")
+            return await asyncio.to_thread(token_manager.get_tenant_token, self.url_base, tenant_id, msp_token,
+                                           self.execution_id, False, (self.username, self.password))
+        raise ValueError(f"Tipo de token {token_type} desconhecido")
+
+    async def request(self, method, url, headers, body, timeout=None, rate_limit=None):
+        retries = self.http_settings["retries"]
+        limiter = rate_limiter.get_limiter(url, rate_limit) if rate_limit else None
+        throttle_retries = limiter.settings["max_throttle_retries"] if limiter else 0
+        request_timeout = None
+        if timeout:
+            connect, read = http_session.resolve_timeout(timeout)
+            request_timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+
+        # Mesma política de retry da sessão síncrona: erros de conexão e status em status_forcelist;
+        # respostas 429 não contam como tentativa: pausam o limitador pelo Retry-After (até max_throttle_retries vezes)
+        attempt = throttled = 0
+        while True:
+            if limiter:
+                await limiter.acquire_async()
+            started, status, retry_after = time.perf_counter(), None, None
+            try:
+                kwargs = {"json": body} if method == "POST" else {}
+                async with self.session.request(method, url, headers=headers, timeout=request_timeout, **kwargs) as response:
+                    status = response.status
+                    retry_after = rate_limiter.parse_retry_after(response.headers.get("Retry-After"))
+                    if status == 200:
+                        return await response.json(content_type=None)
+                    text = await response.text()
+                    if status == 429 and throttled < throttle_retries:
+                        throttled += 1
+                        continue
+                    if status not in retries["status_forcelist"] or attempt == retries["total"]:
+                        raise ApiCallError(f"Erro na resposta: {status} - {text}")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == retries["total"]:
+                    raise ApiCallError(f"Erro ao fazer a chamada API: {e!r}") from e
+            finally:
+                if limiter:
+                    limiter.release(status, time.perf_counter() - started, retry_after)
+            await asyncio.sleep(retries["backoff_factor"] * (2 ** attempt) * (0.5 + random.random() / 2))
+            attempt += 1
+
+    async def fetch_page(self, endpoint_name, endpoint_config, tenant_id=None, **kwargs):
+        token_type = endpoint_config.token_type
+        if token_type == "tenant" and not tenant_id:
+            raise ValueError(f"O endpoint {endpoint_name} requer 'tenant_id' pois utiliza token Tenant.")
+        # Cache de respostas compartilhado com o coletor síncrono; aqui sem revalidação condicional (a página expirada é buscada de novo)
+        cached = response_cache.lookup(endpoint_name, endpoint_config, f"{http_session.build_base_url(self.url_base)}{endpoint_config.path}",
+                                       build_url_params(endpoint_config, self.execution_id, **kwargs),
+                                       build_body_params(endpoint_config, self.execution_id, **kwargs), tenant_id)
+        if cached is not None and cached.fresh:
+            return cached.hit()
+        token = await self.get_token(token_type, tenant_id)
+        url, headers, body = build_request(endpoint_config, self.url_base, token, self.execution_id, **kwargs)
+        logger.debug("[UUID: %s] Requisição assíncrona para URL: %s", self.execution_id, url)
+
+        tenant_semaphore = self.tenant_semaphores[tenant_id] if tenant_id else None
+        endpoint_semaphore = self.endpoint_semaphores.get(endpoint_name)
+        # Ordem fixa de aquisição: tenant -> endpoint -> global
+        async with _optional(tenant_semaphore), _optional(endpoint_semaphore), self.global_semaphore:
+            with metrics.timer("http_request_seconds", endpoint=endpoint_name, tenant=tenant_id):
+                data = await self.request(endpoint_config.method, url, headers, body, endpoint_config.timeout, token_type)
+        return cached.store(data) if cached is not None else data
+
+    async def get_db_pool(self, db_name, db_connection):
+        async with self.db_pools_lock:
+            if db_name not in self.db_pools:
+                if asyncpg is None:
+                    raise RuntimeError("A saída em banco do coletor assíncrono requer o pacote 'asyncpg' (pip install asyncpg)")
+                self.db_pools[db_name] = await asyncpg.create_pool(encode_db_connection(db_connection), min_size=1,
+                                                                   max_size=self.settings["db_pool_max_size"])
+            return self.db_pools[db_name]
+
+    async def save_page(self, endpoint_name, page, tenant_id, response_key, page_number, page_kwargs):
+        handler_type, handler_settings = resolve_handler_settings(endpoint_name, self.execution_id)
+        if handler_type == "file":
+            handler = FileOutputHandler(handler_settings['base_path'], handler_settings.get('file_name_template', "{endpoint}_response.json"))
+            await asyncio.to_thread(handler.save, endpoint_name, page, tenant_id=tenant_id or "", execution_id=self.execution_id,
+                                    response_key=response_key, page=page_number, **page_kwargs)
+            return
+
+        if handler_type != "database":
+            raise ValueError(f"[UUID: {self.execution_id}] Handler desconhecido: {handler_type}")
+        state_tracking = handler_settings.get("state_tracking")
+        if state_tracking and state_tracking.get("enabled", True):
+            # O rastreamento de estado depende do índice em memória do AlarmStateOutputHandler: gravação síncrona em uma thread
+            await self.save_with_handler(endpoint_name, page, tenant_id, response_key, handler_settings)
+            return
+
+        # Com páginas pendentes no spool (ou logo após uma falha), o handler síncrono drena o spool antes de gravar ou
+        # acrescenta a página ao fim dele: uma página nova não passa à frente das que aguardam o replay
+        spool = get_spool(handler_settings["db_name"], handler_settings.get("spool_settings"))
+        if spool is not None and (time.monotonic() < spool.bypass_until or spool.segments(include_open=True)):
+            await self.save_with_handler(endpoint_name, page, tenant_id, response_key, handler_settings)
+            return
+
+        # Reaproveita o SQL do DatabaseOutputHandler (ON CONFLICT, hash de conteúdo, staging e merge), executado via asyncpg
+        sql = DatabaseOutputHandler(handler_settings["db_connection"], handler_settings["table"], handler_settings["save_mode"],
+                                    handler_settings.get("unique_field"), handler_settings.get("on_conflict"),
+                                    change_detection=handler_settings.get("change_detection", False),
+                                    schema=handler_settings.get("schema"))
+        conflict_query = sql.build_conflict_query(sql.on_conflict or "update")
+        items = page.get(response_key) or []
+        try:
+            pool = await self.get_db_pool(handler_settings["db_name"], handler_settings["db_connection"])
+            async with pool.acquire() as conn:
+                if sql.change_detection and not sql.hash_column_checked():
+                    sql.hash_column_found(await conn.fetchval(sql.hash_column_query("$1"), sql.table))
+                async with conn.transaction():
+                    await conn.execute(sql.create_staging_query())
+                    await conn.copy_records_to_table(sql.staging_table, columns=sql.staging_columns, records=sql.staging_records(items))
+                    await conn.execute(sql.merge_staging_query(conflict_query))
+        except Exception as e:
+            # Como no handler síncrono, só falhas de conexão vão para o spool; erros do próprio comando se repetiriam no replay
+            if spool is None or not is_connection_error(e):
+                raise
+            logger.error(f"[UUID: {self.execution_id}] Banco {handler_settings['db_name']} indisponível ao gravar {endpoint_name}: {e!r}")
+            spool.bypass_until = time.monotonic() + spool.settings["retry_interval"]
+            handler = get_output_handler(handler_type, self.execution_id, **handler_settings)
+            if handler is None or await asyncio.to_thread(handler.spool_page, spool, endpoint_name, page, tenant_id=tenant_id or "",
+                                                           response_key=response_key) is None:
+                raise RuntimeError(f"[UUID: {self.execution_id}] Falha ao guardar a página de {endpoint_name} no spool") from e
+
+    # Função para gravar a página com o handler síncrono (spool, drenagem e rastreamento de estado) em uma thread
+    async def save_with_handler(self, endpoint_name, page, tenant_id, response_key, handler_settings):
+        handler = get_output_handler("database", self.execution_id, **handler_settings)
+        if handler is None or await asyncio.to_thread(handler.save, endpoint_name, page, tenant_id=tenant_id or "",
+                                                       execution_id=self.execution_id, response_key=response_key) is None:
+            raise RuntimeError(f"[UUID: {self.execution_id}] Falha ao gravar a página de {endpoint_name}")
+
+    async def collect(self, endpoint_name, tenant_id=None, on_page=None, **kwargs):
+        # Equivalente assíncrono de make_api_call(paginate=True): busca e salva página por página
+        endpoint_config = get_endpoint_config(endpoint_name, self.execution_id)
+        kwargs = convert_array_args(endpoint_config, self.execution_id, **kwargs)
+        pagination = endpoint_config.pagination
+        response_key = endpoint_config.response_key
+        if pagination:
+            kwargs.setdefault(pagination.get("size_param", "pageSize"), pagination.get("page_size"))
+            if pagination["type"] == "page_index":
+                kwargs.setdefault(pagination.get("index_param", "pageIndex"), pagination.get("first_index", 1))
+        max_pages = (pagination or {}).get("max_pages", 1000)
+
+        summary = {"pages": 0, "items": 0}
+        previous_first = None
+        while kwargs is not None and summary["pages"] < max_pages:
+            page = await self.fetch_page(endpoint_name, endpoint_config, tenant_id, **kwargs)
+            items = page.get(response_key) or []
+            summary["pages"] += 1
+            summary["items"] += len(items)
+            metrics.inc("pages_total", endpoint=endpoint_name, tenant=tenant_id)
+            metrics.inc("items_total", len(items), endpoint=endpoint_name, tenant=tenant_id)
+            if response_cache.needs_save(page):
+                try:
+                    await self.save_page(endpoint_name, page, tenant_id, response_key, summary["pages"], kwargs)
+                except Exception:
+                    response_cache.discard(page)
+                    raise
+            if on_page is not None:
+                on_page(items)
+            if not pagination or (items and items[0] == previous_first):
+                break
+            previous_first = items[0] if items else None
+            kwargs = next_page_kwargs(pagination, page, kwargs, len(items), items[-1] if items else None)
+        return summary
+
+    async def list_tenant_ids(self):
+        tenant_ids = []
+        # Captura os IDs à medida que as páginas de get_tenants chegam (e são salvas normalmente)
+        await self.collect("get_tenants", on_page=lambda items: tenant_ids.extend(t["tenantId"] for t in items if t.get("tenantId")))
+        return tenant_ids
+
+    async def collect_tenant(self, tenant_id, endpoint_name):
+        extra_args = TENANT_SCOPED_ARGS.get(endpoint_name, lambda _: {})(tenant_id)
+        started = time.monotonic()
+        try:
+            # Coleta incremental (ver watermarks.py): mesma janela e mesmo store do coletor síncrono; o watermark só
+            # avança depois que todas as páginas foram gravadas (ou guardadas no spool)
+            incremental = get_endpoint_config(endpoint_name, self.execution_id).get("incremental", {})
+            window = await asyncio.to_thread(open_window, incremental, tenant_id) if incremental.get("enabled", False) else None
+            if window is not None:
+                extra_args.update(window["params"])
+            summary = await self.collect(endpoint_name, tenant_id=tenant_id,
+                                         on_page=(lambda items: track_newest(window, items)) if window is not None else None,
+                                         **extra_args)
+            if window is not None:
+                summary.update(await asyncio.to_thread(close_window, window, tenant_id))
+            return {"tenant_id": tenant_id, "endpoint": endpoint_name, "ok": True, "elapsed": time.monotonic() - started, **summary}
+        except Exception as e:
+            logger.error(f"[UUID: {self.execution_id}] Falha no tenant {tenant_id}, endpoint {endpoint_name}: {e!r}")
+            logger.debug(traceback.format_exc())
+            return {"tenant_id": tenant_id, "endpoint": endpoint_name, "ok": False, "elapsed": time.monotonic() - started, "error": repr(e)}
+
+    async def run_sweep(self, endpoints=None, tenant_ids=None):
+        endpoints = endpoints or DEFAULT_TENANT_ENDPOINTS
+        if tenant_ids is None:
+            tenant_ids = await self.list_tenant_ids()
+        logger.info(f"[UUID: {self.execution_id}] Varredura assíncrona de {len(tenant_ids)} tenants x {len(endpoints)} endpoints")
+        return await asyncio.gather(*(self.collect_tenant(tenant_id, endpoint_name)
+                                      for tenant_id in tenant_ids for endpoint_name in endpoints))
+
+# Função para separar as falhas de conexão do asyncpg (banco fora, rede, pool) dos erros do próprio comando
+def is_connection_error(error):
+    if isinstance(error, (OSError, asyncio.TimeoutError)):
+        return True
+    return asyncpg is not None and isinstance(error, (asyncpg.PostgresConnectionError, asyncpg.InterfaceError,
+                                                      asyncpg.CannotConnectNowError, asyncpg.TooManyConnectionsError))
+
+# Context manager assíncrono que não faz nada quando o semáforo não existe
+class _optional:
+    def __init__(self, semaphore):
+        self.semaphore = semaphore
+
+    async def __aenter__(self):
+        if self.semaphore is not None:
+            await self.semaphore.acquire()
+
+    async def __aexit__(self, *exc_info):
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+async def main(args, execution_id):
+    settings = {}
+    if args.global_concurrency:
+        settings["global_concurrency"] = args.global_concurrency
+    if args.tenant_concurrency:
+        settings["tenant_concurrency"] = args.tenant_concurrency
+    async with AsyncCollector(args.url_base, args.username, args.password, execution_id, settings) as collector:
+        return await collector.run_sweep(
+            endpoints=args.endpoints.split(","),
+            tenant_ids=args.tenant_ids.split(",") if args.tenant_ids else None,
+        )
+
+if __name__ == "__main__":
+    execution_id = str(uuid.uuid4())
+    parser = argparse.ArgumentParser(description="Coletar todos os tenants da API Huawei NCE em um único event loop")
+    parser.add_argument('--username', required=True, help="Username para autenticação")
+    parser.add_argument('--password', required=True, help="Password para autenticação")
+    parser.add_argument('--url_base', required=True, help="URL base da API")
+    parser.add_argument('--endpoints', default=",".join(DEFAULT_TENANT_ENDPOINTS),
+                        help="Endpoints coletados por tenant (use vírgula para separar valores)")
+    parser.add_argument('--tenant_ids', help="Lista fixa de tenants, sem consultar get_tenants (use vírgula para separar valores)")
+    parser.add_argument('--global_concurrency', type=int, help="Máximo de requisições simultâneas no total")
+    parser.add_argument('--tenant_concurrency', type=int, help="Máximo de requisições simultâneas por tenant")
+    args = parser.parse_args()
+
+    try:
+        started = time.monotonic()
+        results = asyncio.run(main(args, execution_id))
+    except Exception as e:
+        logger.error(f"[UUID: {execution_id}] Erro ao executar a varredura assíncrona: {str(e)}")
+        logger.error(traceback.format_exc())
+        export_metrics(execution_id)
+        sys.exit(3)
+    export_metrics(execution_id)
+    for name, stats in rate_limiter.all_limiter_stats().items():
+        logger.info(f"[UUID: {execution_id}] Limitador {name}: {stats}")
+
+    failed = [result for result in results if not result["ok"]]
+    for result in sorted(results, key=lambda r: (r["tenant_id"], r["endpoint"])):
+        details = result.get("error") or f"{result['pages']} páginas, {result['items']} itens"
+        print(f"{result['tenant_id']}\t{result['endpoint']}\t{'OK' if result['ok'] else 'FALHA'}\t{result['elapsed']:.2f}s\t{details}")
+    print(f"Chamadas: {len(results)}, sucesso: {len(results) - len(failed)}, falha: {len(failed)}, "
+          f"tempo total: {time.monotonic() - started:.2f}s")
+    sys.exit(3 if failed else 0)
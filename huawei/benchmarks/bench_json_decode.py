@@ -0,0 +1,87 @@
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_stream import StreamedPage, streaming_available
+from output_handler import iter_chunks
+
+# Benchmark de memória (pico do tracemalloc) e CPU da decodificação de uma página do alarm-list:
+#   triple  - comportamento antigo: response.json() chamado três vezes (save, log e retorno)
+#   single  - resposta decodificada uma única vez
+#   stream  - itens de 'alarm' decodificados de forma incremental e entregues em lotes, como no DatabaseOutputHandler
+# Uso: python benchmarks/bench_json_decode.py --alarms 5000 --batch_size 1000 --repeat 3
+
+# Função para gerar uma página sintética no formato do alarm-list
+def build_payload(n_alarms):
+    alarms = [{
+        "alarm-type-id": "huawei-nce-alarm:ALARM_LINK_DOWN",
+        "alarm-type-qualifier": f"{1000 + k % 50}",
+        "resource": f"c0f5a4e2-{k:08d}-4b7e-9d1b-6c1d3e8f9a20",
+        "time-created": "2024-10-19T16:07:05.092Z",
+        "is-acked": False,
+        "alarm-parameters": {
+            "alarm-serial-number": str(k),
+            "tenant-id": "2c758bed554544b1bcec3b0653a3c6d0",
+            "location-info": "Site=Matriz, Device=AR6121E, Interface=GigabitEthernet0/0/1",
+            "additional-information": "The link between the device and the controller is down. " * 3
+        },
+        "resource-alarm-parameters": {
+            "is-cleared": k % 3 == 0,
+            "perceived-severity": ("critical", "major", "minor", "warning")[k % 4],
+            "last-changed": "2024-10-19T16:07:05.092Z"
+        }
+    } for k in range(n_alarms)]
+    return json.dumps({"alarm": alarms, "marker": str(n_alarms)}).encode("utf-8")
+
+def run_triple(payload, batch_size):
+    saved = json.loads(payload)
+    logged = f"Resposta recebida: {json.loads(payload)}"
+    returned = json.loads(payload)
+    return len(returned["alarm"]) if saved and logged else 0
+
+def run_single(payload, batch_size):
+    data = json.loads(payload)
+    return sum(len(chunk) for chunk in iter_chunks(data["alarm"], batch_size))
+
+def run_stream(payload, batch_size):
+    page = StreamedPage(io.BytesIO(payload), "alarm", meta_keys=["marker"])
+    return sum(len(chunk) for chunk in iter_chunks(page["alarm"], batch_size))
+
+# Função para medir pico de memória e tempo de CPU de uma estratégia
+# (em execuções separadas: o tracemalloc deixa as alocações bem mais lentas e distorceria o tempo de CPU)
+def measure(strategy, payload, batch_size, repeat):
+    peaks, cpu_times = [], []
+    for _ in range(repeat):
+        started = time.process_time()
+        items = strategy(payload, batch_size)
+        cpu_times.append(time.process_time() - started)
+
+        tracemalloc.start()
+        strategy(payload, batch_size)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {"items": items, "peak_mb": round(min(peaks) / 2**20, 2), "cpu_s": round(min(cpu_times), 4)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark da decodificação das respostas da API (memória e CPU)")
+    parser.add_argument('--alarms', type=int, default=5000, help="Número de alarmes na página sintética")
+    parser.add_argument('--batch_size', type=int, default=1000, help="Tamanho do lote entregue ao handler")
+    parser.add_argument('--repeat', type=int, default=3, help="Repetições por estratégia (vale a melhor)")
+    args = parser.parse_args()
+
+    payload = build_payload(args.alarms)
+    strategies = {"triple": run_triple, "single": run_single}
+    if streaming_available():
+        strategies["stream"] = run_stream
+    else:
+        print("ijson não instalado: estratégia 'stream' ignorada", file=sys.stderr)
+
+    print(f"Página de {args.alarms} alarmes, {len(payload) / 2**20:.2f} MB")
+    for name, strategy in strategies.items():
+        result = measure(strategy, payload, args.batch_size, args.repeat)
+        print(f"{name:8} itens={result['items']:<8} pico={result['peak_mb']:>8.2f} MB  cpu={result['cpu_s']:.4f}s")
@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_end_to_end import git_revision, previous_run
+
+# Benchmark de inicialização: tempo de parede de invocações avulsas (um processo Python novo por execução), como as
+# do agente de monitoramento que chama o api_manager.py a cada item. Cada cenário roda --runs vezes (após uma
+# execução de aquecimento: .pyc, tokens e cache de respostas já gravados) e registra o mínimo, a mediana e os
+# módulos pesados carregados. O resultado é acrescentado a benchmarks/results/startup_history.jsonl e comparado
+# com a última execução de mesmos parâmetros; com --base_dir mede outra cópia do código (ex.: um git worktree).
+# Uso: python benchmarks/bench_startup.py --runs 20 [--base_dir /tmp/versao_anterior/huawei]
+
+DEFAULT_RESULTS_FILE = os.path.join(BENCH_DIR, "results", "startup_history.jsonl")
+HEAVY_MODULES = ("requests", "urllib3", "psycopg2", "sqlite3", "asyncio", "ijson")
+
+# Cenários: código executado no processo novo ({base_dir} e {url_base} preenchidos na execução)
+SCENARIOS = {
+    "interpreter": "pass",
+    "import": "import api_manager",
+    "help": ("import runpy\nsys.argv = ['api_manager.py', '--endpoint_name', 'get_alarms', '--help']\n"
+             "runpy.run_path(os.path.join({base_dir!r}, 'api_manager.py'), run_name='__main__')"),
+    # Chamada avulsa com saída em arquivo (token MSP já gravado em config/token.json pelo aquecimento)
+    "call_file": ("import api_manager\n"
+                  "api_manager.output_config['get_devices_msp'] = {{'type': 'file', 'file_settings': "
+                  "{{'base_path': 'output', 'file_name_template': 'devices.json'}}}}\n"
+                  "sys.exit(0 if api_manager.make_api_call('get_devices_msp', {url_base!r}, 'bench', 'bench', "
+                  "api_manager.execution_id) else 3)"),
+    # Página de get_tenants ainda válida no cache de respostas: nem token nem requisição
+    "call_cached": ("import api_manager\n"
+                    "api_manager.output_config['get_tenants'] = {{'type': 'file', 'file_settings': "
+                    "{{'base_path': 'output', 'file_name_template': 'tenants.json'}}}}\n"
+                    "sys.exit(0 if api_manager.make_api_call('get_tenants', {url_base!r}, 'bench', 'bench', "
+                    "api_manager.execution_id) else 3)"),
+}
+
+# Envolve o cenário: caminho do código e, na execução de sondagem, o registro dos módulos carregados ao sair
+PROBE_TEMPLATE = """import os, sys, json, atexit
+sys.path.insert(0, {base_dir!r})
+def _probe():
+    if {probe!r}:
+        with open({probe!r}, 'w') as file:
+            json.dump({{'modules': len(sys.modules), 'heavy': [name for name in {heavy!r} if name in sys.modules]}}, file)
+atexit.register(_probe)
+{body}
+"""
+
+# Função para executar um cenário uma vez em um processo novo; devolve (segundos, código de saída)
+def run_once(code, workdir):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    seconds = time.perf_counter() - started
+    if result.returncode != 0:
+        print(result.stderr[-2000:], file=sys.stderr)
+    return seconds, result.returncode
+
+def run_scenario(name, base_dir, url_base, workdir, runs):
+    body = SCENARIOS[name].format(base_dir=base_dir, url_base=url_base)
+    code = PROBE_TEMPLATE.format(base_dir=base_dir, probe="", heavy=HEAVY_MODULES, body=body)
+    run_once(code, workdir)  # aquecimento
+    timings, failures = [], 0
+    for _ in range(runs):
+        seconds, returncode = run_once(code, workdir)
+        timings.append(seconds)
+        failures += returncode != 0
+    probe_path = os.path.join(workdir, "probe.json")
+    run_once(PROBE_TEMPLATE.format(base_dir=base_dir, probe=probe_path, heavy=HEAVY_MODULES, body=body), workdir)
+    with open(probe_path, encoding="utf-8") as file:
+        probe = json.load(file)
+    return {
+        "scenario": name,
+        "ok": failures == 0,
+        "min_ms": round(min(timings) * 1000, 1),
+        "median_ms": round(statistics.median(timings) * 1000, 1),
+        "modules": probe["modules"],
+        "heavy_modules": probe["heavy"],
+    }
+
+def print_report(run, previous):
+    baseline = {r["scenario"]: r for r in (previous or {}).get("results", [])}
+    print(f"Revisão {run['git_revision']}, {run['params']}")
+    if previous:
+        print(f"Comparado com {previous['git_revision']} de {previous['timestamp']}")
+    for result in run["results"]:
+        line = (f"{result['scenario']:12} {'OK' if result['ok'] else 'FALHA':5} min={result['min_ms']:>7.1f}ms "
+                f"mediana={result['median_ms']:>7.1f}ms módulos={result['modules']:<5} pesados={','.join(result['heavy_modules']) or '-'}")
+        before = baseline.get(result["scenario"])
+        if before and before.get("median_ms"):
+            line += f"  ({(result['median_ms'] / before['median_ms'] - 1) * 100:+.1f}% mediana)"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do tempo de inicialização de invocações avulsas do api_manager.py")
+    parser.add_argument('--runs', type=int, default=20, help="Execuções medidas por cenário")
+    parser.add_argument('--scenarios', default=",".join(SCENARIOS), help="Cenários medidos (use vírgula para separar valores)")
+    parser.add_argument('--base_dir', default=BASE_DIR, help="Diretório do código medido (padrão: esta cópia)")
+    parser.add_argument('--results', default=DEFAULT_RESULTS_FILE, help="Arquivo JSONL com o histórico de resultados")
+    parser.add_argument('--label', default="", help="Rótulo livre da execução (ex.: nome da máquina)")
+    args = parser.parse_args()
+
+    base_dir = os.path.abspath(args.base_dir)
+    results_file = os.path.abspath(args.results)
+
+    # Tokens, logs, cache de respostas e arquivos de saída ficam em um diretório temporário (caminhos relativos ao cwd)
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    os.makedirs(os.path.join(workdir, "config"))
+    for config_file in ("endpoints_config.json", "output_handler_config.json", "log_config.json"):
+        os.symlink(os.path.join(base_dir, "config", config_file), os.path.join(workdir, "config", config_file))
+    from mock_nce import MockNCE, start_server
+
+    server, url_base = start_server(MockNCE(5, 5, 0))
+    run = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "label": args.label,
+        "params": {"runs": args.runs, "scenarios": args.scenarios, "base_dir": base_dir},
+        "results": [],
+    }
+    try:
+        for name in args.scenarios.split(","):
+            run["results"].append(run_scenario(name, base_dir, url_base, workdir, args.runs))
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    previous = previous_run(results_file, run["params"])
+    os.makedirs(os.path.dirname(results_file), exist_ok=True)
+    with open(results_file, "a", encoding="utf-8") as file:
+        file.write(json.dumps(run) + "\n")
+    print_report(run, previous)
+    print(f"Resultado acrescentado a {results_file}")
@@ -0,0 +1,273 @@
+import os
+import sys
+import copy
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Controlador NCE simulado para benchmarks: implementa os endpoints do endpoints_config.json
+# (tokens MSP e de tenant, tenants, devices/msp/query, alarm-list com marker e network/link)
+# com N tenants x M dispositivos x K alarmes sintéticos, latência configurável e injeção de erros.
+# Uso isolado: python benchmarks/mock_nce.py --port 8443 --tenants 20 --devices 50 --alarms 5000
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN_TTL = timedelta(minutes=30)
+
+# Função para carregar os caminhos dos endpoints a partir da configuração do coletor
+def load_endpoint_paths():
+    with open(os.path.join(BASE_DIR, "config", "endpoints_config.json"), encoding="utf-8") as file:
+        endpoints = json.load(file)["endpoints"]
+    return {name: endpoint["endpoint"] for name, endpoint in endpoints.items()}
+
+# Função para carregar o primeiro item de um arquivo de amostra (alarms_output/, devices_output/), usado como modelo
+def load_sample_item(directory, response_key):
+    path = os.path.join(BASE_DIR, directory)
+    for file_name in sorted(os.listdir(path)):
+        with open(os.path.join(path, file_name), encoding="utf-8") as file:
+            items = json.load(file).get(response_key) or []
+        if items:
+            return items[0]
+    raise ValueError(f"Nenhum item de amostra em {path}")
+
+# Dados sintéticos e comportamento do controlador simulado
+class MockNCE:
+    def __init__(self, tenants=10, devices=20, alarms=1000, links=None, latency=0.0, latency_jitter=0.0,
+                 error_rate=0.0, capacity=0, seed=42):
+        self.tenant_count = tenants
+        self.device_count = devices
+        self.alarm_count = alarms
+        self.link_count = devices if links is None else links
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        # Capacidade do controlador (requisições/s); acima dela, responde 429 com Retry-After (0 = sem limite)
+        self.capacity = capacity
+        self.capacity_window = [0, 0]  # [segundo atual, requisições no segundo]
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.paths = load_endpoint_paths()
+        self.alarm_template = load_sample_item("alarms_output", "alarm")
+        self.device_template = load_sample_item("devices_output", "data")
+        self.tenant_ids = [uuid.UUID(int=seed * 10**6 + t).hex for t in range(tenants)]
+        self.tenant_index = {tenant_id: t for t, tenant_id in enumerate(self.tenant_ids)}
+        self.tokens = {}  # token -> tenantId (None para o token MSP)
+        self.tokens_lock = threading.Lock()
+        # Alarmes espalhados nas últimas 24 horas, para caírem na janela inicial da coleta incremental
+        self.base_time = datetime.now(timezone.utc).replace(microsecond=0)
+        self.stats = {"requests": 0, "errors_injected": 0, "throttled": 0, "bytes_sent": 0, "not_modified": 0}
+        self.stats_lock = threading.Lock()
+
+    def issue_token(self, tenant_id=None):
+        token = uuid.uuid4().hex
+        with self.tokens_lock:
+            self.tokens[token] = tenant_id
+        return token, (datetime.now(timezone.utc) + TOKEN_TTL).strftime("%Y-%m-%d %H:%M:%S")
+
+    def tenant_for(self, token):
+        with self.tokens_lock:
+            if token not in self.tokens:
+                raise PermissionError("token inválido")
+            return self.tokens[token]
+
+    def roll(self):
+        with self.random_lock:
+            return self.random.random()
+
+    def delay(self):
+        if self.latency or self.latency_jitter:
+            time.sleep(max(0.0, self.latency + (self.roll() * 2 - 1) * self.latency_jitter))
+
+    def tenant(self, t):
+        return {"tenantId": self.tenant_ids[t], "tenantName": f"TENANT_{t:04d}", "description": "", "createTime": "2024-09-05 12:00:00"}
+
+    def device(self, t, d):
+        device = copy.deepcopy(self.device_template)
+        device.update({
+            "id": str(uuid.UUID(int=(t + 1) * 10**7 + d)),
+            "name": f"DEV_{t:04d}_{d:05d}",
+            "esn": f"ESN{t:04d}{d:08d}",
+            "tenantId": self.tenant_ids[t],
+            "tenantName": f"TENANT_{t:04d}",
+            "status": ("0", "1", "3")[d % 3],
+        })
+        return device
+
+    def alarm_age(self, k):
+        # Alarmes mais novos primeiro: o alarme k foi criado alarm_age(k) segundos antes de base_time
+        return k * 86400 // max(self.alarm_count, 1)
+
+    def alarm(self, t, k):
+        alarm = copy.deepcopy(self.alarm_template)
+        created = (self.base_time - timedelta(seconds=self.alarm_age(k))).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        alarm["time-created"] = created
+        alarm["alarm-parameters"].update({
+            "alarm-serial-number": self.alarm_serial(t, k),
+            "tenant-id": self.tenant_ids[t],
+            "tenant": f"TENANT_{t:04d}",
+        })
+        alarm["resource-alarm-parameters"].update({
+            "is-cleared": k % 4 == 0,
+            "perceived-severity": ("critical", "major", "minor", "warning")[k % 4],
+            "last-changed": created,
+        })
+        return alarm
+
+    def alarm_serial(self, t, k):
+        return f"{t + 1:04d}{k:08d}"
+
+    def link(self, t, n):
+        link_id = str(uuid.UUID(int=(t + 1) * 10**8 + n))
+        return {
+            "id": link_id,
+            "linkdn": f"link={link_id}",
+            "linkName": f"LINK_{t:04d}_{n:05d}",
+            "tenantId": self.tenant_ids[t],
+            "srcDeviceId": str(uuid.UUID(int=(t + 1) * 10**7 + n % max(self.device_count, 1))),
+            "dstDeviceId": str(uuid.UUID(int=(t + 1) * 10**7 + (n + 1) % max(self.device_count, 1))),
+            "linkType": "WAN",
+            "status": "UP" if n % 5 else "DOWN",
+        }
+
+    def page_index(self, total, page_index, page_size, build):
+        start = (page_index - 1) * page_size
+        return {"errcode": "0", "errmsg": "", "pageIndex": page_index, "pageSize": page_size, "totalRecords": total,
+                "data": [build(position) for position in range(start, min(start + page_size, total))]}
+
+    # Função para responder a uma requisição: devolve (status, corpo JSON)
+    def handle(self, method, path, query, body, token):
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            if self.capacity:
+                second = int(time.monotonic())
+                if self.capacity_window[0] != second:
+                    self.capacity_window[:] = [second, 0]
+                self.capacity_window[1] += 1
+                if self.capacity_window[1] > self.capacity:
+                    self.stats["throttled"] += 1
+                    return 429, {"errcode": "429", "errmsg": "limite de requisições excedido"}
+        self.delay()
+        if self.error_rate and self.roll() < self.error_rate:
+            with self.stats_lock:
+                self.stats["errors_injected"] += 1
+            return 503, {"errcode": "503", "errmsg": "erro injetado pelo controlador simulado"}
+
+        if method == "POST" and path == self.paths["get_token"]:
+            token, expired = self.issue_token()
+            return 200, {"errcode": "0", "errmsg": "", "data": {"token_id": token, "expiredDate": expired}}
+        try:
+            tenant_id = self.tenant_for(token)
+        except PermissionError:
+            return 401, {"errcode": "401", "errmsg": "token inválido"}
+
+        if method == "POST" and path == self.paths["get_tenant_token"]:
+            token, expired = self.issue_token(body["identity"]["assumeRole"]["tenantId"])
+            return 200, {"data": {"tokenId": token, "expiredDate": expired}}
+
+        page_index = int(query.get("pageIndex", body.get("pageIndex", 1)))
+        page_size = int(query.get("pageSize", body.get("pageSize", 100)))
+        if method == "GET" and path == self.paths["get_tenants"]:
+            return 200, self.page_index(self.tenant_count, page_index, page_size, self.tenant)
+
+        if method == "POST" and path == self.paths["get_devices_msp"]:
+            wanted = body.get("tenantIdList") or self.tenant_ids
+            tenants = [self.tenant_index[tid] for tid in wanted if tid in self.tenant_index]
+            total = len(tenants) * self.device_count
+            return 200, self.page_index(total, page_index, page_size,
+                                        lambda n: self.device(tenants[n // self.device_count], n % self.device_count))
+
+        t = self.tenant_index.get(tenant_id)
+        if t is None:
+            return 403, {"errcode": "403", "errmsg": "operação exige token de tenant"}
+
+        if method == "GET" and path == self.paths["get_network_link"]:
+            return 200, self.page_index(self.link_count, page_index, page_size, lambda n: self.link(t, n))
+
+        if method == "GET" and path == self.paths["get_alarms"]:
+            limit = int(query.get("limit", 1000))
+            marker = query.get("marker")
+            first = int(marker[4:]) + 1 if marker else 0
+            last = self.alarm_count
+            if query.get("start-time"):
+                # Janela da coleta incremental: só os alarmes criados a partir de start-time
+                start = datetime.fromisoformat(query["start-time"].replace("Z", "+00:00"))
+                window = (self.base_time - start).total_seconds()
+                last = next((k for k in range(self.alarm_count) if self.alarm_age(k) > window), self.alarm_count)
+            return 200, {"alarm": [self.alarm(t, k) for k in range(first, min(first + limit, last))]}
+
+        return 404, {"errcode": "404", "errmsg": f"endpoint {path} não implementado"}
+
+# Handler HTTP que repassa as requisições ao MockNCE do servidor
+class MockNCEHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else {}
+        status, payload = self.server.nce.handle(method, url.path, query, body, self.headers.get("X-ACCESS-TOKEN"))
+        content = json.dumps(payload).encode("utf-8")
+        # Respostas GET levam ETag; com If-None-Match igual, o corpo não é reenviado (304)
+        etag = f'"{hashlib.sha1(content).hexdigest()}"' if method == "GET" and status == 200 else None
+        if etag and self.headers.get("If-None-Match") == etag:
+            status, content = 304, b""
+        with self.server.nce.stats_lock:
+            self.server.nce.stats["bytes_sent"] += len(content)
+            if status == 304:
+                self.server.nce.stats["not_modified"] += 1
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+# Função para iniciar o controlador simulado em uma thread; devolve (servidor, url_base)
+def start_server(nce, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), MockNCEHandler)
+    server.daemon_threads = True
+    server.nce = nce
+    threading.Thread(target=server.serve_forever, name="mock-nce", daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Controlador NCE simulado para benchmarks")
+    parser.add_argument('--host', default="127.0.0.1", help="Endereço de escuta")
+    parser.add_argument('--port', type=int, default=8443, help="Porta de escuta")
+    parser.add_argument('--tenants', type=int, default=10, help="Número de tenants")
+    parser.add_argument('--devices', type=int, default=20, help="Dispositivos por tenant")
+    parser.add_argument('--alarms', type=int, default=1000, help="Alarmes por tenant")
+    parser.add_argument('--latency', type=float, default=0.0, help="Latência fixa por requisição (s)")
+    parser.add_argument('--latency_jitter', type=float, default=0.0, help="Variação máxima da latência (s)")
+    parser.add_argument('--error_rate', type=float, default=0.0, help="Fração das requisições respondidas com 503")
+    parser.add_argument('--capacity', type=int, default=0, help="Requisições/s aceitas antes de responder 429 (0 = sem limite)")
+    args = parser.parse_args()
+
+    nce = MockNCE(args.tenants, args.devices, args.alarms, latency=args.latency,
+                  latency_jitter=args.latency_jitter, error_rate=args.error_rate, capacity=args.capacity)
+    server, url_base = start_server(nce, args.host, args.port)
+    print(f"Controlador simulado em {url_base} (use --url_base {url_base})", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"Estatísticas: {nce.stats}", file=sys.stderr)
@@ -0,0 +1,222 @@
+import argparse
+import sys
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import logging_config
+import metrics
+from api_manager import make_api_call, iter_api_pages, resolve_output_handler, export_metrics
+from db_pool import all_pool_stats
+from rate_limiter import all_limiter_stats, share_among_processes
+from access_manager import token_manager
+from watermarks import is_incremental, make_incremental_call
+from device_sync import tenant_batch_settings, sync_tenant_batches
+from pipeline import IngestionPipeline, load_pipeline_settings
+from spool import replay_spools
+from sharding import get_coordinator
+import response_cache
+
+# Carregar a configuração de log para o coletor
+logger = logging_config.load_log_config('collector')
+
+# Endpoints coletados por tenant em cada varredura
+DEFAULT_TENANT_ENDPOINTS = ["get_alarms", "get_network_link", "get_devices_msp"]
+
+# Argumentos extras por endpoint para restringir a chamada ao tenant atual
+TENANT_SCOPED_ARGS = {
+    "get_devices_msp": lambda tenant_id: {"tenantIdList": [tenant_id]},
+}
+
+EXECUTORS = {
+    "thread": ThreadPoolExecutor,
+    "process": ProcessPoolExecutor,
+}
+
+# Função para listar os IDs de todos os tenants via get_tenants, salvando cada página no handler configurado
+# (com o cache de respostas, processos que rodam em seguida reaproveitam a lista sem chamar o controlador)
+def list_tenant_ids(url_base, username, password, execution_id):
+    output_handler = resolve_output_handler("get_tenants", execution_id)
+    if output_handler is None:
+        raise RuntimeError(f"[UUID: {execution_id}] Output handler indisponível para get_tenants")
+    tenant_ids = []
+    for page_number, page, page_kwargs in iter_api_pages("get_tenants", url_base, username, password, execution_id):
+        if response_cache.needs_save(page) and output_handler.save("get_tenants", page, tenant_id="", execution_id=execution_id,
+                                                                    response_key="data", page=page_number, **page_kwargs) is None:
+            response_cache.discard(page)
+        tenant_ids.extend(tenant["tenantId"] for tenant in page.get("data", []) if tenant.get("tenantId"))
+    return tenant_ids
+
+# Função executada pelos workers: coleta todos os endpoints de um tenant
+def collect_tenant(tenant_id, endpoints, url_base, username, password, execution_id, incremental=True, pipeline=None):
+    result = {"tenant_id": tenant_id, "endpoints": {}, "elapsed": 0.0}
+    started = time.monotonic()
+
+    for endpoint_name in endpoints:
+        extra_args = TENANT_SCOPED_ARGS.get(endpoint_name, lambda _: {})(tenant_id)
+        try:
+            if incremental and is_incremental(endpoint_name, execution_id):
+                response = make_incremental_call(endpoint_name, url_base, username, password, execution_id,
+                                                 tenant_id, pipeline=pipeline, **extra_args)
+            else:
+                response = make_api_call(endpoint_name, url_base, username, password, execution_id,
+                                         tenant_id=tenant_id, paginate=True, pipeline=pipeline, **extra_args)
+            result["endpoints"][endpoint_name] = "ok" if response else "erro na resposta"
+        # access_manager encerra com sys.exit em falhas de token; não pode derrubar o worker
+        except (Exception, SystemExit) as e:
+            logger.error(f"[UUID: {execution_id}] Falha no tenant {tenant_id}, endpoint {endpoint_name}: {e!r}")
+            logger.debug(traceback.format_exc())
+            result["endpoints"][endpoint_name] = f"exceção: {e!r}"
+
+    result["ok"] = all(status == "ok" for status in result["endpoints"].values())
+    result["elapsed"] = time.monotonic() - started
+    return result
+
+# Versão de collect_tenant para o executor de processos: devolve junto as métricas do worker, somadas no processo principal
+def collect_tenant_in_process(*args):
+    result = collect_tenant(*args)
+    result["metrics"] = metrics.registry.drain()
+    return result
+
+# Função para acrescentar ao resultado de um tenant o status dos endpoints coletados em lote
+def merge_batch_results(result, batch_results):
+    for endpoint_name, endpoint_results in batch_results.items():
+        batch_result = endpoint_results.get(result["tenant_id"], {"status": "tenant ausente dos lotes", "elapsed": 0.0})
+        result["endpoints"][endpoint_name] = batch_result["status"]
+        result["ok"] = result["ok"] and batch_result["status"] == "ok"
+        result["elapsed"] = max(result["elapsed"], batch_result["elapsed"])
+    return result
+
+# Função para varrer todos os tenants em um pool limitado de workers
+def run_sweep(url_base, username, password, execution_id, endpoints=None, tenant_ids=None,
+              max_workers=8, executor_type="thread", incremental=True, batch=True, use_pipeline=True, replay=True,
+              sharding=True):
+    endpoints = endpoints or DEFAULT_TENANT_ENDPOINTS
+    if executor_type not in EXECUTORS:
+        raise ValueError(f"Tipo de executor {executor_type} desconhecido")
+
+    # Páginas guardadas no spool em varreduras anteriores (banco fora do ar) são gravadas antes das novas
+    if replay:
+        replay_spools(execution_id)
+
+    # Com vários coletores (ver sharding.py), cada nó coleta só os tenants do seu trecho do anel com lease obtido
+    coordinator = get_coordinator() if sharding else None
+    sweep_started = time.monotonic()
+
+    if tenant_ids is None:
+        tenant_ids = list_tenant_ids(url_base, username, password, execution_id)
+    if coordinator is not None:
+        tenant_ids = coordinator.claim(tenant_ids, execution_id)
+    logger.info(f"[UUID: {execution_id}] Iniciando varredura de {len(tenant_ids)} tenants com {max_workers} workers ({executor_type})")
+
+    # Endpoints com "tenant_batch" (ex.: get_devices_msp) são coletados em lotes de tenants, fora do loop por tenant
+    batched = [endpoint for endpoint in endpoints if batch and tenant_batch_settings(endpoint, execution_id)]
+    per_tenant = [endpoint for endpoint in endpoints if endpoint not in batched]
+    batch_results = {endpoint: sync_tenant_batches(endpoint, tenant_ids, url_base, username, password, execution_id)
+                     for endpoint in batched}
+
+    results = []
+    if not per_tenant:
+        # Só endpoints em lote: nada a distribuir entre os workers
+        results = [merge_batch_results({"tenant_id": tenant_id, "endpoints": {}, "ok": True, "elapsed": 0.0}, batch_results)
+                   for tenant_id in tenant_ids]
+        failed = [result["tenant_id"] for result in results if not result["ok"]]
+        logger.info("[UUID: %s] Lotes concluídos: %d tenants, %d com falha %s", execution_id, len(results), len(failed), failed)
+    else:
+        worker = collect_tenant_in_process if executor_type == "process" else collect_tenant
+        # Pipeline de gravação compartilhado pelos workers de busca (só entre threads; cada processo grava sozinho)
+        pipeline_settings = load_pipeline_settings()
+        pipeline = None
+        if use_pipeline and executor_type == "thread" and pipeline_settings["enabled"]:
+            pipeline = IngestionPipeline(execution_id, pipeline_settings)
+            pipeline.start()
+        try:
+            # Cada processo tem seus próprios limitadores de taxa: o limite configurado é dividido entre os workers
+            executor_kwargs = {"initializer": share_among_processes, "initargs": (max_workers,)} if executor_type == "process" else {}
+            with EXECUTORS[executor_type](max_workers=max_workers, **executor_kwargs) as executor:
+                futures = {
+                    executor.submit(worker, tenant_id, per_tenant, url_base, username, password, execution_id, incremental,
+                                    pipeline): tenant_id
+                    for tenant_id in tenant_ids
+                }
+                for future in as_completed(futures):
+                    tenant_id = futures[future]
+                    try:
+                        result = future.result()
+                    except BaseException as e:
+                        # Falha no próprio worker (ex.: processo encerrado)
+                        result = {"tenant_id": tenant_id, "endpoints": {}, "ok": False, "error": repr(e), "elapsed": 0.0}
+                    if "metrics" in result:
+                        metrics.registry.merge(result.pop("metrics"))
+                    results.append(merge_batch_results(result, batch_results))
+                    logger.info("[UUID: %s] Tenant %s: %s %s", execution_id, tenant_id, 'OK' if result['ok'] else 'FALHA', result['endpoints'])
+        finally:
+            if pipeline is not None:
+                pipeline.close()
+
+    if coordinator is not None:
+        coordinator.record_sweep(time.monotonic() - sweep_started)
+
+    # Com executor de processos, cada worker tem seus próprios pools; aqui ficam só os do processo principal
+    for name, stats in all_pool_stats().items():
+        logger.info(f"[UUID: {execution_id}] Pool {name}: {stats}")
+    logger.info(f"[UUID: {execution_id}] Tokens: {token_manager.stats()}")
+    for name, stats in all_limiter_stats().items():
+        logger.info(f"[UUID: {execution_id}] Limitador {name}: {stats}")
+    return results
+
+if __name__ == "__main__":
+    execution_id = str(uuid.uuid4())
+    parser = argparse.ArgumentParser(description="Coletar todos os tenants da API Huawei NCE em um único processo")
+    parser.add_argument('--username', required=True, help="Username para autenticação")
+    parser.add_argument('--password', required=True, help="Password para autenticação")
+    parser.add_argument('--url_base', required=True, help="URL base da API")
+    parser.add_argument('--endpoints', default=",".join(DEFAULT_TENANT_ENDPOINTS),
+                        help="Endpoints coletados por tenant (use vírgula para separar valores)")
+    parser.add_argument('--tenant_ids', help="Lista fixa de tenants, sem consultar get_tenants (use vírgula para separar valores)")
+    parser.add_argument('--workers', type=int, default=8, help="Número máximo de workers simultâneos")
+    parser.add_argument('--executor', choices=sorted(EXECUTORS), default="thread", help="Tipo de pool de workers")
+    parser.add_argument('--full', action='store_true', help="Ignorar os watermarks e coletar o histórico completo dos endpoints incrementais")
+    parser.add_argument('--per_tenant', action='store_true', help="Coletar também os endpoints com tenant_batch um tenant por vez")
+    parser.add_argument('--no_pipeline', action='store_true', help="Gravar cada página no próprio worker de busca, sem o pipeline de ingestão")
+    parser.add_argument('--no_replay', action='store_true', help="Não drenar o spool de páginas não gravadas antes da varredura")
+    parser.add_argument('--no_sharding', action='store_true', help="Coletar todos os tenants mesmo com a divisão entre nós coletores ligada na configuração")
+    parser.add_argument('--node_id', help="Identificador deste nó coletor na divisão de tenants (padrão: hostname)")
+    args = parser.parse_args()
+
+    try:
+        started = time.monotonic()
+        if not args.no_sharding:
+            get_coordinator(args.node_id)
+        results = run_sweep(
+            args.url_base,
+            args.username,
+            args.password,
+            execution_id,
+            endpoints=args.endpoints.split(","),
+            tenant_ids=args.tenant_ids.split(",") if args.tenant_ids else None,
+            max_workers=args.workers,
+            executor_type=args.executor,
+            incremental=not args.full,
+            batch=not args.per_tenant,
+            use_pipeline=not args.no_pipeline,
+            replay=not args.no_replay,
+            sharding=not args.no_sharding,
+        )
+    except Exception as e:
+        logger.error(f"[UUID: {execution_id}] Erro ao executar a varredura: {str(e)}")
+        logger.error(traceback.format_exc())
+        export_metrics(execution_id)
+        sys.exit(3)
+    export_metrics(execution_id)
+
+    results.sort(key=lambda r: r["tenant_id"])
+    failed = [result for result in results if not result["ok"]]
+    for result in results:
+        details = result.get("error") or ", ".join(f"{name}={outcome}" for name, outcome in result["endpoints"].items())
+        print(f"{result['tenant_id']}\t{'OK' if result['ok'] else 'FALHA'}\t{result['elapsed']:.2f}s\t{details}")
+    print(f"Tenants: {len(results)}, sucesso: {len(results) - len(failed)}, falha: {len(failed)}, "
+          f"tempo total: {time.monotonic() - started:.2f}s")
+
+    sys.exit(3 if failed else 0)
@@ -1,54 +1,209 @@
+import io
+import re
+import sys
+import csv
+import bz2
+import gzip
+import json
+import lzma
+import time
 import psycopg2
+import psycopg2.extras
 import argparse
 
-# Função para executar a consulta no PostgreSQL
-def executar_consulta(host, port, database, user, password, query):
-    try:
-        # Conectar ao banco de dados
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            database=database,
-            user=user,
-            password=password
-        )
+# Formatos de saída: tuple (print de cada linha, como antes), csv, ndjson e copy (COPY ... TO STDOUT em CSV, feito pelo servidor)
+FORMATOS = ("tuple", "csv", "ndjson", "copy")
+
+# Compressão do arquivo de destino, escolhida pela extensão (ou por --compressao)
+COMPRESSOES = {"gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+
+# Comandos que podem ser lidos por um cursor nomeado (DECLARE ... CURSOR FOR); os demais usam um cursor comum
+CONSULTA_STREAMING = re.compile(r"^\s*(SELECT|WITH|VALUES|TABLE)\b", re.IGNORECASE)
+
+# Valor JSON/JSONB mantido como o texto recebido do servidor (evita decodificar e serializar de novo na exportação)
+class JsonBruto(str):
+    pass
+
+# Stream que conta os bytes escritos (antes da compressão) e repassa ao destino
+class ContadorBytes(io.RawIOBase):
+    def __init__(self, destino):
+        self.destino = destino
+        self.bytes = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self.destino.write(dados)
+        self.bytes += len(dados)
+        return len(dados)
+
+    def flush(self):
+        self.destino.flush()
+
+# Acompanha linhas e bytes exportados e informa o progresso no stderr
+class Progresso:
+    def __init__(self, contador, intervalo):
+        self.contador = contador
+        self.intervalo = intervalo
+        self.linhas = 0
+        self.inicio = time.perf_counter()
+
+    def linha(self):
+        self.linhas += 1
+        if self.intervalo and self.linhas % self.intervalo == 0:
+            self.informar()
+
+    def informar(self, final=False):
+        decorrido = time.perf_counter() - self.inicio
+        taxa = self.linhas / decorrido if decorrido else 0
+        prefixo = "Concluído" if final else "Progresso"
+        print(f"{prefixo}: {self.linhas} linhas em {decorrido:.1f}s ({taxa:.0f} linhas/s), "
+              f"{self.contador.bytes / 2**20:.1f} MB escritos", file=sys.stderr)
+
+# Função para abrir o destino (stdout ou arquivo, comprimido ou não) como stream binário
+def abrir_destino(destino, compressao=None):
+    if not destino or destino == "-":
+        return sys.stdout.buffer, False
+    abrir = COMPRESSOES.get(compressao or next((ext for ext in COMPRESSOES if destino.endswith(f".{ext}")), None), open)
+    return abrir(destino, "wb"), True
 
-        # Criar o cursor para executar comandos
-        cursor = conn.cursor()
+# Função para converter um valor em texto para CSV (JSON como JSON, NULL como campo vazio)
+def valor_csv(valor):
+    if valor is None or isinstance(valor, str):
+        return valor
+    if isinstance(valor, (dict, list)):
+        return json.dumps(valor, ensure_ascii=False)
+    return valor
 
-        # Executar a query
-        cursor.execute(query)
+# Função para serializar um valor em NDJSON (JSON bruto do servidor é copiado sem nova decodificação)
+def valor_json(valor):
+    if isinstance(valor, JsonBruto):
+        return valor
+    return json.dumps(valor, ensure_ascii=False, default=str)
 
-        # Obter os resultados
-        rows = cursor.fetchall()
+def escrever_tuple(cursor, saida, progresso, cabecalho):
+    for row in cursor:
+        saida.write(f"{row}\n")
+        progresso.linha()
 
-        # Exibir os resultados
-        for row in rows:
-            print(row)
+def escrever_csv(cursor, saida, progresso, cabecalho):
+    writer = csv.writer(saida)
+    linhas = iter(cursor)
+    # Em cursores nomeados, description só existe depois da primeira leitura
+    primeira = next(linhas, None)
+    if cabecalho and cursor.description:
+        writer.writerow([coluna.name for coluna in cursor.description])
+    if primeira is None:
+        return
+    writer.writerow([valor_csv(valor) for valor in primeira])
+    progresso.linha()
+    for row in linhas:
+        writer.writerow([valor_csv(valor) for valor in row])
+        progresso.linha()
 
-        # Fechar o cursor e a conexão
+def escrever_ndjson(cursor, saida, progresso, cabecalho):
+    chaves = None
+    for row in cursor:
+        if chaves is None:
+            chaves = [json.dumps(coluna.name) for coluna in cursor.description]
+        saida.write("{" + ",".join(f"{chave}:{valor_json(valor)}" for chave, valor in zip(chaves, row)) + "}\n")
+        progresso.linha()
+
+ESCRITORES = {"tuple": escrever_tuple, "csv": escrever_csv, "ndjson": escrever_ndjson}
+
+# Função para executar a consulta no PostgreSQL e exportar o resultado sem carregá-lo inteiro na memória
+def executar_consulta(host, port, database, user, password, query, params=None, formato="tuple", destino=None,
+                      compressao=None, itersize=10000, cabecalho=True, intervalo_progresso=100000):
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato {formato} desconhecido, use um de {FORMATOS}")
+    conn = None
+    arquivo, fechar = abrir_destino(destino, compressao)
+    contador = ContadorBytes(arquivo)
+    progresso = Progresso(contador, intervalo_progresso)
+    try:
+        # Conectar ao banco de dados (somente leitura: a exportação nunca altera dados)
+        conn = psycopg2.connect(host=host, port=port, database=database, user=user, password=password)
+        conn.set_session(readonly=True)
+        saida_binaria = io.BufferedWriter(contador, buffer_size=1024 * 1024)
+
+        if formato == "copy":
+            # COPY não aceita parâmetros: a consulta é montada com os valores escapados pelo próprio psycopg2
+            cursor = conn.cursor()
+            consulta = cursor.mogrify(query, params).decode("utf-8") if params else query
+            header = "HEADER" if cabecalho else ""
+            cursor.copy_expert(f"COPY ({consulta.rstrip().rstrip(';')}) TO STDOUT WITH (FORMAT csv {header and ', ' + header})",
+                               saida_binaria)
+            progresso.linhas = max(cursor.rowcount, 0)
+        else:
+            if formato != "tuple":
+                # JSON/JSONB chegam como texto e são repassados sem decodificar
+                psycopg2.extras.register_default_json(conn, loads=JsonBruto)
+                psycopg2.extras.register_default_jsonb(conn, loads=JsonBruto)
+            if CONSULTA_STREAMING.match(query):
+                # Cursor nomeado: o servidor entrega o resultado em lotes de itersize linhas
+                cursor = conn.cursor(name="consulta_exportacao")
+                cursor.itersize = itersize
+            else:
+                cursor = conn.cursor()
+            cursor.execute(query, params)
+            saida = io.TextIOWrapper(saida_binaria, encoding="utf-8", newline="")
+            ESCRITORES[formato](cursor, saida, progresso, cabecalho)
+            saida.flush()
+            saida.detach()
+
+        saida_binaria.flush()
         cursor.close()
-        conn.close()
+        progresso.informar(final=True)
+        return {"linhas": progresso.linhas, "bytes": contador.bytes, "segundos": time.perf_counter() - progresso.inicio}
+    finally:
+        if fechar:
+            arquivo.close()
+        if conn is not None:
+            conn.close()
 
-    except Exception as e:
-        print(f"Erro ao executar a consulta: {e}")
+# Função para converter os --param nome=valor no dicionário usado pelos placeholders %(nome)s
+def ler_parametros(pares):
+    parametros = {}
+    for par in pares or []:
+        nome, separador, valor = par.partition("=")
+        if not separador:
+            raise argparse.ArgumentTypeError(f"Parâmetro inválido '{par}', use nome=valor")
+        parametros[nome] = valor
+    return parametros or None
 
 # Configuração do argparse para aceitar todos os parâmetros via linha de comando
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Executar consultas no PostgreSQL via parâmetros.")
-    
+
     # Parâmetros de conexão
     parser.add_argument("--host", required=True, help="Endereço do servidor PostgreSQL")
     parser.add_argument("--port", required=True, help="Porta do servidor PostgreSQL")
     parser.add_argument("--database", required=True, help="Nome do banco de dados")
     parser.add_argument("--user", required=True, help="Usuário do PostgreSQL")
     parser.add_argument("--password", required=True, help="Senha do PostgreSQL")
-    
+
     # Parâmetro para a query
-    parser.add_argument("--query", required=True, help="Consulta SQL a ser executada")
+    parser.add_argument("--query", required=True, help="Consulta SQL a ser executada (placeholders no formato %%(nome)s)")
+    parser.add_argument("--param", action="append", help="Valor de um placeholder, no formato nome=valor (pode repetir)")
+
+    # Parâmetros da exportação
+    parser.add_argument("--formato", choices=FORMATOS, default="tuple", help="Formato da saída")
+    parser.add_argument("--saida", help="Arquivo de destino (padrão: stdout); .gz, .bz2 e .xz são comprimidos")
+    parser.add_argument("--compressao", choices=sorted(COMPRESSOES), help="Compressão do arquivo, independente da extensão")
+    parser.add_argument("--itersize", type=int, default=10000, help="Linhas buscadas por lote no cursor do servidor")
+    parser.add_argument("--sem_cabecalho", action="store_true", help="Não escrever a linha de cabeçalho (csv e copy)")
+    parser.add_argument("--progresso", type=int, default=100000, help="Informar o progresso a cada N linhas (0 desliga)")
 
     # Parse dos argumentos
     args = parser.parse_args()
 
     # Executar a consulta com os parâmetros fornecidos
-    executar_consulta(args.host, args.port, args.database, args.user, args.password, args.query)
+    try:
+        executar_consulta(args.host, args.port, args.database, args.user, args.password, args.query,
+                          params=ler_parametros(args.param), formato=args.formato, destino=args.saida,
+                          compressao=args.compressao, itersize=args.itersize, cabecalho=not args.sem_cabecalho,
+                          intervalo_progresso=args.progresso)
+    except Exception as e:
+        print(f"Erro ao executar a consulta: {e}", file=sys.stderr)
+        sys.exit(1)
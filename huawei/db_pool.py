@@ -0,0 +1,208 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Pools compartilhados pelo processo, indexados pelo nome do banco em output_handler_config.json
+_pools = {}
+_pools_lock = threading.Lock()
+
+class PoolTimeout(Exception):
+    """Nenhuma conexão ficou disponível dentro do acquire_timeout."""
+
+# Pool de conexões PostgreSQL com limites, verificação de saúde e descarte de conexões ociosas
+# (psycopg2 só é importado ao abrir ou verificar conexões: importar o coletor não depende dele)
+class ConnectionPool:
+    def __init__(self, dsn, name=None, min_size=1, max_size=5, idle_timeout=300,
+                 health_check_interval=30, acquire_timeout=30):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"Tamanhos de pool inválidos: min_size={min_size}, max_size={max_size}")
+        self.dsn = dsn
+        self.name = name or "default"
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._idle = deque()  # (conexão, instante em que voltou ao pool)
+        self._size = 0        # conexões abertas (ociosas + em uso + sendo criadas)
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "acquisitions": 0,
+            "acquire_wait_total": 0.0,
+            "acquire_wait_max": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "closed": 0,
+            "health_check_failures": 0,
+        }
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._stats["closed"] += 1
+
+    def _evict_idle(self):
+        # Chamado com o lock adquirido: fecha as conexões ociosas há mais de idle_timeout, mantendo min_size
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._close(conn)
+
+    def _is_healthy(self, conn, idle_since):
+        import psycopg2
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.acquire_timeout
+        while True:
+            with self._cond:
+                self._evict_idle()
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"Pool {self.name}: nenhuma conexão disponível em {self.acquire_timeout}s "
+                                          f"({self._in_use} em uso, máximo {self.max_size})")
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    # LIFO: reutiliza a conexão mais recente, deixando as antigas expirarem
+                    conn, idle_since = self._idle.pop()
+                else:
+                    conn, idle_since = None, None
+                    self._size += 1  # reserva a vaga antes de conectar fora do lock
+
+            if conn is None:
+                try:
+                    import psycopg2
+                    conn = psycopg2.connect(self.dsn)
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._stats["created"] += 1
+            elif not self._is_healthy(conn, idle_since):
+                logging.warning(f"Pool {self.name}: conexão ociosa falhou na verificação de saúde, descartando.")
+                with self._cond:
+                    self._size -= 1
+                    self._stats["health_check_failures"] += 1
+                    self._close(conn)
+                    self._cond.notify()
+                continue
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self._in_use += 1
+                self._stats["acquisitions"] += 1
+                self._stats["acquire_wait_total"] += waited
+                self._stats["acquire_wait_max"] = max(self._stats["acquire_wait_max"], waited)
+            return conn
+
+    def release(self, conn, discard=False):
+        import psycopg2
+        from psycopg2 import extensions
+        if not discard and not conn.closed:
+            try:
+                # Nunca devolver ao pool uma conexão com transação aberta
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed:
+                self._size -= 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._evict_idle()
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, discard=conn.closed)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                "name": self.name,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "size": self._size,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            })
+        stats["acquire_wait_avg"] = stats["acquire_wait_total"] / stats["acquisitions"] if stats["acquisitions"] else 0.0
+        return stats
+
+    def close_all(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                self._close(conn)
+
+# Função para obter (ou criar) o pool compartilhado de um banco configurado
+def get_pool(db_name, dsn, **settings):
+    with _pools_lock:
+        pool = _pools.get(db_name)
+        if pool is None:
+            pool = ConnectionPool(dsn, name=db_name, **settings)
+            _pools[db_name] = pool
+            logging.info(f"Pool de conexões criado para {db_name}: {settings}")
+        return pool
+
+# Função para obter as estatísticas de todos os pools do processo
+def all_pool_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.name: pool.stats() for pool in pools}
+
+# Função para fechar todas as conexões ociosas de todos os pools
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+# Após um fork, o filho não pode usar nem fechar as conexões herdadas do pai (fechar encerraria a sessão do pai)
+_inherited_pools = []
+
+def _reset_pools_after_fork():
+    global _pools_lock
+    _inherited_pools.append(dict(_pools))
+    _pools.clear()
+    _pools_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
@@ -0,0 +1,114 @@
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import logging_config
+import metrics
+import response_cache
+from api_manager import get_endpoint_config, iter_api_pages, resolve_output_handler
+from output_handler import FileOutputHandler, get_nested_field
+
+# Carregar a configuração de log para a sincronização em lote
+logger = logging_config.load_log_config('device_sync')
+
+# Sincronização em lote de endpoints que aceitam uma lista de tenants (ex.: get_devices_msp com tenantIdList):
+# em vez de uma chamada por tenant, os tenants são agrupados em lotes de chunk_size, cada lote é paginado
+# normalmente e os itens de cada página são separados de volta por tenant para a gravação e as métricas.
+# Configuração no endpoints_config.json, na chave "tenant_batch" do endpoint:
+#   {"param": "tenantIdList", "chunk_size": 100, "tenant_field": "tenantId", "workers": 2}
+
+DEFAULT_TENANT_BATCH_SETTINGS = {
+    "param": "tenantIdList",   # parâmetro (array) do corpo com a lista de tenants
+    "chunk_size": 100,         # tenants por chamada, respeitando o limite do controlador
+    "tenant_field": "tenantId",
+    "workers": 2               # lotes buscados em paralelo
+}
+
+# Função para obter a configuração de lote de um endpoint; None se ele não for sincronizado em lote
+def tenant_batch_settings(endpoint_name, execution_id):
+    settings = get_endpoint_config(endpoint_name, execution_id).get("tenant_batch")
+    if not settings or not settings.get("enabled", True):
+        return None
+    return {**DEFAULT_TENANT_BATCH_SETTINGS, **settings}
+
+# Função para dividir a lista de tenants em lotes de até size tenants
+def chunk_tenants(tenant_ids, size):
+    return [tenant_ids[start:start + size] for start in range(0, len(tenant_ids), size)]
+
+# Função para separar os itens de uma página pelo tenant de cada item, mantendo a ordem
+def split_by_tenant(items, tenant_field):
+    groups = {}
+    for item in items:
+        groups.setdefault(get_nested_field(item, tenant_field), []).append(item)
+    return groups
+
+# Função para buscar e gravar um lote de tenants; devolve os itens recebidos por tenant
+def sync_chunk(endpoint_name, chunk, settings, url_base, username, password, execution_id):
+    output_handler = resolve_output_handler(endpoint_name, execution_id)
+    if output_handler is None:
+        raise RuntimeError(f"[UUID: {execution_id}] Output handler indisponível para {endpoint_name}")
+    response_key = get_endpoint_config(endpoint_name, execution_id).get("response_key", "data")
+    # O handler de arquivo grava um arquivo por tenant (como nas chamadas individuais); o de banco grava a página inteira
+    split_storage = isinstance(output_handler, FileOutputHandler)
+    counts = {tenant_id: 0 for tenant_id in chunk}
+    tenant_pages = {}
+
+    for page_number, page, page_kwargs in iter_api_pages(endpoint_name, url_base, username, password, execution_id,
+                                                         **{settings["param"]: chunk}):
+        # A página (no máximo page_size itens) é materializada: os itens são usados na separação e na gravação
+        items = list(page.get(response_key) or [])
+        groups = split_by_tenant(items, settings["tenant_field"])
+        for tenant_id, tenant_items in groups.items():
+            counts[tenant_id] = counts.get(tenant_id, 0) + len(tenant_items)
+            metrics.inc("tenant_items_total", len(tenant_items), endpoint=endpoint_name, tenant=tenant_id)
+        if not response_cache.needs_save(page):
+            # Página vinda do cache de respostas: já gravada quando foi recebida
+            continue
+        if not split_storage:
+            if output_handler.save(endpoint_name, {**page, response_key: items}, tenant_id="", execution_id=execution_id,
+                                   response_key=response_key, page=page_number, **page_kwargs) is None:
+                response_cache.discard(page)
+                raise RuntimeError(f"[UUID: {execution_id}] Falha ao gravar a página {page_number} de {endpoint_name}")
+            continue
+        for tenant_id, tenant_items in groups.items():
+            # Cada tenant tem sua própria numeração de páginas (um tenant pode aparecer em várias páginas do lote)
+            tenant_pages[tenant_id] = tenant_pages.get(tenant_id, 0) + 1
+            tenant_kwargs = {**page_kwargs, settings["param"]: [tenant_id or ""]}
+            if output_handler.save(endpoint_name, {**page, response_key: tenant_items}, tenant_id=tenant_id or "", execution_id=execution_id,
+                                   response_key=response_key, page=tenant_pages[tenant_id], **tenant_kwargs) is None:
+                response_cache.discard(page)
+                raise RuntimeError(f"[UUID: {execution_id}] Falha ao gravar a página {page_number} de {endpoint_name} (tenant {tenant_id})")
+    return counts
+
+# Função para sincronizar um endpoint em lote para todos os tenants; devolve {tenant_id: resultado}
+def sync_tenant_batches(endpoint_name, tenant_ids, url_base, username, password, execution_id, settings=None):
+    settings = settings or tenant_batch_settings(endpoint_name, execution_id) or DEFAULT_TENANT_BATCH_SETTINGS
+    chunks = chunk_tenants(list(tenant_ids), settings["chunk_size"])
+    logger.info("[UUID: %s] %s: %d tenants em %d lotes de até %d", execution_id, endpoint_name, len(tenant_ids),
+                len(chunks), settings["chunk_size"])
+
+    results, started = {}, time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, min(settings["workers"], len(chunks) or 1))) as executor:
+        futures = {executor.submit(sync_chunk, endpoint_name, chunk, settings, url_base, username, password, execution_id): chunk
+                   for chunk in chunks}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                counts = future.result()
+                status = "ok"
+            # access_manager encerra com sys.exit em falhas de token; não pode derrubar a varredura
+            except (Exception, SystemExit) as e:
+                logger.error("[UUID: %s] Falha no lote de %d tenants de %s: %r", execution_id, len(chunk), endpoint_name, e)
+                logger.debug(traceback.format_exc())
+                counts, status = {tenant_id: 0 for tenant_id in chunk}, f"exceção: {e!r}"
+            for tenant_id, items in counts.items():
+                if tenant_id not in chunk:
+                    # Itens de tenants fora do lote (ou sem tenantId): contabilizados, mas sem resultado próprio
+                    logger.warning("[UUID: %s] %s: %d itens do tenant %r fora do lote", execution_id, endpoint_name, items, tenant_id)
+                    continue
+                results[tenant_id] = {"status": status, "items": items, "elapsed": time.monotonic() - started}
+
+    total = sum(result["items"] for result in results.values())
+    failed = sum(1 for result in results.values() if result["status"] != "ok")
+    logger.info("[UUID: %s] %s: %d itens de %d tenants, %d tenants com falha", execution_id, endpoint_name, total, len(results), failed)
+    return results
@@ -0,0 +1,147 @@
+import os
+import json
+import threading
+from collections import namedtuple
+from collections.abc import Mapping
+from types import MappingProxyType
+
+# Registro dos endpoints do endpoints_config.json, lido e validado uma vez por processo (e de novo só se o arquivo
+# mudar em disco, ex.: scheduler em execução contínua). Cada endpoint vira um objeto imutável e compacto (__slots__)
+# com método, caminho, headers e listas de parâmetros já prontos, em vez de um dict relido a cada chamada e a cada
+# token. Para o código que lê o endpoint como dict (endpoint_config.get("pagination")), o objeto também é um Mapping
+# somente leitura. As demais chaves do arquivo (http, pipeline, metrics, ...) vêm de load_endpoints_config().
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'endpoints_config.json')
+
+METHODS = ("GET", "POST")
+TOKEN_TYPES = (None, "msp", "tenant")
+PARAM_TYPES = ("string", "int", "int64", "boolean", "array")
+PAGINATION_TYPES = ("page_index", "marker")
+
+# Parâmetro de URL ou de corpo de um endpoint
+Param = namedtuple("Param", ("name", "type", "required", "description"))
+
+# Função para congelar a configuração de um endpoint (dicts somente leitura, listas como tuplas)
+def freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+# Função para listar os problemas de configuração de um endpoint (lista vazia se estiver válido)
+def validate_endpoint(name, config):
+    problems = []
+    if config.get("method") not in METHODS:
+        problems.append(f"{name}: method deve ser um de {METHODS}")
+    if not str(config.get("endpoint", "")).startswith("/"):
+        problems.append(f"{name}: endpoint deve ser um caminho iniciado por /")
+    if config.get("token_type") not in TOKEN_TYPES:
+        problems.append(f"{name}: token_type {config.get('token_type')} desconhecido")
+    for kind in ("url_params", "body_params"):
+        for param in config.get(kind, []):
+            if "name" not in param or param.get("type") not in PARAM_TYPES:
+                problems.append(f"{name}: {kind} {param.get('name')} sem nome ou com tipo fora de {PARAM_TYPES}")
+    pagination = config.get("pagination")
+    if pagination and pagination.get("type") not in PAGINATION_TYPES:
+        problems.append(f"{name}: pagination.type deve ser um de {PAGINATION_TYPES}")
+    return problems
+
+class Endpoint(Mapping):
+    __slots__ = ("name", "method", "path", "token_type", "response_key", "timeout", "stream", "pagination",
+                 "url_params", "body_params", "url_param_names", "body_param_names", "array_params",
+                 "static_headers", "templated_headers", "config")
+
+    def __init__(self, name, config):
+        frozen = freeze(config)
+        url_params = tuple(Param(p["name"], p["type"], p.get("required", False), p.get("description", ""))
+                           for p in config.get("url_params", []))
+        body_params = tuple(Param(p["name"], p["type"], p.get("required", False), p.get("description", ""))
+                            for p in config.get("body_params", []))
+        headers = config.get("headers", {})
+        values = {
+            "name": name,
+            "method": config["method"],
+            "path": config["endpoint"],
+            "token_type": config.get("token_type"),
+            "response_key": config.get("response_key", "data"),
+            "timeout": frozen.get("timeout"),
+            "stream": config.get("stream", False),
+            "pagination": frozen.get("pagination"),
+            "url_params": url_params,
+            "body_params": body_params,
+            "url_param_names": tuple(param.name for param in url_params),
+            "body_param_names": tuple(param.name for param in body_params),
+            "array_params": tuple(param.name for param in body_params if param.type == "array"),
+            # Só os headers com placeholders ({token}) são formatados a cada requisição
+            "static_headers": MappingProxyType({k: v for k, v in headers.items() if not (isinstance(v, str) and "{" in v)}),
+            "templated_headers": tuple((k, v) for k, v in headers.items() if isinstance(v, str) and "{" in v),
+            "config": frozen,
+        }
+        for slot, value in values.items():
+            object.__setattr__(self, slot, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Endpoint {self.name} é somente leitura")
+
+    def __getitem__(self, key):
+        return self.config[key]
+
+    def __iter__(self):
+        return iter(self.config)
+
+    def __len__(self):
+        return len(self.config)
+
+    def __repr__(self):
+        return f"Endpoint({self.name!r}, {self.method} {self.path})"
+
+    # Headers da requisição, com os placeholders preenchidos (ex.: token=...)
+    def headers(self, **values):
+        headers = dict(self.static_headers)
+        for key, template in self.templated_headers:
+            headers[key] = template.format(**values)
+        return headers
+
+class EndpointRegistry:
+    __slots__ = ("endpoints", "config", "signature")
+
+    def __init__(self, config, signature=None):
+        problems = [problem for name, endpoint in config.get("endpoints", {}).items() for problem in validate_endpoint(name, endpoint)]
+        if problems:
+            raise ValueError(f"Configuração de endpoints inválida: {'; '.join(problems)}")
+        self.endpoints = MappingProxyType({name: Endpoint(name, endpoint) for name, endpoint in config.get("endpoints", {}).items()})
+        self.config = config
+        self.signature = signature
+
+    def get(self, name):
+        return self.endpoints.get(name)
+
+_registry = None
+_registry_lock = threading.Lock()
+
+# Função para identificar a versão do arquivo em disco (o registro é refeito se ela mudar)
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+# Função para obter o registro do processo, lendo o arquivo só na primeira vez ou quando ele muda
+def get_registry():
+    global _registry
+    signature = file_signature(CONFIG_PATH)
+    registry = _registry
+    if registry is not None and registry.signature == signature:
+        return registry
+    with _registry_lock:
+        if _registry is None or _registry.signature != signature:
+            with open(CONFIG_PATH, 'r', encoding='utf-8') as file:
+                _registry = EndpointRegistry(json.load(file), signature)
+        return _registry
+
+# Função para carregar a configuração de endpoints (compartilhada pelo processo: somente leitura)
+def load_endpoints_config():
+    return get_registry().config
+
+# Função para obter um endpoint do registro; None se não existir
+def get_endpoint(name):
+    return get_registry().get(name)
@@ -0,0 +1,125 @@
+import os
+import time
+import logging
+import threading
+from collections.abc import Mapping
+
+import rate_limiter
+from endpoint_registry import load_endpoints_config
+
+# Configuração padrão da camada HTTP; pode ser sobrescrita pela chave "http" do endpoints_config.json
+DEFAULT_HTTP_SETTINGS = {
+    "pool_connections": 4,       # número de hosts distintos mantidos em cache
+    "pool_maxsize": 32,          # conexões keep-alive por host; deve acompanhar o número de workers
+    "pool_block": False,
+    "gzip": True,
+    "timeout": {"connect": 5, "read": 60},
+    "retries": {
+        "total": 3,
+        "connect": 3,
+        "read": 2,
+        "status": 3,
+        "backoff_factor": 0.5,
+        "status_forcelist": [500, 502, 503, 504],
+        "allowed_methods": ["GET", "POST"]
+    }
+}
+
+# Função para montar a base das URLs: sem esquema explícito, o controlador é acessado via HTTPS
+# (com esquema, ex.: http://127.0.0.1:8443, usado pelo controlador simulado dos benchmarks)
+def build_base_url(url_base):
+    return url_base.rstrip("/") if "://" in url_base else f"https://{url_base}"
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_settings = None
+
+# Função para carregar as configurações HTTP, mescladas com os valores padrão
+def load_http_settings():
+    global _settings
+    if _settings is None:
+        custom = load_endpoints_config().get("http", {})
+        settings = {**DEFAULT_HTTP_SETTINGS, **custom}
+        settings["timeout"] = {**DEFAULT_HTTP_SETTINGS["timeout"], **custom.get("timeout", {})}
+        settings["retries"] = {**DEFAULT_HTTP_SETTINGS["retries"], **custom.get("retries", {})}
+        _settings = settings
+    return _settings
+
+# Função para criar uma sessão com pool de conexões keep-alive e política de retry
+# (requests/urllib3 só são importados aqui, na primeira requisição do processo)
+def build_session(settings):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # Retry que não repete respostas 429 por conta própria: com o limitador de taxa ativo, o 429 volta para
+    # request(), que pausa o limitador do controlador inteiro (e não só a thread que recebeu a resposta)
+    class ThrottleAwareRetry(Retry):
+        RETRY_AFTER_STATUS_CODES = frozenset(Retry.RETRY_AFTER_STATUS_CODES - {429})
+
+    retry_settings = settings["retries"]
+    retry_class = ThrottleAwareRetry if rate_limiter.load_rate_limit_settings().get("enabled", True) else Retry
+    retry = retry_class(
+        total=retry_settings["total"],
+        connect=retry_settings["connect"],
+        read=retry_settings["read"],
+        status=retry_settings["status"],
+        backoff_factor=retry_settings["backoff_factor"],
+        status_forcelist=retry_settings["status_forcelist"],
+        allowed_methods=frozenset(retry_settings["allowed_methods"]),
+        raise_on_status=False,  # devolve a última resposta para que o chamador registre o erro
+    )
+    adapter = HTTPAdapter(
+        pool_connections=settings["pool_connections"],
+        pool_maxsize=settings["pool_maxsize"],
+        pool_block=settings["pool_block"],
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate" if settings["gzip"] else "identity"
+    return session
+
+# Função para obter a sessão compartilhada pelo processo (recriada após um fork)
+def get_session():
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = build_session(load_http_settings())
+            _session_pid = os.getpid()
+            logging.info(f"Sessão HTTP criada (pid {_session_pid})")
+        return _session
+
+# Função para converter o timeout configurado (dict ou número) na tupla (connect, read) do requests
+def resolve_timeout(timeout=None):
+    default = load_http_settings()["timeout"]
+    if timeout is None:
+        timeout = default
+    if isinstance(timeout, Mapping):
+        return (timeout.get("connect", default["connect"]), timeout.get("read", default["read"]))
+    return timeout
+
+# Função para fazer uma requisição pela sessão compartilhada, sempre com timeout
+# Com rate_limit (tipo de token: "msp" ou "tenant"), a requisição passa pelo limitador do controlador;
+# respostas 429 pausam o limitador pelo Retry-After e a requisição é repetida até max_throttle_retries vezes
+def request(method, url, timeout=None, rate_limit=None, **kwargs):
+    limiter = rate_limiter.get_limiter(url, rate_limit) if rate_limit else None
+    if limiter is None:
+        return get_session().request(method, url, timeout=resolve_timeout(timeout), **kwargs)
+
+    from requests.exceptions import RequestException
+    for attempt in range(limiter.settings["max_throttle_retries"] + 1):
+        limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = get_session().request(method, url, timeout=resolve_timeout(timeout), **kwargs)
+        except RequestException:
+            limiter.release(None, time.perf_counter() - started)
+            raise
+        # Com stream=True, a vaga é liberada ao receber os cabeçalhos
+        limiter.release(response.status_code, time.perf_counter() - started, rate_limiter.parse_retry_after(response.headers.get("Retry-After")))
+        if response.status_code != 429 or attempt == limiter.settings["max_throttle_retries"]:
+            return response
+        response.close()
@@ -0,0 +1,86 @@
+from collections.abc import Iterator
+
+# Dependência opcional: sem o ijson, as respostas são decodificadas por completo com response.json()
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Tamanho dos blocos lidos da resposta e entregues ao parser
+CHUNK_SIZE = 64 * 1024
+
+# Função para indicar se a decodificação incremental está disponível
+def streaming_available():
+    return ijson is not None
+
+# Página de resposta decodificada de forma incremental: os itens de response_key são montados pelo backend do
+# ijson (em C, quando disponível) e produzidos em blocos, sem materializar o documento inteiro. Campos
+# de primeiro nível pedidos em meta_keys (ex.: totalRecords, marker) só ficam completos após a leitura da lista.
+class StreamedPage(dict):
+    def __init__(self, raw, response_key, meta_keys=(), on_close=None, chunk_size=CHUNK_SIZE):
+        super().__init__()
+        self.response_key = response_key
+        self.meta_keys = set(meta_keys)
+        self.count = 0
+        self.first_item = None
+        self.last_item = None
+        self._raw = raw
+        self._chunk_size = chunk_size
+        self._on_close = on_close
+        self._items = self._iter_items()
+        self[response_key] = self._items
+
+    def _track(self, items):
+        if self.count == 0:
+            self.first_item = items[0]
+        self.last_item = items[-1]
+        self.count += len(items)
+
+    def _iter_items(self):
+        items = ijson.sendable_list()
+        coroutines = [ijson.items_coro(items, f"{self.response_key}.item", use_float=True)]
+        # Cada campo de primeiro nível pedido usa um parser próprio sobre os mesmos blocos (também montado em C)
+        meta = {key: ijson.sendable_list() for key in self.meta_keys}
+        coroutines += [ijson.items_coro(values, key, use_float=True) for key, values in meta.items()]
+        try:
+            while True:
+                chunk = self._raw.read(self._chunk_size)
+                for coroutine in coroutines:
+                    if chunk:
+                        coroutine.send(chunk)
+                    else:
+                        coroutine.close()
+                for key, values in meta.items():
+                    if values:
+                        self[key] = values[-1]
+                if items:
+                    self._track(items)
+                    yield from items
+                    del items[:]
+                if not chunk:
+                    break
+        finally:
+            self.close()
+
+    def drain(self):
+        # Consome o restante do fluxo (itens não lidos e campos finais) e libera a conexão
+        for _ in self._items:
+            pass
+        self.close()
+
+    def close(self):
+        if self._on_close is not None:
+            self._on_close()
+            self._on_close = None
+
+# Função para resumir os itens de uma página (lista comum ou StreamedPage já consumida)
+def page_items_summary(page, response_key):
+    if isinstance(page, StreamedPage):
+        page.drain()
+        return page.count, page.first_item, page.last_item
+    items = page.get(response_key) or []
+    return len(items), (items[0] if items else None), (items[-1] if items else None)
+
+# Função para indicar se o valor é um iterador de itens (e não uma lista já materializada)
+def is_item_stream(value):
+    return isinstance(value, Iterator)
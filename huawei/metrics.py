@@ -0,0 +1,350 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Prefixo de todas as métricas exportadas
+PREFIX = "nce_collector"
+
+# Limites (em segundos) dos buckets dos histogramas de latência
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Descrição das métricas, usada nas linhas # HELP do arquivo do textfile collector
+METRIC_HELP = {
+    "token_seconds": "Tempo para obter um token (source: cache, wait, file ou network)",
+    "http_request_seconds": "Duração das requisições HTTP ao controlador",
+    "decode_seconds": "Tempo de decodificação do JSON das respostas",
+    "save_seconds": "Tempo de gravação de uma página pelo output handler",
+    "commit_seconds": "Duração do COMMIT no banco de dados",
+    "http_response_bytes_total": "Bytes recebidos do controlador",
+    "items_total": "Itens recebidos nas respostas",
+    "pages_total": "Páginas recebidas",
+    "rows_written_total": "Linhas gravadas no banco (result: inserted, updated, unchanged)",
+    "errors_total": "Erros por fase (token, http, decode, save)",
+    "throttled_total": "Respostas de throttling (429, ou 503 com Retry-After) por limitador",
+    "rate_limit_wait_seconds": "Espera por uma vaga no limitador de taxa",
+    "rate_limit_adjustments_total": "Ajustes AIMD do limitador de taxa (direction: up ou down)",
+    "tenant_items_total": "Itens por tenant recebidos nas coletas em lote (tenant_batch)",
+    "pipeline_stage_seconds": "Latência por estágio do pipeline de ingestão (stage: enqueue_wait, queued, write)",
+    "pipeline_queue_depth": "Páginas aguardando gravação na fila do pipeline",
+    "pipeline_queue_depth_max": "Maior profundidade da fila do pipeline na execução",
+    "pipeline_batches_total": "Gravações em lote do pipeline (várias páginas por comando)",
+    "pipeline_pages_total": "Páginas gravadas pelo pipeline (result: ok ou error)",
+    "alarm_events_total": "Transições de estado de alarmes gravadas (event: raised, cleared, reraised, acked, unacked, severity, changed)",
+    "spool_records_total": "Páginas no spool local (result: spooled, replayed, rejected pelo banco no replay ou full com o spool cheio)",
+    "spool_items_total": "Itens guardados no spool local por falha na gravação no banco",
+    "spool_items_replayed_total": "Itens do spool local gravados no banco pelo replay",
+    "spool_bytes": "Tamanho em bytes dos segmentos do spool local",
+    "spool_replay_seconds": "Duração do replay do spool local",
+    "response_cache_total": "Consultas ao cache de respostas (result: hit, revalidated ou miss)",
+    "response_cache_evictions_total": "Páginas removidas do cache de respostas pelo limite de tamanho (LRU)",
+    "response_cache_bytes": "Tamanho em bytes das páginas guardadas no cache de respostas",
+    "shard_nodes": "Nós coletores vivos no anel de hash",
+    "shard_tenants": "Tenants do nó (state: assigned no trecho do anel, leased com lease obtido)",
+    "shard_sweep_seconds": "Duração das varreduras do nó coletor",
+    "shard_claim_errors_total": "Falhas ao obter os leases de tenants (a varredura usa a última divisão conhecida)",
+    "alarm_rollup_rows_total": "Linhas das tabelas de rollup de alarmes atualizadas na ingestão",
+    "alarm_retention_rows_total": "Linhas removidas pela retenção das tabelas de alarmes e de eventos",
+    "alarm_retention_partitions_total": "Partições antigas e vazias de alarmes removidas pela retenção",
+}
+
+# Histograma cumulativo no formato do Prometheus
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def merge(self, data):
+        for position, count in enumerate(data["counts"]):
+            self.counts[position] += count
+        self.sum += data["sum"]
+        self.count += data["count"]
+
+    def as_dict(self):
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+# Registro de contadores e histogramas do processo, por nome e rótulos
+class MetricsRegistry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.per_tenant = True
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def _key(self, name, labels):
+        # O rótulo de tenant pode ser desligado para limitar a cardinalidade com muitos tenants
+        if not self.per_tenant:
+            labels.pop("tenant", None)
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                "histograms": [[name, list(labels), histogram.as_dict()] for (name, labels), histogram in self._histograms.items()],
+                "gauges": [[name, list(labels), value] for (name, labels), value in self._gauges.items()],
+            }
+
+    def drain(self):
+        # Devolve as métricas acumuladas e zera o registro (usado pelos workers em processos separados)
+        data = self.snapshot()
+        self.reset()
+        return data
+
+    def merge(self, data):
+        with self._lock:
+            for name, labels, value in data["counters"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                self._counters[key] = self._counters.get(key, 0) + value
+            for name, labels, histogram_data in data["histograms"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(histogram_data["buckets"])
+                histogram.merge(histogram_data)
+            # Gauges guardam o último valor informado
+            for name, labels, value in data.get("gauges", []):
+                self._gauges[(name, tuple(tuple(label) for label in labels))] = value
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._gauges.clear()
+            self.started_at = time.time()
+
+    def render_prometheus(self):
+        # Formato de exposição de texto do Prometheus, lido pelo textfile collector do node_exporter
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda entry: entry[0])
+            histograms = [(key, histogram.as_dict()) for key, histogram in histograms]
+            gauges = sorted(self._gauges.items())
+
+        lines, declared = [], set()
+        for (name, labels), value in counters:
+            metric = f"{PREFIX}_{name}"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# HELP {metric} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{label_text(labels)} {value}")
+        for (name, labels), value in gauges:
+            metric = f"{PREFIX}_{name}"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# HELP {metric} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric}{label_text(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            metric = f"{PREFIX}_{name}"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# HELP {metric} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                cumulative += count
+                lines.append(f"{metric}_bucket{label_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{metric}_bucket{label_text(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{metric}_sum{label_text(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{metric}_count{label_text(labels)} {histogram['count']}")
+        lines.append(f"# TYPE {PREFIX}_last_export_timestamp_seconds gauge")
+        lines.append(f"{PREFIX}_last_export_timestamp_seconds {time.time():.3f}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, execution_id):
+        # Resumo da execução: totais por nome e rótulos e, por histograma, latência média e p95 aproximado
+        data = self.snapshot()
+        histograms = []
+        for name, labels, histogram in data["histograms"]:
+            histograms.append({
+                "name": name,
+                "labels": dict(labels),
+                "count": histogram["count"],
+                "sum_seconds": round(histogram["sum"], 6),
+                "avg_seconds": round(histogram["sum"] / histogram["count"], 6) if histogram["count"] else None,
+                "p95_upper_bound": percentile_bound(histogram, 0.95),
+            })
+        return {
+            "execution_id": execution_id,
+            "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "duration_seconds": round(time.time() - self.started_at, 3),
+            "counters": [{"name": name, "labels": dict(labels), "value": value} for name, labels, value in data["counters"]],
+            "gauges": [{"name": name, "labels": dict(labels), "value": value} for name, labels, value in data["gauges"]],
+            "histograms": histograms,
+        }
+
+# Função para estimar o limite superior do bucket que contém o percentil pedido
+def percentile_bound(histogram, quantile):
+    if not histogram["count"]:
+        return None
+    target, cumulative = quantile * histogram["count"], 0
+    for bound, count in zip(histogram["buckets"], histogram["counts"]):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return "+Inf"
+
+# Função para gravar um arquivo de forma atômica (o textfile collector nunca lê um arquivo pela metade)
+def write_atomic(path, content):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_metrics_")
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write(content)
+        # mkstemp cria o arquivo com modo 0600; o node_exporter costuma rodar com outro usuário e precisa lê-lo
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+# Registro compartilhado pelo processo
+registry = MetricsRegistry()
+
+# Atalhos para o registro compartilhado
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+def observe(name, seconds, **labels):
+    registry.observe(name, seconds, **labels)
+
+def set_gauge(name, value, **labels):
+    registry.set_gauge(name, value, **labels)
+
+def timer(name, **labels):
+    return registry.timer(name, **labels)
+
+# Função para aplicar a configuração "metrics" do endpoints_config.json
+def configure(metrics_config):
+    registry.per_tenant = metrics_config.get("per_tenant", True)
+    if "buckets" in metrics_config:
+        registry.buckets = tuple(metrics_config["buckets"])
+
+# Função para obter o arquivo do textfile collector do script em execução: cada script (api_manager, collector,
+# async_collector, scheduler) grava o seu, sem sobrescrever as métricas dos outros
+def textfile_path(metrics_config, script=None):
+    textfile = metrics_config.get("textfile", "metrics/nce_collector_{script}.prom")
+    script = script or os.path.splitext(os.path.basename(sys.argv[0]))[0] or "python"
+    if "{script}" not in textfile:
+        root, extension = os.path.splitext(textfile)
+        textfile = f"{root}_{{script}}{extension}"
+    return textfile.format(script=script)
+
+# Função para somar as métricas do processo às acumuladas pelas execuções anteriores do script (estado em JSON ao lado
+# do .prom), sob lock: execuções avulsas (cron) concorrentes não perdem os valores umas das outras e os contadores
+# não voltam a zero a cada execução. Histogramas gravados com outros buckets (configuração alterada) recomeçam.
+def accumulate(textfile):
+    import fcntl
+    state_path = f"{os.path.splitext(textfile)[0]}.json"
+    os.makedirs(os.path.dirname(textfile) or ".", exist_ok=True)
+    with open(f"{textfile}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            merged = MetricsRegistry(registry.buckets)
+            try:
+                with open(state_path) as state_file:
+                    state = json.load(state_file)
+                buckets = list(registry.buckets)
+                state["histograms"] = [entry for entry in state["histograms"] if entry[2]["buckets"] == buckets]
+                merged.merge(state)
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+            merged.merge(registry.snapshot())
+            write_atomic(state_path, json.dumps(merged.snapshot()))
+            write_atomic(textfile, merged.render_prometheus())
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# Função para remover os resumos de execução mais antigos que summary_retention_days
+def prune_summaries(summary_dir, retention_days):
+    cutoff = time.time() - retention_days * 86400
+    removed = 0
+    for entry in os.scandir(summary_dir):
+        if entry.name.endswith(".json") and entry.is_file() and entry.stat().st_mtime < cutoff:
+            try:
+                os.unlink(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+# Função para exportar as métricas: arquivo .prom do textfile collector e resumo JSON da execução.
+# cumulative=True (daemon): o registro já acumula desde o início do processo e o arquivo é reescrito com ele;
+# nas execuções avulsas, as métricas da execução são somadas às das anteriores (ver accumulate)
+def export(metrics_config, execution_id, summary=True, cumulative=False):
+    if not metrics_config.get("enabled", True):
+        return None
+    textfile = textfile_path(metrics_config)
+    if cumulative:
+        write_atomic(textfile, registry.render_prometheus())
+    else:
+        accumulate(textfile)
+    summary_path = None
+    summary_dir = metrics_config.get("summary_dir", "metrics/runs")
+    if summary and summary_dir:
+        summary_path = os.path.join(summary_dir, f"{execution_id}.json")
+        write_atomic(summary_path, json.dumps(registry.summary(execution_id), indent=4, default=str))
+        prune_summaries(summary_dir, metrics_config.get("summary_retention_days", 7))
+    return summary_path
+
+# Após um fork, o processo filho começa com o registro vazio (os valores do pai já estão no pai)
+def _reset_after_fork():
+    registry._lock = threading.Lock()
+    registry.reset()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,8 +1,19 @@
 import os
+import io
+import csv
 import json
+import hashlib
 import logging
-import psycopg2
+import threading
+import time
+from itertools import islice
+from collections import OrderedDict
+from contextlib import contextmanager
 from urllib.parse import quote_plus
+from json_stream import is_item_stream
+from spool import SpoolFull, DatabaseUnavailable, get_spool, replay_spools
+from alarm_rollups import RollupAccumulator, rollup_settings
+import metrics
 import traceback
 
 # Handler para salvar em arquivos
@@ -12,96 +23,744 @@ class FileOutputHandler:
         self.file_name_template = file_name_template
     
     def save(self, endpoint, data, **kwargs):
+        started = time.perf_counter()
         try:
             valid_kwargs = {k: (','.join(v) if isinstance(v, list) else v) if v is not None else '' for k, v in kwargs.items()}
             file_name = self.file_name_template.format(**valid_kwargs).replace("__", "_").strip("_")
+            # Em chamadas paginadas, cada página a partir da segunda vai para um arquivo próprio
+            page = kwargs.get("page")
+            if page and page > 1:
+                root, ext = os.path.splitext(file_name)
+                file_name = f"{root}_page{page}{ext}"
             filename = os.path.join(self.base_path, file_name)
 
             os.makedirs(self.base_path, exist_ok=True)
 
             with open(filename, 'w') as outfile:
-                json.dump(data, outfile, indent=4)
+                response_key = kwargs.get("response_key", "data")
+                if is_item_stream(data.get(response_key)):
+                    self.dump_stream(data, response_key, outfile)
+                else:
+                    json.dump(data, outfile, indent=4)
 
-            logging.info(f"Arquivo salvo em: {filename}")
+            logging.info("Arquivo salvo em: %s", filename)
+            metrics.observe("save_seconds", time.perf_counter() - started, endpoint=endpoint, tenant=kwargs.get("tenant_id") or None, handler="file")
+            return filename
         except Exception as e:
+            metrics.inc("errors_total", phase="save", endpoint=endpoint, handler="file")
             logging.error(f"Erro ao salvar o arquivo: {e}")
             logging.error(traceback.format_exc())
+            return None
+
+    def dump_stream(self, data, response_key, outfile):
+        # Grava os itens à medida que são decodificados; os demais campos só ficam completos após a lista
+        outfile.write(f"{{\n    {json.dumps(response_key)}: [")
+        for position, item in enumerate(data[response_key]):
+            outfile.write(",\n        " if position else "\n        ")
+            json.dump(item, outfile)
+        outfile.write("\n    ]")
+        for key, value in data.items():
+            if key != response_key:
+                outfile.write(f",\n    {json.dumps(key)}: {json.dumps(value)}")
+        outfile.write("\n}\n")
+
+# Função para dividir uma sequência (lista ou iterador) em lotes de até size itens
+def iter_chunks(items, size):
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+# Itens de uma página em streaming repassados ao gravador, guardando uma cópia (até max_items) para o spool: se a
+# gravação falhar, a página é remontada com os itens já lidos e o restante da resposta
+class ItemTee:
+    def __init__(self, items, max_items):
+        self.source = iter(items)
+        self.max_items = max_items
+        self.buffer = []
+        self.overflowed = False
+
+    def __iter__(self):
+        for item in self.source:
+            if not self.overflowed:
+                self.buffer.append(item)
+                if len(self.buffer) > self.max_items:
+                    self.overflowed, self.buffer = True, []
+            yield item
+
+    # Todos os itens da página, na ordem; None se a cópia passou de max_items
+    def items(self):
+        if self.overflowed:
+            return None
+        return self.buffer + list(self.source)
 
 # Função auxiliar para verificar se o campo é aninhado
 def is_nested_field(field):
     """Verifica se o campo é aninhado (contém '->>')."""
     return '->>' in field
 
+# Função para ler o valor de um campo simples ou aninhado ('pai->>filho') de um item
+def get_nested_field(item, field):
+    """Lê o campo do item seguindo a mesma notação usada em unique_field."""
+    if is_nested_field(field):
+        parent, child = field.split('->>', 1)
+        return (item.get(parent) or {}).get(child)
+    return item.get(field)
+
+# Função para montar a expressão SQL que lê um campo simples ou aninhado da coluna data
+def field_expression(field):
+    """Converte a notação de unique_field ('campo' ou 'pai->>filho') na expressão sobre a coluna JSONB."""
+    if is_nested_field(field):
+        return f"data->'{field.split('->')[0]}'->>'{field.split('->>')[1]}'"
+    return f"data->>'{field}'"
+
 # Função para construir a cláusula ON CONFLICT para campos aninhados ou simples
 def build_conflict_clause(unique_field):
     """Constrói a cláusula ON CONFLICT com suporte para campos aninhados."""
-    conflict_clause = []
-    for field in unique_field:
-        if is_nested_field(field):
-            conflict_clause.append(f"(data->'{field.split('->')[0]}'->>'{field.split('->>')[1]}')")
-        else:
-            conflict_clause.append(f"(data->>'{field}')")
-    return ", ".join(conflict_clause)
+    return ", ".join(f"({field_expression(field)})" for field in unique_field)
+
+# Função SQL (criada pelo schema_manager) que converte os timestamps ISO 8601 do NCE em timestamptz;
+# declarada IMMUTABLE para poder ser usada em colunas geradas e índices
+TIMESTAMP_FUNCTION = "nce_timestamp"
+
+# Valor da coluna de partição para itens sem o campo (ou com um texto que não é timestamp): a coluna é NOT NULL e faz
+# parte da chave única, então o valor precisa ser fixo para o item continuar deduplicado entre coletas; '-infinity'
+# não cai em nenhuma faixa mensal e vai para a partição padrão
+MISSING_PARTITION_VALUE = "-infinity"
+
+# Função para montar a expressão SQL do valor da coluna de partição a partir do texto do campo
+def partition_expression(value):
+    return f"COALESCE({TIMESTAMP_FUNCTION}({value}), '{MISSING_PARTITION_VALUE}')"
+
+# Função para codificar a senha da string de conexão (ex.: senhas com '%' ou '@')
+def encode_db_connection(db_connection):
+    if "@" in db_connection:
+        parts = db_connection.split("@")
+        credentials, host = parts[0], parts[1]
+        user_pass = credentials.split("//")[-1]
+        user, password = user_pass.split(":")
+        password_encoded = quote_plus(password)
+        credentials_encoded = f"{user}:{password_encoded}"
+        return f"postgresql://{credentials_encoded}@{host}"
+    return db_connection
+
+# Função para identificar falhas de conexão com o banco (fora do ar, conexão perdida, pool sem conexões livres), as únicas
+# que vão para o spool: erros do próprio comando (índice único ausente, NOT NULL, JSON inválido) se repetiriam no replay
+def is_connection_error(error):
+    import psycopg2
+    from db_pool import PoolTimeout
+    return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeout))
+
+# Modos de escrita suportados pelo DatabaseOutputHandler
+WRITE_MODES = ("row", "values", "copy")
+
+# Função para calcular o hash estável de um item (JSON canônico: chaves ordenadas, sem espaços)
+def content_hash(item):
+    canonical = json.dumps(item, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+_hash_columns_ready = set()
+_hash_lock = threading.Lock()
 
 # Handler para salvar no banco de dados
 class DatabaseOutputHandler:
-    def __init__(self, db_connection, table, save_mode, unique_field=None):
+    def __init__(self, db_connection, table, save_mode, unique_field=None, on_conflict=None, write_mode="row", batch_size=1000,
+                 db_name=None, pool_settings=None, change_detection=False, schema=None, spool_settings=None):
+        if write_mode not in WRITE_MODES:
+            raise ValueError(f"write_mode {write_mode} desconhecido, use um de {WRITE_MODES}")
         self.db_connection = self.encode_db_connection(db_connection)
         self.table = table
         self.save_mode = save_mode
-        self.unique_field = unique_field
+        self.unique_field = [unique_field] if isinstance(unique_field, str) else unique_field
+        self.on_conflict = on_conflict
+        self.write_mode = write_mode
+        self.batch_size = batch_size
+        # Com pool configurado, as conexões são emprestadas do pool compartilhado do banco
+        # (psycopg2 só é importado pelos handlers de banco: a saída em arquivo não depende dele)
+        self.pool = None
+        if pool_settings is not None:
+            from db_pool import get_pool
+            self.pool = get_pool(db_name or self.db_connection, self.db_connection, **pool_settings)
+        # Spool local (ver spool.py): páginas que não puderam ser gravadas ficam em disco até o replay
+        self.spool = get_spool(db_name or table, spool_settings)
+        # Detecção de mudança: coluna data_hash, comparada pelo próprio banco no upsert (IS DISTINCT FROM), que vê as
+        # gravações de todos os processos; um cache local ficaria defasado com vários gravadores
+        self.change_detection = change_detection
+        # Tabela particionada (ver schema_manager): a coluna de partição é gravada pelo handler e faz parte da chave única
+        partition = (schema or {}).get("partition")
+        self.partition_column = partition["column"] if partition else None
+        self.partition_field = schema["columns"][self.partition_column]["field"] if partition else None
     
     def encode_db_connection(self, db_connection):
-        if "@" in db_connection:
-            parts = db_connection.split("@")
-            credentials, host = parts[0], parts[1]
-            user_pass = credentials.split("//")[-1]
-            user, password = user_pass.split(":")
-            password_encoded = quote_plus(password)
-            credentials_encoded = f"{user}:{password_encoded}"
-            return f"postgresql://{credentials_encoded}@{host}"
-        return db_connection
+        return encode_db_connection(db_connection)
+
+    @contextmanager
+    def connection(self):
+        if self.pool is not None:
+            with self.pool.connection() as conn:
+                yield conn
+        else:
+            import psycopg2
+            conn = psycopg2.connect(self.db_connection)
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+    @property
+    def columns(self):
+        columns = "data, data_hash" if self.change_detection else "data"
+        return f"{columns}, {self.partition_column}" if self.partition_column else columns
+
+    @property
+    def placeholders(self):
+        # O valor da coluna de partição chega como texto e é convertido pela mesma função das colunas geradas
+        # (MISSING_PARTITION_VALUE quando o campo falta)
+        placeholders = ["%s"] * (2 if self.change_detection else 1)
+        if self.partition_column:
+            placeholders.append(partition_expression("%s"))
+        return ", ".join(placeholders)
+
+    @property
+    def conflict_fields(self):
+        conflict_fields = build_conflict_clause(self.unique_field)
+        return f"{conflict_fields}, {self.partition_column}" if self.partition_column else conflict_fields
+
+    @property
+    def inserted_expression(self):
+        # Em tabelas particionadas o RETURNING não pode ler xmax; inserted_at só coincide com collected_at na inserção
+        return "(inserted_at = collected_at)" if self.partition_column else "(xmax = 0)"
+
+    def build_conflict_query(self, on_conflict_action):
+        # Usar a função build_conflict_clause para criar o ON CONFLICT correto
+        conflict_fields = self.conflict_fields
+        if on_conflict_action != "update":
+            return f"ON CONFLICT ({conflict_fields}) DO NOTHING"
+        if self.change_detection:
+            # Só reescreve a linha (e gera WAL) quando o conteúdo realmente mudou
+            return (f"ON CONFLICT ({conflict_fields}) DO UPDATE SET data = EXCLUDED.data, data_hash = EXCLUDED.data_hash, "
+                    f"collected_at = NOW() WHERE {self.table}.data_hash IS DISTINCT FROM EXCLUDED.data_hash")
+        return f"ON CONFLICT ({conflict_fields}) DO UPDATE SET data = EXCLUDED.data, collected_at = NOW()"
+
+    def item_key(self, item):
+        return json.dumps([get_nested_field(item, field) for field in self.unique_field], default=str)
+
+    def unique_items(self, items):
+        """Remove itens repetidos pela chave única, mantendo a última ocorrência."""
+        # Um mesmo comando INSERT ... ON CONFLICT DO UPDATE não pode afetar a mesma linha duas vezes
+        unique = {}
+        for item in items:
+            key = self.item_key(item)
+            unique.pop(key, None)
+            unique[key] = item
+        return list(unique.values())
+
+    def row_values(self, item):
+        serialized = json.dumps(item)
+        values = (serialized, content_hash(item)) if self.change_detection else (serialized,)
+        return values + (get_nested_field(item, self.partition_field),) if self.partition_column else values
+
+    # A coluna data_hash é criada pelo schema_manager.py: na coleta só o catálogo é lido (um ALTER TABLE, mesmo com
+    # IF NOT EXISTS, pegaria um lock exclusivo na tabela a cada processo novo)
+    def hash_column_query(self, placeholder="%s"):
+        return (f"SELECT EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass({placeholder}) "
+                f"AND attname = 'data_hash' AND NOT attisdropped)")
+
+    def hash_column_checked(self):
+        with _hash_lock:
+            return self.table in _hash_columns_ready
+
+    def hash_column_found(self, exists):
+        if not exists:
+            raise RuntimeError(f"Tabela {self.table} sem a coluna data_hash (change_detection): execute python schema_manager.py")
+        with _hash_lock:
+            _hash_columns_ready.add(self.table)
+
+    def check_hash_column(self, cursor):
+        if self.hash_column_checked():
+            return
+        cursor.execute(self.hash_column_query(), (self.table,))
+        self.hash_column_found(cursor.fetchone()[0])
 
     def save(self, endpoint, data, **kwargs):
+        # spool=False (usado no replay): uma falha não volta para o spool
+        replaying = not kwargs.pop("spool", True)
+        spool = None if replaying else self.spool
+        response_key, tee = kwargs.get("response_key", "data"), None
+        if spool is not None:
+            if not self.drain_spool(spool, kwargs.get("execution_id")):
+                return self.spool_page(spool, endpoint, data, **kwargs)
+            # Página em streaming: os itens seguem direto para o banco e uma cópia fica em memória, para a página inteira
+            # ainda poder ir para o spool se a gravação falhar no meio
+            if is_item_stream(data.get(response_key)):
+                tee = ItemTee(data[response_key], spool.settings["buffer_items"])
+                data = {**data, response_key: tee}
+        started = time.perf_counter()
         try:
-            # Obter a chave de resposta do arquivo de configuração
-            response_key = kwargs.get("response_key", "data")  # "data" será o padrão, caso não seja especificado
+            with self.connection() as conn:
+                try:
+                    counts = self.save_with_connection(conn, data, **kwargs)
+                except Exception:
+                    conn.rollback()
+                    raise
+            metrics.observe("save_seconds", time.perf_counter() - started, endpoint=endpoint, tenant=kwargs.get("tenant_id") or None,
+                            handler="database", table=self.table)
+            for result in ("inserted", "updated", "unchanged"):
+                metrics.inc("rows_written_total", counts[result], table=self.table, result=result)
+            return counts
+        except Exception as e:
+            metrics.inc("errors_total", phase="save", endpoint=endpoint, handler="database", table=self.table)
+            logging.error(f"Erro ao salvar no banco de dados: {e}")
+            logging.error(traceback.format_exc())
+            if replaying and is_connection_error(e):
+                # O replay para e o registro continua no segmento; só erros do próprio comando o levam a rejected/
+                raise DatabaseUnavailable(str(e)) from e
+            # Erro permanente: a página não é dada como salva (e o watermark não avança)
+            if spool is None or not is_connection_error(e):
+                return None
+            spool.bypass_until = time.monotonic() + spool.settings["retry_interval"]
+            if tee is not None:
+                items = tee.items()
+                if items is None:
+                    logging.error("Página de %s com mais de %d itens: sem cópia para o spool, fica como não gravada",
+                                  endpoint, spool.settings["buffer_items"])
+                    return None
+                data = {**data, response_key: items}
+            return self.spool_page(spool, endpoint, data, **kwargs)
 
-            # Usar a chave correta para acessar os dados
-            data_to_process = data.get(response_key, [])
+    # Função para decidir se a página pode ir direto para o banco: páginas novas não passam à frente das que estão no
+    # spool (o replay posterior gravaria as antigas por cima, com transições e rollups falsos), então o spool pendente
+    # é drenado antes; se o replay não terminar, a página também vai para o spool, na ordem
+    def drain_spool(self, spool, execution_id):
+        # Logo após uma falha, as páginas vão direto para o spool, sem esperar o timeout de cada conexão
+        if time.monotonic() < spool.bypass_until:
+            return False
+        if not spool.segments(include_open=True):
+            return True
+        summary = replay_spools(execution_id, [spool.name]).get(spool.name, {})
+        if summary.get("complete") and not spool.segments(include_open=True):
+            return True
+        spool.bypass_until = time.monotonic() + spool.settings["retry_interval"]
+        return False
 
-            conn = psycopg2.connect(self.db_connection)
-            cursor = conn.cursor()
+    def spool_page(self, spool, endpoint, data, **kwargs):
+        response_key = kwargs.get("response_key", "data")
+        items = data.get(response_key) or []
+        if is_item_stream(items):
+            items = list(items)
+        try:
+            spool.append(endpoint, response_key, items, tenant_id=kwargs.get("tenant_id"))
+        except (SpoolFull, OSError) as e:
+            # Sem espaço no spool a página é tratada como não gravada (e o watermark não avança)
+            logging.error(f"Erro ao gravar a página de {endpoint} no spool {spool.directory}: {e}")
+            return None
+        logging.warning("Página de %s (%d itens) guardada no spool %s", endpoint, len(items), spool.directory)
+        return {"items": len(items), "inserted": 0, "updated": 0, "unchanged": 0, "spooled": len(items)}
+
+    def save_with_connection(self, conn, data, **kwargs):
+        # Obter a chave de resposta do arquivo de configuração
+        response_key = kwargs.get("response_key", "data")  # "data" será o padrão, caso não seja especificado
+
+        # Usar a chave correta para acessar os dados (lista ou iterador de uma página decodificada de forma incremental)
+        data_to_process = data.get(response_key) or []
+        counts = {"items": 0, "inserted": 0, "updated": 0, "unchanged": 0}
+
+        cursor = conn.cursor()
+        if self.change_detection:
+            self.check_hash_column(cursor)
+
+        # Verifica a lógica de conflito (argumento explícito tem precedência sobre a configuração)
+        on_conflict_action = kwargs.get("on_conflict") or self.on_conflict or "update"
+        # RETURNING (xmax = 0) distingue linhas inseridas (true) de atualizadas (false); as inalteradas não retornam
+        conflict_query = f"{self.build_conflict_query(on_conflict_action)} RETURNING {self.inserted_expression}"
 
-            # Verifica a lógica de conflito
-            on_conflict_action = kwargs.get("on_conflict", "update")
-            if on_conflict_action == "update":
-                conflict_query = "DO UPDATE SET data = EXCLUDED.data, collected_at = NOW()"
+        # Os itens são processados em lotes de batch_size, na mesma transação, sem materializar a página inteira
+        returned, staged = [], False
+        for chunk in iter_chunks(data_to_process, self.batch_size):
+            counts["items"] += len(chunk)
+            if self.write_mode == "values":
+                returned.extend(self.save_values(cursor, chunk, conflict_query))
+            elif self.write_mode == "copy":
+                if not staged:
+                    cursor.execute(self.create_staging_query())
+                    staged = True
+                self.copy_to_staging(cursor, chunk, counts["items"] - len(chunk))
             else:
-                conflict_query = "DO NOTHING"
+                returned.extend(self.save_rows(cursor, chunk, conflict_query))
+        if staged:
+            cursor.execute(self.merge_staging_query(conflict_query))
+            returned = cursor.fetchall()
 
-            # Inserção com upsert usando o índice único composto ou único
-            insert_query = f"""
-            INSERT INTO {self.table} (data, collected_at)
-            VALUES (%s, NOW())
-            """
+        with metrics.timer("commit_seconds", table=self.table):
+            conn.commit()
+        cursor.close()
+
+        counts["inserted"] = sum(1 for (inserted,) in returned if inserted)
+        counts["updated"] = len(returned) - counts["inserted"]
+        counts["unchanged"] = counts["items"] - counts["inserted"] - counts["updated"]
+        logging.info("Dados salvos na tabela %s (modo %s): %s", self.table, self.write_mode, counts)
+        return counts
+
+    def save_rows(self, cursor, items, conflict_query):
+        # Inserção com upsert usando o índice único composto ou único, um item por comando
+        insert_query = f"""
+            INSERT INTO {self.table} ({self.columns}, collected_at)
+            VALUES ({self.placeholders}, NOW())
+            {conflict_query};"""
+
+        returned = []
+        for item in items:
+            cursor.execute(insert_query, self.row_values(item))
+            returned.extend(cursor.fetchall())
+        return returned
+
+    def save_values(self, cursor, items, conflict_query):
+        from psycopg2.extras import execute_values
+        # Inserção em lotes com VALUES de várias linhas: um comando por lote de batch_size itens
+        insert_query = f"""
+            INSERT INTO {self.table} ({self.columns}, collected_at)
+            VALUES %s
+            {conflict_query};"""
+
+        template = f"({self.placeholders}, NOW())"
+        rows = [self.row_values(item) for item in self.unique_items(items)]
+        return execute_values(cursor, insert_query, rows, template=template, page_size=self.batch_size, fetch=True)
+
+    def copy_to_staging(self, cursor, items, offset=0):
+        # COPY de um lote para a tabela temporária; o merge com ON CONFLICT é feito uma vez, ao fim da página
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows(self.staging_records(items, offset))
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {self.staging_table} (ord, {self.columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    @property
+    def staging_table(self):
+        return f"staging_{self.table}"
+
+    @property
+    def staging_columns(self):
+        return ["ord"] + [column.strip() for column in self.columns.split(",")]
+
+    def staging_records(self, items, offset=0):
+        return [(position,) + self.row_values(item) for position, item in enumerate(items, offset)]
+
+    def create_staging_query(self):
+        hash_column = ", data_hash text" if self.change_detection else ""
+        partition_column = f", {self.partition_column} text" if self.partition_column else ""
+        return f"CREATE TEMP TABLE IF NOT EXISTS {self.staging_table} (ord integer, data jsonb{hash_column}{partition_column}) ON COMMIT DROP;"
+
+    def merge_staging_query(self, conflict_query):
+        # DISTINCT ON pela chave única mantém só a última ocorrência de cada item da página
+        conflict_fields = self.conflict_fields
+        select_columns = "data, data_hash" if self.change_detection else "data"
+        if self.partition_column:
+            select_columns += f", {partition_expression(self.partition_column)}"
+        return f"""
+            INSERT INTO {self.table} ({self.columns}, collected_at)
+            SELECT DISTINCT ON ({conflict_fields}) {select_columns}, NOW()
+            FROM {self.staging_table}
+            ORDER BY {conflict_fields}, ord DESC
+            {conflict_query};"""
+
+# Campos que identificam o alarme e os que definem seu estado (comparados a cada coleta pelo rastreamento de estado)
+ALARM_KEY_FIELDS = {"serial_number": "alarm-parameters->>alarm-serial-number", "tenant_id": "alarm-parameters->>tenant-id"}
+ALARM_STATE_FIELDS = {
+    "is_cleared": "resource-alarm-parameters->>is-cleared",
+    "severity": "resource-alarm-parameters->>perceived-severity",
+    "is_acked": "is-acked",
+    "last_changed": "resource-alarm-parameters->>last-changed",
+}
+# Demais campos copiados para a tabela de eventos
+ALARM_EVENT_FIELDS = {"time_created": "time-created", "alarm_type": "common-alarm-parameters->>alarm-type-qualifier",
+                      "ne_name": "alarm-parameters->>ne-name", "probable_cause": "alarm-parameters->>native-probable-cause"}
+# Colunas da tabela de eventos gravadas pelo handler, na ordem de event_row
+ALARM_EVENT_COLUMNS = ("tenant_id", "serial_number", "event_type", "severity", "previous_severity", "is_cleared", "is_acked",
+                       "last_changed", "time_created", "alarm_type", "ne_name", "probable_cause", "previous_is_cleared")
+
+# Colunas da tabela de eventos usadas pelos rollups (previous_is_cleared nulo indica alarme novo); em tabelas de
+# eventos anteriores aos rollups, acrescentadas pelo schema_manager.py
+ALARM_EVENT_ROLLUP_COLUMNS = {"ne_name": "text", "probable_cause": "text", "previous_is_cleared": "boolean"}
+
+# Função para montar os comandos que criam a tabela de eventos (transições) de alarmes, somente inserção
+def alarm_events_table_sql(events_table):
+    return [
+        f"""CREATE TABLE IF NOT EXISTS {events_table} (
+            id bigserial PRIMARY KEY,
+            tenant_id text NOT NULL,
+            serial_number text NOT NULL,
+            event_type text NOT NULL,
+            severity text,
+            previous_severity text,
+            is_cleared boolean,
+            is_acked boolean,
+            last_changed timestamptz,
+            time_created timestamptz,
+            alarm_type text,
+            ne_name text,
+            probable_cause text,
+            previous_is_cleared boolean,
+            recorded_at timestamptz NOT NULL DEFAULT NOW()
+        );""",
+        f"CREATE INDEX IF NOT EXISTS {events_table}_alarm_idx ON {events_table} (tenant_id, serial_number, recorded_at);",
+        f"CREATE INDEX IF NOT EXISTS {events_table}_recorded_at_idx ON {events_table} (recorded_at);",
+    ]
+
+# Função para normalizar um valor de estado como o texto que o operador ->> do PostgreSQL devolveria
+def state_value(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+# Função para classificar a transição entre o estado anterior (None para alarme novo) e o atual
+def transition_type(previous, current, fields):
+    state = dict(zip(fields, current))
+    if previous is None:
+        return "cleared" if state.get("is_cleared") == "true" else "raised"
+    before = dict(zip(fields, previous))
+    if before.get("is_cleared") != state.get("is_cleared"):
+        return "cleared" if state.get("is_cleared") == "true" else "reraised"
+    if before.get("is_acked") != state.get("is_acked"):
+        return "acked" if state.get("is_acked") == "true" else "unacked"
+    if before.get("severity") != state.get("severity"):
+        return "severity"
+    return "changed"
+
+# Índice em memória, compartilhado pelo processo, do último estado conhecido de cada alarme (serial, tenant). Serve só
+# para dispensar sem consulta os alarmes que não mudaram: o estado anterior de um alarme que será gravado vem sempre do
+# banco. Como outros processos também gravam, o índice é recarregado a cada refresh_seconds e as entradas de um tenant
+# são descartadas quando este nó passa a coletá-lo (ver invalidate_alarm_state)
+class AlarmStateIndex:
+    def __init__(self, max_size, tenant_position, refresh_seconds):
+        self.max_size = max_size
+        self.tenant_position = tenant_position
+        self.refresh_seconds = refresh_seconds
+        self.warmed_at = None
+        self.warm_lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def needs_warm(self):
+        return self.warmed_at is None or time.monotonic() - self.warmed_at >= self.refresh_seconds
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
 
-            # Usar a função build_conflict_clause para criar o ON CONFLICT correto
-            conflict_fields = build_conflict_clause(self.unique_field)
-            insert_query += f"ON CONFLICT ({conflict_fields}) {conflict_query};"
+    def update(self, entries):
+        with self._lock:
+            for key, state in entries:
+                self._entries[key] = state
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
 
-            # Executa a inserção
-            for item in data_to_process:
-                cursor.execute(insert_query, (json.dumps(item),))
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
 
+    def drop_tenants(self, tenant_ids):
+        with self._lock:
+            stale = [key for key in self._entries if key[self.tenant_position] in tenant_ids]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def __len__(self):
+        return len(self._entries)
+
+_alarm_state_indexes = {}
+_events_tables_ready = set()
+
+# Função para descartar do índice de estado os alarmes de tenants que outro processo pode ter gravado (ex.: tenants
+# que este nó acabou de assumir na divisão entre coletores); devolve o número de entradas descartadas
+def invalidate_alarm_state(tenant_ids):
+    tenant_ids = set(tenant_ids)
+    with _hash_lock:
+        indexes = list(_alarm_state_indexes.values())
+    return sum(index.drop_tenants(tenant_ids) for index in indexes)
+
+# Marcador de chave ausente no índice (None já significa "alarme que não existe no banco")
+_MISSING = object()
+
+# Handler de alarmes com rastreamento de estado: compara cada alarme com o último estado gravado e só envia ao banco
+# os alarmes novos e os que mudaram (is-cleared, perceived-severity, is-acked, last-changed), atualizando a tabela
+# de estado atual e acrescentando uma linha por transição na tabela de eventos, na mesma transação
+class AlarmStateOutputHandler(DatabaseOutputHandler):
+    def __init__(self, *args, state_tracking=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        settings = state_tracking or {}
+        self.events_table = settings.get("events_table", f"{self.table}_events")
+        self.warm_lookback_hours = settings.get("warm_lookback_hours", 168)
+        self.key_fields = {**ALARM_KEY_FIELDS, **settings.get("key_fields", {})}
+        self.state_fields = {**ALARM_STATE_FIELDS, **settings.get("state_fields", {})}
+        self.state_names = list(self.state_fields)
+        self.rollups = rollup_settings(settings, self.table)
+        with _hash_lock:
+            if self.table not in _alarm_state_indexes:
+                _alarm_state_indexes[self.table] = AlarmStateIndex(settings.get("index_size", 500000), list(self.key_fields).index("tenant_id"),
+                                                                   settings.get("index_refresh_hours", 6) * 3600)
+            self.state_index = _alarm_state_indexes[self.table]
+
+    def alarm_key(self, item):
+        return tuple(get_nested_field(item, field) for field in self.key_fields.values())
+
+    def alarm_state(self, item):
+        return tuple(state_value(get_nested_field(item, field)) for field in self.state_fields.values())
+
+    @property
+    def state_select(self):
+        return ", ".join(field_expression(field) for field in list(self.key_fields.values()) + list(self.state_fields.values()))
+
+    # A tabela de eventos, as de rollup e a função de timestamps são criadas pelo schema_manager.py: na coleta só o
+    # catálogo é lido, uma vez por processo, e a falta de qualquer uma vira um erro claro em vez de falhar no INSERT
+    def check_events_schema(self, cursor):
+        with _hash_lock:
+            if self.events_table in _events_tables_ready:
+                return
+        tables = [self.events_table] + ([self.rollups[name] for name in ("hourly_table", "daily_table", "active_table")]
+                                        if self.rollups else [])
+        function = f"{TIMESTAMP_FUNCTION}(text)"
+        cursor.execute("SELECT name FROM unnest(%s::text[]) AS name WHERE to_regclass(name) IS NULL "
+                       "UNION ALL SELECT %s WHERE to_regprocedure(%s) IS NULL", (tables, function, function))
+        missing = [row[0] for row in cursor.fetchall()]
+        if missing:
+            raise RuntimeError(f"Rastreamento de estado de {self.table} sem {', '.join(missing)}: execute python schema_manager.py")
+        with _hash_lock:
+            _events_tables_ready.add(self.events_table)
+
+    def warm_index(self, conn):
+        # Carga do índice (inicial e a cada refresh_seconds): alarmes ainda ativos e os gravados dentro de warm_lookback_hours
+        if not self.state_index.needs_warm():
+            return
+        with self.state_index.warm_lock:
+            if not self.state_index.needs_warm():
+                return
+            started = time.perf_counter()
+            self.state_index.clear()
+            key_size = len(self.key_fields)
+            cleared = field_expression(self.state_fields["is_cleared"])
+            with conn.cursor(name=f"warm_{self.table}") as cursor:
+                cursor.itersize = 10000
+                cursor.execute(f"SELECT {self.state_select} FROM {self.table} "
+                               f"WHERE ({cleared}) IS DISTINCT FROM 'true' OR collected_at >= NOW() - %s * interval '1 hour'",
+                               (self.warm_lookback_hours,))
+                loaded = 0
+                for rows in iter_chunks(cursor, 10000):
+                    self.state_index.update((tuple(row[:key_size]), tuple(row[key_size:])) for row in rows)
+                    loaded += len(rows)
             conn.commit()
-            logging.info(f"Dados salvos na tabela {self.table}")
-            cursor.close()
-            conn.close()
+            self.state_index.warmed_at = time.monotonic()
+            logging.info("Índice de estado de %s carregado: %d alarmes em %.2fs", self.table, loaded, time.perf_counter() - started)
 
-        except Exception as e:
-            logging.error(f"Erro ao salvar no banco de dados: {e}")
-            logging.error(traceback.format_exc())
+    def lookup_states(self, cursor, keys):
+        from psycopg2.extras import execute_values
+        # Estado atual no banco dos alarmes que mudaram (ou não estão no índice), em um só comando; o lock das linhas faz
+        # gravadores concorrentes do mesmo alarme esperarem o commit um do outro, sem gerar a mesma transição duas vezes
+        names = list(self.key_fields)
+        join = " AND ".join(f"{field_expression(field)} = k.{name}" for name, field in self.key_fields.items())
+        rows = execute_values(cursor, f"SELECT {self.state_select} FROM {self.table} JOIN (VALUES %s) AS k ({', '.join(names)}) ON {join} "
+                                      f"FOR UPDATE OF {self.table}", keys, page_size=len(keys), fetch=True)
+        return {tuple(row[:len(names)]): tuple(row[len(names):]) for row in rows}
+
+    def purged_states(self, cursor, keys):
+        from psycopg2.extras import execute_values
+        # Último tombstone (evento "purged", gravado pela retenção do alarm_rollups.compact_raw) dos alarmes que não estão
+        # na tabela bruta; o estado anterior é o do alarme quando foi removido, sempre encerrado
+        names = list(self.key_fields)
+        join = " AND ".join(f"e.{name} = k.{name}" for name in names)
+        rows = execute_values(cursor, f"SELECT DISTINCT ON (e.tenant_id, e.serial_number) {', '.join(f'e.{name}' for name in names)}, "
+                                      f"e.severity, e.is_acked::text FROM {self.events_table} e JOIN (VALUES %s) AS k ({', '.join(names)}) "
+                                      f"ON {join} WHERE e.event_type = 'purged' ORDER BY e.tenant_id, e.serial_number, e.recorded_at DESC",
+                              keys, page_size=len(keys), fetch=True)
+        states = {}
+        for row in rows:
+            before = {"is_cleared": "true", "severity": row[len(names)], "is_acked": row[len(names) + 1]}
+            states[tuple(row[:len(names)])] = tuple(before.get(name) for name in self.state_names)
+        return states
+
+    def event_row(self, item, event_type, previous):
+        fields = {**self.key_fields, **self.state_fields, **ALARM_EVENT_FIELDS}
+        values = {name: get_nested_field(item, field) for name, field in fields.items()}
+        before = dict(zip(self.state_names, previous)) if previous else {}
+        # Alarme já conhecido sem is-cleared conta como ativo; nulo fica reservado para alarme novo
+        previous_is_cleared = (before.get("is_cleared") or "false") if previous else None
+        return (values["tenant_id"], values["serial_number"], event_type, values["severity"], before.get("severity"),
+                state_value(values["is_cleared"]), state_value(values["is_acked"]), values["last_changed"],
+                values["time_created"], values["alarm_type"], values["ne_name"], values["probable_cause"], previous_is_cleared)
+
+    def save_events(self, cursor, rows):
+        from psycopg2.extras import execute_values
+        execute_values(cursor, f"""
+            INSERT INTO {self.events_table} ({", ".join(ALARM_EVENT_COLUMNS)})
+            VALUES %s;""", rows, template=f"(%s, %s, %s, %s, %s, %s::boolean, %s::boolean, {TIMESTAMP_FUNCTION}(%s), "
+                                          f"{TIMESTAMP_FUNCTION}(%s), %s, %s, %s, %s::boolean)", page_size=self.batch_size)
+        if self.rollups:
+            # Rollups na mesma transação dos eventos: o commit (ou rollback) vale para os dois
+            accumulator = RollupAccumulator()
+            for row in rows:
+                accumulator.add(dict(zip(ALARM_EVENT_COLUMNS, row)))
+            accumulator.save(cursor, self.rollups)
+
+    def save_with_connection(self, conn, data, **kwargs):
+        response_key = kwargs.get("response_key", "data")
+        cursor = conn.cursor()
+        self.check_events_schema(cursor)
+        self.warm_index(conn)
+
+        total, changed, events, pending, confirmed = 0, [], [], {}, {}
+        for chunk in iter_chunks(data.get(response_key) or [], self.batch_size):
+            total += len(chunk)
+            rows = [(item, self.alarm_key(item), self.alarm_state(item)) for item in chunk]
+            # Alarmes iguais ao último estado conhecido pelo índice são dispensados sem consulta; para os demais, o estado
+            # anterior vem do banco, que vê as gravações de todos os processos
+            lookup = {key for _, key, state in rows if key not in pending and self.state_index.get(key, _MISSING) != state}
+            known = self.lookup_states(cursor, list(lookup)) if lookup else {}
+            missing = [key for key in lookup if key not in known]
+            purged = self.purged_states(cursor, missing) if missing else {}
+            confirmed.update(known)
+            for item, key, state in rows:
+                # Itens repetidos na mesma página são comparados com a ocorrência anterior
+                if key in pending:
+                    previous = pending[key]
+                elif key in lookup:
+                    previous = known.get(key)
+                    if previous is None and key in purged:
+                        # Alarme removido pela retenção e reportado de novo: se continua encerrado é dispensado (sem evento
+                        # e sem voltar à tabela bruta); se está ativo, é reraised, não um alarme novo
+                        if dict(zip(self.state_names, state)).get("is_cleared") == "true":
+                            confirmed[key] = state
+                            continue
+                        previous = purged[key]
+                else:
+                    continue
+                if previous == state:
+                    continue
+                event_type = transition_type(previous, state, self.state_names)
+                events.append(self.event_row(item, event_type, previous))
+                changed.append(item)
+                pending[key] = state
+
+        if events:
+            self.save_events(cursor, events)
+            for event_type in {row[2] for row in events}:
+                metrics.inc("alarm_events_total", sum(1 for row in events if row[2] == event_type), table=self.events_table, event=event_type)
+        cursor.close()
+
+        # Só os alarmes novos ou alterados vão para a tabela de estado, sempre com upsert (on_conflict "nothing" congelaria
+        # o estado da primeira coleta); o commit feito pelo DatabaseOutputHandler inclui os eventos
+        counts = super().save_with_connection(conn, {response_key: changed}, response_key=response_key, on_conflict="update")
+        self.state_index.update(list(confirmed.items()) + list(pending.items()))
+        counts["unchanged"] += total - len(changed)
+        counts["items"] = total
+        counts["events"] = len(events)
+        logging.info("Estado de alarmes em %s: %d itens, %d transições gravadas em %s", self.table, total, len(events), self.events_table)
+        return counts
 
 # Função para carregar o arquivo de configuração
 def load_output_config(config_file='output_handler_config.json'):
@@ -118,7 +777,7 @@ def load_output_config(config_file='output_handler_config.json'):
 # Função para escolher o handler de saída
 def get_output_handler(handler_type, execution_id, **kwargs):
     try:
-        logging.info(f"[UUID: {execution_id}] Tipo de handler: {handler_type}, Parâmetros recebidos: {kwargs}")
+        logging.info("[UUID: %s] Tipo de handler: %s, Parâmetros recebidos: %s", execution_id, handler_type, kwargs)
 
         if handler_type == "file":
             return FileOutputHandler(kwargs['base_path'], kwargs.get('file_name_template', "{endpoint}_response.json"))
@@ -127,13 +786,30 @@ def get_output_handler(handler_type, execution_id, **kwargs):
             table = kwargs.get('table')
             save_mode = kwargs.get('save_mode')
             unique_field = kwargs.get('unique_field')
+            on_conflict = kwargs.get('on_conflict')
+            write_mode = kwargs.get('write_mode', 'row')
+            batch_size = kwargs.get('batch_size', 1000)
+            db_name = kwargs.get('db_name')
+            pool_settings = kwargs.get('pool_settings')
+            change_detection = kwargs.get('change_detection', False)
+            schema = kwargs.get('schema')
+            state_tracking = kwargs.get('state_tracking')
+            spool_settings = kwargs.get('spool_settings')
 
-            logging.info(f"[UUID: {execution_id}] db_connection: {db_connection}, table: {table}, save_mode: {save_mode}, unique_field: {unique_field}")
+            logging.info("[UUID: %s] table: %s, save_mode: %s, unique_field: %s, on_conflict: %s, write_mode: %s",
+                         execution_id, table, save_mode, unique_field, on_conflict, write_mode)
 
             if not db_connection or not table or not save_mode:
                 raise ValueError(f"[UUID: {execution_id}] Parâmetros de banco de dados faltando: db_connection, table ou save_mode")
 
-            return DatabaseOutputHandler(db_connection, table, save_mode, unique_field)
+            handler_kwargs = dict(db_name=db_name, pool_settings=pool_settings, change_detection=change_detection,
+                                  schema=schema, spool_settings=spool_settings)
+            # Rastreamento de estado (alarmes): grava só alarmes novos e transições, com tabela de eventos
+            if state_tracking and state_tracking.get("enabled", True):
+                return AlarmStateOutputHandler(db_connection, table, save_mode, unique_field, on_conflict, write_mode, batch_size,
+                                               state_tracking=state_tracking, **handler_kwargs)
+            return DatabaseOutputHandler(db_connection, table, save_mode, unique_field, on_conflict, write_mode, batch_size,
+                                         **handler_kwargs)
         else:
             raise ValueError(f"[UUID: {execution_id}] Handler desconhecido: {handler_type}")
     except Exception as e:
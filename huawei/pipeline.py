@@ -0,0 +1,175 @@
+import time
+import queue
+import threading
+import traceback
+from concurrent.futures import Future
+
+import logging_config
+import metrics
+from api_manager import load_endpoints_config, resolve_output_handler
+from output_handler import DatabaseOutputHandler
+
+# Carregar a configuração de log para o pipeline de ingestão
+logger = logging_config.load_log_config('pipeline')
+
+# Pipeline produtor/consumidor entre a busca na API e a gravação: os workers de busca enfileiram as páginas
+# (fila limitada: com a fila cheia, quem busca espera, sem acumular páginas em memória) e um pool de
+# gravadores as consome. Quando a gravação fica para trás, as páginas do mesmo endpoint já enfileiradas, de
+# tenants diferentes, são agrupadas em uma só gravação em lote no handler de banco (até batch_items itens ou
+# max_wait segundos); o handler de arquivo grava cada página como antes. Os handlers vêm da mesma configuração
+# de get_output_handler.
+
+# Configuração padrão; pode ser sobrescrita pela chave "pipeline" do endpoints_config.json
+DEFAULT_PIPELINE_SETTINGS = {
+    "enabled": True,
+    "queue_size": 64,       # páginas na fila antes de a busca esperar
+    "writers": 2,           # threads de gravação
+    "batch_items": 5000,    # itens por gravação em lote (por endpoint)
+    "max_wait": 0.2         # tempo máximo (s) de uma página no lote enquanto a fila continua cheia
+}
+
+# Marcador de encerramento dos gravadores
+_STOP = object()
+
+# Página enfileirada para gravação
+class PageEntry:
+    __slots__ = ("endpoint_name", "data", "response_key", "items", "save_kwargs", "future", "enqueued_at")
+
+    def __init__(self, endpoint_name, data, response_key, items, save_kwargs):
+        self.endpoint_name = endpoint_name
+        self.data = data
+        self.response_key = response_key
+        self.items = items
+        self.save_kwargs = save_kwargs
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+# Função para carregar a configuração "pipeline", mesclada com os valores padrão
+def load_pipeline_settings():
+    return {**DEFAULT_PIPELINE_SETTINGS, **load_endpoints_config().get("pipeline", {})}
+
+class IngestionPipeline:
+    def __init__(self, execution_id, settings=None):
+        self.execution_id = execution_id
+        self.settings = {**DEFAULT_PIPELINE_SETTINGS, **(settings or {})}
+        self.queue = queue.Queue(maxsize=self.settings["queue_size"])
+        self.handlers = {}
+        self.handlers_lock = threading.Lock()
+        self.writers = []
+        self.max_depth = 0
+        self.stats = {"pages": 0, "batches": 0, "errors": 0}
+        self.stats_lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        for number in range(self.settings["writers"]):
+            writer = threading.Thread(target=self.run_writer, name=f"pipeline-writer-{number}", daemon=True)
+            writer.start()
+            self.writers.append(writer)
+        logger.info("[UUID: %s] Pipeline iniciado: %s", self.execution_id, self.settings)
+
+    def close(self):
+        # Cada gravador grava o que tiver pendente ao receber o marcador de encerramento
+        for _ in self.writers:
+            self.queue.put(_STOP)
+        for writer in self.writers:
+            writer.join()
+        self.writers = []
+        metrics.set_gauge("pipeline_queue_depth", 0)
+        logger.info("[UUID: %s] Pipeline encerrado: %s, fila máxima %d", self.execution_id, self.stats, self.max_depth)
+
+    # Enfileira uma página para gravação; devolve um Future com True (gravada) ou False (falha na gravação)
+    def submit(self, endpoint_name, data, response_key, **save_kwargs):
+        # Os itens são materializados antes de entrar na fila: páginas decodificadas sob demanda liberam a conexão HTTP
+        items = list(data.get(response_key) or [])
+        entry = PageEntry(endpoint_name, data, response_key, items, save_kwargs)
+        started = time.perf_counter()
+        self.queue.put(entry)
+        waited = time.perf_counter() - started
+        entry.enqueued_at += waited
+        metrics.observe("pipeline_stage_seconds", waited, stage="enqueue_wait", endpoint=endpoint_name)
+        depth = self.queue.qsize()
+        metrics.set_gauge("pipeline_queue_depth", depth)
+        if depth > self.max_depth:
+            self.max_depth = depth
+            metrics.set_gauge("pipeline_queue_depth_max", depth)
+        return entry.future
+
+    def handler_for(self, endpoint_name):
+        with self.handlers_lock:
+            if endpoint_name not in self.handlers:
+                try:
+                    self.handlers[endpoint_name] = resolve_output_handler(endpoint_name, self.execution_id)
+                except Exception as e:
+                    # Sem handler, as páginas do endpoint são marcadas como falha na gravação
+                    logger.error("[UUID: %s] Erro ao obter o output handler de %s: %r", self.execution_id, endpoint_name, e)
+                    self.handlers[endpoint_name] = None
+            return self.handlers[endpoint_name]
+
+    def run_writer(self):
+        pending = {}  # endpoint -> {"entries": [...], "items": n, "since": instante da primeira página}
+        while True:
+            deadlines = [group["since"] + self.settings["max_wait"] for group in pending.values()]
+            timeout = max(0.0, min(deadlines) - time.perf_counter()) if deadlines else None
+            try:
+                entry = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                entry = None
+            if entry is _STOP:
+                for endpoint_name in list(pending):
+                    self.flush(pending.pop(endpoint_name)["entries"])
+                return
+            if entry is not None:
+                metrics.observe("pipeline_stage_seconds", time.perf_counter() - entry.enqueued_at, stage="queued",
+                                endpoint=entry.endpoint_name)
+                metrics.set_gauge("pipeline_queue_depth", self.queue.qsize())
+                if not isinstance(self.handler_for(entry.endpoint_name), DatabaseOutputHandler):
+                    self.flush([entry])
+                    continue
+                group = pending.setdefault(entry.endpoint_name, {"entries": [], "items": 0, "since": time.perf_counter()})
+                group["entries"].append(entry)
+                group["items"] += len(entry.items)
+                if group["items"] >= self.settings["batch_items"]:
+                    self.flush(pending.pop(entry.endpoint_name)["entries"])
+            # Com a fila vazia não há o que agrupar: grava já, em vez de segurar quem espera pela gravação
+            now, idle = time.perf_counter(), self.queue.empty()
+            for endpoint_name in [name for name, group in pending.items() if idle or now - group["since"] >= self.settings["max_wait"]]:
+                self.flush(pending.pop(endpoint_name)["entries"])
+
+    def flush(self, entries):
+        first = entries[0]
+        handler = self.handler_for(first.endpoint_name)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise RuntimeError(f"Output handler indisponível para {first.endpoint_name}")
+            if len(entries) == 1:
+                data = {**first.data, first.response_key: first.items}
+                result = handler.save(first.endpoint_name, data, execution_id=self.execution_id,
+                                      response_key=first.response_key, **first.save_kwargs)
+            else:
+                # Lote de várias páginas (e tenants): uma só gravação com os itens de todas
+                items = [item for entry in entries for item in entry.items]
+                result = handler.save(first.endpoint_name, {first.response_key: items}, tenant_id="", execution_id=self.execution_id,
+                                      response_key=first.response_key)
+            ok = result is not None
+        except Exception as e:
+            logger.error("[UUID: %s] Erro na gravação de %d páginas de %s: %r", self.execution_id, len(entries), first.endpoint_name, e)
+            logger.debug(traceback.format_exc())
+            ok = False
+
+        metrics.observe("pipeline_stage_seconds", time.perf_counter() - started, stage="write", endpoint=first.endpoint_name)
+        metrics.inc("pipeline_batches_total", endpoint=first.endpoint_name)
+        metrics.inc("pipeline_pages_total", len(entries), endpoint=first.endpoint_name, result="ok" if ok else "error")
+        with self.stats_lock:
+            self.stats["pages"] += len(entries)
+            self.stats["batches"] += 1
+            self.stats["errors"] += 0 if ok else len(entries)
+        for entry in entries:
+            entry.future.set_result(ok)
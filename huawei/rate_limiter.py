@@ -0,0 +1,229 @@
+import os
+import time
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+import metrics
+import logging_config
+from endpoint_registry import load_endpoints_config
+
+# Carregar a configuração de log para o limitador de taxa
+logger = logging_config.load_log_config('rate_limiter')
+
+# Configuração padrão; pode ser sobrescrita pela chave "rate_limits" do endpoints_config.json
+# (valores por tipo de token em "msp"/"tenant" e, por controlador, em "controllers": {"host": {"msp": {...}}})
+DEFAULT_RATE_LIMIT_SETTINGS = {
+    "enabled": True,
+    "rate": 20.0,                   # requisições por segundo (balde de tokens); 0 desliga o controle de taxa
+    "burst": 40,                    # tamanho do balde
+    "min_rate": 1.0,
+    "rate_increase": 1.0,           # aumento aditivo da taxa por janela saudável
+    "initial_concurrency": 8,
+    "min_concurrency": 1,
+    "max_concurrency": 32,
+    "concurrency_increase": 1,      # aumento aditivo da concorrência por janela saudável
+    "decrease_factor": 0.5,         # redução multiplicativa ao detectar throttling, erros ou latência alta
+    "window": 20,                   # respostas avaliadas por ajuste
+    "error_rate_threshold": 0.1,
+    "latency_target": 5.0,          # latência média (s) acima da qual a janela conta como sobrecarga
+    "cooldown": 2.0,                # intervalo mínimo (s) entre reduções, para várias respostas 429 simultâneas contarem uma vez
+    "retry_after_default": 5.0,     # pausa (s) após um 429 sem Retry-After
+    "max_retry_after": 120.0,
+    "max_throttle_retries": 3       # novas tentativas após 429 antes de devolver a resposta ao chamador
+}
+
+# Valores divididos entre os processos de um executor de processos (ver share_among_processes): taxa e balde
+# somam o configurado entre todos os workers; as concorrências são arredondadas para cima
+PROCESS_SHARED_RATES = ("rate", "burst", "min_rate", "rate_increase")
+PROCESS_SHARED_CONCURRENCY = ("initial_concurrency", "max_concurrency")
+
+# Intervalo de reavaliação de quem espera uma vaga no coletor assíncrono
+ASYNC_POLL_INTERVAL = 0.05
+
+# Função para interpretar o cabeçalho Retry-After (segundos ou data HTTP); devolve segundos ou None
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+# Limitador adaptativo de um controlador/tipo de token: balde de tokens para a taxa, limite de requisições
+# simultâneas e ajuste AIMD de ambos a partir dos erros, do throttling (429/Retry-After) e da latência observados
+class AdaptiveLimiter:
+    def __init__(self, name, settings):
+        self.name = name
+        self.settings = settings
+        self.max_rate = float(settings["rate"] or 0)
+        self.rate = self.max_rate
+        self.burst = max(1.0, float(settings["burst"] or self.max_rate or 1))
+        self.tokens = self.burst
+        self.refilled_at = time.monotonic()
+        self.limit = max(settings["min_concurrency"], min(settings["initial_concurrency"], settings["max_concurrency"]))
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.window = {"count": 0, "errors": 0, "latency": 0.0}
+        self.totals = {"requests": 0, "throttled": 0, "errors": 0, "increases": 0, "decreases": 0}
+        self.condition = threading.Condition()
+
+    # Tenta ocupar uma vaga; devolve 0 se conseguiu, o tempo a esperar (s) ou None (aguardar uma liberação)
+    def _try_acquire(self, now):
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= self.limit:
+            return None
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+            self.refilled_at = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+        self.in_flight += 1
+        self.totals["requests"] += 1
+        return 0
+
+    def acquire(self):
+        started = time.monotonic()
+        with self.condition:
+            while True:
+                wait = self._try_acquire(time.monotonic())
+                if wait == 0:
+                    break
+                self.condition.wait(wait)
+        self._observe_wait(time.monotonic() - started)
+
+    async def acquire_async(self):
+        import asyncio
+        started = time.monotonic()
+        while True:
+            with self.condition:
+                wait = self._try_acquire(time.monotonic())
+            if wait == 0:
+                break
+            await asyncio.sleep(ASYNC_POLL_INTERVAL if wait is None else min(wait, self.settings["max_retry_after"]))
+        self._observe_wait(time.monotonic() - started)
+
+    def _observe_wait(self, waited):
+        if waited > 0.001:
+            metrics.observe("rate_limit_wait_seconds", waited, limiter=self.name)
+
+    # Libera a vaga e registra o resultado: status HTTP (None para erro de conexão/timeout), latência e Retry-After
+    def release(self, status, latency, retry_after=None):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if status == 429 or (status == 503 and retry_after is not None):
+                self._throttled(now, retry_after)
+            else:
+                error = status is None or status >= 500
+                self.window["count"] += 1
+                self.window["errors"] += error
+                self.window["latency"] += latency
+                self.totals["errors"] += error
+                if self.window["count"] >= self.settings["window"]:
+                    self._adjust(now)
+            self.condition.notify_all()
+
+    def _throttled(self, now, retry_after):
+        pause = min(self.settings["max_retry_after"], self.settings["retry_after_default"] if retry_after is None else retry_after)
+        self.paused_until = max(self.paused_until, now + pause)
+        self.totals["throttled"] += 1
+        metrics.inc("throttled_total", limiter=self.name)
+        self._decrease(now, f"throttling, pausa de {pause:.1f}s")
+
+    def _adjust(self, now):
+        count, errors, latency = self.window["count"], self.window["errors"], self.window["latency"]
+        self.window = {"count": 0, "errors": 0, "latency": 0.0}
+        error_rate, average_latency = errors / count, latency / count
+        if error_rate > self.settings["error_rate_threshold"]:
+            self._decrease(now, f"taxa de erros {error_rate:.0%}")
+        elif self.settings["latency_target"] and average_latency > self.settings["latency_target"]:
+            self._decrease(now, f"latência média {average_latency:.2f}s")
+        elif self.limit < self.settings["max_concurrency"] or self.rate < self.max_rate:
+            self.limit = min(self.settings["max_concurrency"], self.limit + self.settings["concurrency_increase"])
+            if self.rate:
+                self.rate = min(self.max_rate, self.rate + self.settings["rate_increase"])
+            self.totals["increases"] += 1
+            metrics.inc("rate_limit_adjustments_total", limiter=self.name, direction="up")
+            logger.debug("Limitador %s: concorrência %d, taxa %.1f/s", self.name, self.limit, self.rate)
+
+    def _decrease(self, now, reason):
+        if now - self.last_decrease < self.settings["cooldown"]:
+            return
+        self.last_decrease = now
+        self.limit = max(self.settings["min_concurrency"], int(self.limit * self.settings["decrease_factor"]))
+        if self.rate:
+            self.rate = max(self.settings["min_rate"], self.rate * self.settings["decrease_factor"])
+        self.totals["decreases"] += 1
+        metrics.inc("rate_limit_adjustments_total", limiter=self.name, direction="down")
+        logger.warning("Limitador %s reduzido (%s): concorrência %d, taxa %.1f/s", self.name, reason, self.limit, self.rate)
+
+    def stats(self):
+        with self.condition:
+            return {"concurrency": self.limit, "in_flight": self.in_flight, "rate": round(self.rate, 2), **self.totals}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_settings = None
+_process_share = 1
+
+# Função para carregar a configuração "rate_limits", mesclada com os valores padrão
+def load_rate_limit_settings():
+    global _settings
+    if _settings is None:
+        _settings = load_endpoints_config().get("rate_limits", {})
+    return _settings
+
+# Função para montar a configuração efetiva de um controlador e tipo de token
+def resolve_settings(host, token_type):
+    config = load_rate_limit_settings()
+    base = {key: value for key, value in config.items() if key in DEFAULT_RATE_LIMIT_SETTINGS}
+    controller = config.get("controllers", {}).get(host, {})
+    settings = {**DEFAULT_RATE_LIMIT_SETTINGS, **base, **config.get(token_type, {}),
+                **{key: value for key, value in controller.items() if key in DEFAULT_RATE_LIMIT_SETTINGS},
+                **controller.get(token_type, {})}
+    if _process_share > 1:
+        settings.update({key: (settings[key] or 0) / _process_share for key in PROCESS_SHARED_RATES})
+        settings.update({key: max(settings["min_concurrency"], -(-settings[key] // _process_share)) for key in PROCESS_SHARED_CONCURRENCY})
+    return settings
+
+# Função para obter o limitador compartilhado de um controlador (host da URL) e tipo de token; None se desligado
+def get_limiter(url, token_type):
+    host = urlparse(url).netloc
+    key = (host, token_type)
+    with _limiters_lock:
+        if key not in _limiters:
+            settings = resolve_settings(host, token_type)
+            _limiters[key] = AdaptiveLimiter(f"{host}/{token_type}", settings) if settings["enabled"] else None
+        return _limiters[key]
+
+# Função para obter as estatísticas de todos os limitadores do processo
+def all_limiter_stats():
+    with _limiters_lock:
+        limiters = [limiter for limiter in _limiters.values() if limiter is not None]
+    return {limiter.name: limiter.stats() for limiter in limiters}
+
+# Função para dividir os limites configurados entre os workers de um executor de processos (initializer do pool):
+# cada processo tem seus próprios limitadores, e sem a divisão a taxa total seria workers × a configurada
+def share_among_processes(workers):
+    global _process_share
+    _process_share = max(1, int(workers))
+    with _limiters_lock:
+        _limiters.clear()
+
+# Após um fork, o processo filho começa com limitadores próprios (os locks do pai podem estar ocupados)
+def _reset_after_fork():
+    global _limiters_lock
+    _limiters_lock = threading.Lock()
+    _limiters.clear()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
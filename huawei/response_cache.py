@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import sqlite3
+import argparse
+import threading
+
+import logging_config
+import metrics
+
+# Carregar a configuração de log para o cache de respostas
+logger = logging_config.load_log_config('response_cache')
+
+# Cache local de respostas de endpoints que mudam pouco (ex.: get_tenants), compartilhado entre processos:
+# um arquivo SQLite em modo WAL, com uma linha por página (chave = URL, parâmetros de URL/corpo e tenant).
+# Enquanto a página está dentro do TTL, fetch_page a devolve sem pedir token nem chamar o controlador; expirada,
+# e com ETag/Last-Modified guardados, a página é revalidada com If-None-Match/If-Modified-Since (304 renova o TTL).
+# O tamanho é limitado por max_bytes/max_entries, removendo as páginas menos usadas recentemente (LRU).
+# Configuração global na chave "response_cache" do endpoints_config.json e, por endpoint, na chave "cache":
+#   {"enabled": true, "ttl": 3600, "conditional": true, "save_on_hit": false}
+# Uso: python response_cache.py (estatísticas) | --clear [--endpoint get_tenants]
+
+DEFAULT_CACHE_SETTINGS = {
+    "enabled": True,
+    "path": "cache/responses.sqlite",
+    "max_bytes": 256 * 1024 * 1024,    # soma dos corpos (comprimidos) guardados
+    "max_entries": 10000,
+    "busy_timeout": 5.0                # espera (s) por outro processo gravando no arquivo
+}
+
+DEFAULT_ENDPOINT_CACHE_SETTINGS = {
+    "enabled": True,
+    "ttl": 3600,
+    "conditional": True,       # revalidar páginas expiradas com ETag/Last-Modified
+    "save_on_hit": False       # gravar de novo no output handler as páginas vindas do cache
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    endpoint TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    body BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+"""
+
+# Página devolvida por fetch_page para endpoints com cache; cache_status: hit, revalidated ou miss
+class CachedResponse(dict):
+    __slots__ = ("cache_key", "cache_status", "needs_save")
+
+    def __init__(self, data, cache_key, cache_status, needs_save):
+        super().__init__(data)
+        self.cache_key = cache_key
+        self.cache_status = cache_status
+        self.needs_save = needs_save
+
+class ResponseCache:
+    def __init__(self, settings):
+        self.settings = {**DEFAULT_CACHE_SETTINGS, **settings}
+        self.path = self.settings["path"]
+        self.local = threading.local()
+        self.schema_ready = False
+        self.schema_lock = threading.Lock()
+
+    def connection(self):
+        # Uma conexão por thread (e por processo: após um fork a conexão herdada não é reutilizada)
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.settings["busy_timeout"], isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self.schema_lock:
+                if not self.schema_ready:
+                    conn.executescript(SCHEMA)
+                    self.schema_ready = True
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self.connection().execute("SELECT expires_at, etag, last_modified, body FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return {"expires_at": row[0], "etag": row[1], "last_modified": row[2], "body": row[3]}
+
+    def touch(self, key, expires_at=None):
+        now = time.time()
+        if expires_at is None:
+            self.connection().execute("UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        else:
+            self.connection().execute("UPDATE responses SET last_access = ?, expires_at = ?, hits = hits + 1 WHERE key = ?",
+                                      (now, expires_at, key))
+
+    def put(self, key, endpoint_name, content, ttl, etag=None, last_modified=None):
+        body = zlib.compress(content, 1)
+        now = time.time()
+        conn = self.connection()
+        conn.execute("INSERT OR REPLACE INTO responses (key, endpoint, stored_at, expires_at, last_access, etag, last_modified, size, hits, body) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?)", (key, endpoint_name, now, now + ttl, now, etag, last_modified, len(body), body))
+        self.evict()
+
+    def discard(self, key):
+        self.connection().execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def evict(self):
+        conn = self.connection()
+        # Páginas expiradas sem ETag/Last-Modified não podem ser revalidadas: saem primeiro
+        conn.execute("DELETE FROM responses WHERE expires_at < ? AND etag IS NULL AND last_modified IS NULL", (time.time(),))
+        entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if entries <= self.settings["max_entries"] and total <= self.settings["max_bytes"]:
+            metrics.set_gauge("response_cache_bytes", total)
+            return
+        evicted = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+                if entries <= self.settings["max_entries"] and total <= self.settings["max_bytes"]:
+                    break
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                entries, total, evicted = entries - 1, total - size, evicted + 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        metrics.inc("response_cache_evictions_total", evicted)
+        metrics.set_gauge("response_cache_bytes", total)
+
+    def stats(self):
+        rows = self.connection().execute("SELECT endpoint, COUNT(*), SUM(size), SUM(hits), SUM(expires_at < ?) FROM responses "
+                                         "GROUP BY endpoint ORDER BY endpoint", (time.time(),)).fetchall()
+        return {endpoint: {"entries": entries, "bytes": size, "hits": hits, "expired": expired}
+                for endpoint, entries, size, hits, expired in rows}
+
+    def clear(self, endpoint_name=None):
+        if endpoint_name:
+            return self.connection().execute("DELETE FROM responses WHERE endpoint = ?", (endpoint_name,)).rowcount
+        return self.connection().execute("DELETE FROM responses").rowcount
+
+# Consulta ao cache de uma requisição; usada por fetch_page para devolver, revalidar ou guardar a página
+class CacheLookup:
+    def __init__(self, cache, settings, endpoint_name, key, entry):
+        self.cache = cache
+        self.settings = settings
+        self.endpoint_name = endpoint_name
+        self.key = key
+        self.entry = entry
+        self.fresh = entry is not None and entry["expires_at"] > time.time()
+
+    def page(self, status):
+        with metrics.timer("decode_seconds", endpoint=self.endpoint_name):
+            data = json.loads(zlib.decompress(self.entry["body"]))
+        metrics.inc("response_cache_total", endpoint=self.endpoint_name, result=status)
+        return CachedResponse(data, self.key, status, self.settings["save_on_hit"])
+
+    def hit(self):
+        self.cache.touch(self.key)
+        return self.page("hit")
+
+    def conditional_headers(self):
+        if self.entry is None or not self.settings["conditional"]:
+            return {}
+        headers = {}
+        if self.entry["etag"]:
+            headers["If-None-Match"] = self.entry["etag"]
+        if self.entry["last_modified"]:
+            headers["If-Modified-Since"] = self.entry["last_modified"]
+        return headers
+
+    def revalidated(self):
+        # 304: o conteúdo guardado continua válido por mais um TTL
+        self.cache.touch(self.key, time.time() + self.settings["ttl"])
+        return self.page("revalidated")
+
+    def store(self, data, content=None, headers=None):
+        headers = headers or {}
+        try:
+            self.cache.put(self.key, self.endpoint_name, content if content is not None else json.dumps(data).encode("utf-8"),
+                           self.settings["ttl"], headers.get("ETag"), headers.get("Last-Modified"))
+        except sqlite3.Error as e:
+            # Falha no cache não impede a coleta: a página segue para o output handler normalmente
+            logger.warning("Erro ao guardar a página de %s no cache %s: %s", self.endpoint_name, self.cache.path, e)
+        metrics.inc("response_cache_total", endpoint=self.endpoint_name, result="miss")
+        return CachedResponse(data, self.key, "miss", True)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# Função para obter o cache compartilhado do processo; None se desligado na configuração
+def get_response_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            from api_manager import load_endpoints_config
+            settings = {**DEFAULT_CACHE_SETTINGS, **load_endpoints_config().get("response_cache", {})}
+            _cache = ResponseCache(settings) if settings["enabled"] else False
+        return _cache or None
+
+# Função para obter a configuração de cache de um endpoint; None se ele não usa cache
+def endpoint_cache_settings(endpoint_config):
+    settings = endpoint_config.get("cache")
+    if not settings or not settings.get("enabled", True):
+        return None
+    return {**DEFAULT_ENDPOINT_CACHE_SETTINGS, **settings}
+
+# Função para montar a chave de uma requisição: URL, parâmetros de URL e corpo (sem o token) e o tenant
+def cache_key(endpoint_name, url, url_params, body, tenant_id=None):
+    text = json.dumps([endpoint_name, url, url_params, body, tenant_id or None], sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Função para consultar o cache de uma requisição; None se o endpoint não usa cache (ou o cache está indisponível)
+def lookup(endpoint_name, endpoint_config, url, url_params, body, tenant_id=None):
+    settings = endpoint_cache_settings(endpoint_config)
+    cache = get_response_cache() if settings else None
+    if cache is None:
+        return None
+    # Páginas de token MSP não dependem do tenant da chamada
+    key = cache_key(endpoint_name, url, url_params, body, tenant_id if endpoint_config.get("token_type") == "tenant" else None)
+    try:
+        entry = cache.get(key)
+    except sqlite3.Error as e:
+        logger.warning("Erro ao consultar o cache %s: %s", cache.path, e)
+        return None
+    return CacheLookup(cache, settings, endpoint_name, key, entry)
+
+# Função para saber se uma página deve ir para o output handler (páginas do cache já foram gravadas quando chegaram)
+def needs_save(page):
+    return getattr(page, "needs_save", True)
+
+# Função para descartar do cache uma página cuja gravação falhou, para que a próxima coleta a busque de novo
+def discard(page):
+    key = getattr(page, "cache_key", None)
+    cache = get_response_cache() if key else None
+    if cache is not None:
+        try:
+            cache.discard(key)
+        except sqlite3.Error as e:
+            logger.warning("Erro ao descartar a página do cache %s: %s", cache.path, e)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consultar ou limpar o cache local de respostas do controlador")
+    parser.add_argument('--clear', action='store_true', help="Remover as páginas do cache")
+    parser.add_argument('--endpoint', help="Restringir a limpeza a um endpoint")
+    args = parser.parse_args()
+
+    cache = get_response_cache()
+    if cache is None:
+        print("Cache de respostas desligado")
+    elif args.clear:
+        print(f"{cache.clear(args.endpoint)} páginas removidas de {cache.path}")
+    else:
+        for endpoint_name, stats in cache.stats().items():
+            print(f"{endpoint_name}: {stats['entries']} páginas ({stats['expired']} expiradas), "
+                  f"{stats['bytes'] / 2**20:.1f} MB, {stats['hits']} acertos")
@@ -0,0 +1,186 @@
+import argparse
+import logging
+import os
+import random
+import signal
+import sys
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import logging_config
+from api_manager import load_endpoints_config, make_api_call, export_metrics
+from collector import run_sweep, list_tenant_ids
+from access_manager import token_manager
+from db_pool import all_pool_stats
+from rate_limiter import all_limiter_stats
+from sharding import get_coordinator
+
+# Carregar a configuração de log para o daemon
+logger = logging_config.load_log_config('scheduler')
+
+# Agenda padrão, usada se o endpoints_config.json não tiver a chave "schedule"
+DEFAULT_SCHEDULE = {
+    "get_tenants": {"interval": 3600, "jitter": 60, "scope": "global"},
+    "get_alarms": {"interval": 60, "jitter": 5, "scope": "tenant"},
+    "get_network_link": {"interval": 300, "jitter": 15, "scope": "tenant"},
+    "get_devices_msp": {"interval": 300, "jitter": 15, "scope": "tenant"}
+}
+
+# Estado de agendamento de um endpoint
+class ScheduledJob:
+    def __init__(self, name, interval, jitter=0, scope="tenant"):
+        if scope not in ("tenant", "global"):
+            raise ValueError(f"Escopo {scope} desconhecido para o endpoint {name}")
+        self.name = name
+        self.interval = interval
+        self.jitter = jitter
+        self.scope = scope
+        # Primeira execução espalhada dentro do jitter, para os endpoints não dispararem todos juntos
+        self.next_run = time.monotonic() + random.uniform(0, jitter)
+        self.future = None
+        self.stats = {"runs": 0, "failures": 0, "skipped": 0, "last_duration": None}
+
+    def schedule_next(self):
+        self.next_run += self.interval + random.uniform(-self.jitter, self.jitter)
+        # Se atrasamos mais que um intervalo, não tenta "compensar" com execuções em sequência
+        self.next_run = max(self.next_run, time.monotonic())
+
+    @property
+    def running(self):
+        return self.future is not None and not self.future.done()
+
+# Daemon que mantém configurações, tokens, sessões HTTP e conexões aquecidos entre os ciclos
+class CollectorDaemon:
+    def __init__(self, url_base, username, password, schedule, max_workers=8, executor_type="thread", node_id=None):
+        self.url_base = url_base
+        self.username = username
+        self.password = password
+        self.max_workers = max_workers
+        self.executor_type = executor_type
+        self.jobs = {name: ScheduledJob(name, **settings) for name, settings in schedule.items()}
+        self.executor = ThreadPoolExecutor(max_workers=len(self.jobs), thread_name_prefix="scheduler")
+        self.stop_event = threading.Event()
+        self.tenant_ids = []
+        self.tenant_ids_lock = threading.Lock()
+        self.daemon_id = str(uuid.uuid4())
+        self.node_id = node_id
+
+    def refresh_tenants(self, execution_id):
+        tenant_ids = list_tenant_ids(self.url_base, self.username, self.password, execution_id)
+        with self.tenant_ids_lock:
+            self.tenant_ids = tenant_ids
+        logger.info(f"[UUID: {execution_id}] Lista de tenants atualizada: {len(tenant_ids)} tenants")
+
+    def run_job(self, job):
+        execution_id = str(uuid.uuid4())
+        started = time.monotonic()
+        try:
+            if job.name == "get_tenants":
+                self.refresh_tenants(execution_id)
+                ok = True
+            elif job.scope == "global":
+                ok = make_api_call(job.name, self.url_base, self.username, self.password, execution_id, paginate=True) is not None
+            else:
+                with self.tenant_ids_lock:
+                    tenant_ids = list(self.tenant_ids)
+                results = run_sweep(self.url_base, self.username, self.password, execution_id, endpoints=[job.name],
+                                    tenant_ids=tenant_ids, max_workers=self.max_workers, executor_type=self.executor_type)
+                failed = [result["tenant_id"] for result in results if not result["ok"]]
+                if failed:
+                    logger.warning(f"[UUID: {execution_id}] {job.name}: {len(failed)} de {len(results)} tenants falharam: {failed}")
+                ok = not failed
+        except (Exception, SystemExit) as e:
+            logger.error(f"[UUID: {execution_id}] Erro na execução agendada de {job.name}: {e!r}")
+            logger.error(traceback.format_exc())
+            ok = False
+
+        job.stats["runs"] += 1
+        job.stats["failures"] += 0 if ok else 1
+        job.stats["last_duration"] = round(time.monotonic() - started, 3)
+        logger.info(f"[UUID: {execution_id}] {job.name} concluído em {job.stats['last_duration']}s ({'OK' if ok else 'FALHA'})")
+        # No daemon as métricas são acumuladas desde o início; o textfile é atualizado a cada execução
+        export_metrics(execution_id, summary=False, cumulative=True)
+
+    def tick(self):
+        now = time.monotonic()
+        for job in self.jobs.values():
+            if now < job.next_run:
+                continue
+            if job.running:
+                # A execução anterior da mesma chave ainda não terminou: pula este ciclo em vez de empilhar
+                job.stats["skipped"] += 1
+                logger.warning(f"{job.name}: execução anterior ainda em andamento, ciclo pulado")
+            elif job.scope == "tenant" and not self.tenant_ids:
+                logger.warning(f"{job.name}: lista de tenants ainda vazia, ciclo pulado")
+            else:
+                job.future = self.executor.submit(self.run_job, job)
+            job.schedule_next()
+        return min(job.next_run for job in self.jobs.values())
+
+    def stop(self, signum=None, frame=None):
+        logger.info(f"Sinal {signum} recebido, encerrando após as execuções em andamento")
+        self.stop_event.set()
+
+    def run(self, drain_timeout=300):
+        # Registro do nó antes do primeiro token: com a divisão de tenants, os tokens ficam no diretório do nó
+        coordinator = get_coordinator(self.node_id)
+        # A lista de tenants é necessária antes dos endpoints por tenant
+        try:
+            self.refresh_tenants(str(uuid.uuid4()))
+        except (Exception, SystemExit) as e:
+            logger.error(f"Falha ao carregar a lista inicial de tenants: {e!r}")
+        if "get_tenants" in self.jobs:
+            self.jobs["get_tenants"].next_run = time.monotonic() + self.jobs["get_tenants"].interval
+
+        while not self.stop_event.is_set():
+            next_due = self.tick()
+            self.stop_event.wait(max(0.0, min(next_due - time.monotonic(), 1.0)))
+
+        # Drenar: aguarda as execuções em andamento, sem iniciar novas
+        running = [job.future for job in self.jobs.values() if job.running]
+        logger.info(f"Aguardando {len(running)} execuções em andamento (até {drain_timeout}s)")
+        _, pending = wait(running, timeout=drain_timeout)
+        if pending:
+            logger.warning(f"{len(pending)} execuções não terminaram dentro de {drain_timeout}s")
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if coordinator is not None:
+            try:
+                # Os outros nós assumem os tenants deste na hora, sem esperar os leases expirarem
+                coordinator.leave()
+            except Exception as e:
+                logger.error(f"Erro ao retirar o nó do anel: {e!r}")
+
+        logger.info(f"Estatísticas dos jobs: { {name: job.stats for name, job in self.jobs.items()} }")
+        logger.info(f"Tokens: {token_manager.stats()}")
+        logger.info(f"Pools: {all_pool_stats()}")
+        logger.info(f"Limitadores: {all_limiter_stats()}")
+        export_metrics(self.daemon_id, cumulative=True)
+        return not pending
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Daemon de coleta da API Huawei NCE com agendamento por endpoint")
+    parser.add_argument('--username', required=True, help="Username para autenticação")
+    parser.add_argument('--password', required=True, help="Password para autenticação")
+    parser.add_argument('--url_base', required=True, help="URL base da API")
+    parser.add_argument('--workers', type=int, default=8, help="Número máximo de workers por varredura")
+    parser.add_argument('--executor', choices=["thread", "process"], default="thread", help="Tipo de pool de workers das varreduras")
+    parser.add_argument('--drain_timeout', type=int, default=300, help="Tempo máximo (s) para concluir as execuções em andamento ao encerrar")
+    parser.add_argument('--node_id', help="Identificador deste nó coletor na divisão de tenants (padrão: hostname)")
+    args = parser.parse_args()
+
+    schedule = load_endpoints_config().get("schedule", DEFAULT_SCHEDULE)
+    daemon = CollectorDaemon(args.url_base, args.username, args.password, schedule,
+                             max_workers=args.workers, executor_type=args.executor, node_id=args.node_id)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+
+    logger.info(f"Daemon iniciado com a agenda: {schedule}")
+    if not daemon.run(drain_timeout=args.drain_timeout):
+        # Threads ainda em execução impediriam o encerramento normal do interpretador
+        logging_config.shutdown()
+        logging.shutdown()
+        os._exit(3)
+    sys.exit(0)
@@ -0,0 +1,349 @@
+import sys
+import argparse
+import traceback
+from datetime import datetime, timezone
+
+import psycopg2
+
+import logging_config
+from output_handler import (load_output_config, encode_db_connection, build_conflict_clause, field_expression,
+                            alarm_events_table_sql, partition_expression, ALARM_EVENT_ROLLUP_COLUMNS, TIMESTAMP_FUNCTION)
+from alarm_rollups import rollup_settings, rollup_tables_sql
+
+# Carregar a configuração de log para o gerenciador de esquema
+logger = logging_config.load_log_config('schema_manager')
+
+# Cria ou migra as tabelas JSONB dos handlers de banco a partir do output_handler_config.json:
+#   - índice único de expressão que casa com o ON CONFLICT de build_conflict_clause
+#   - colunas geradas (STORED) para os campos consultados com frequência, com índices
+#   - particionamento por faixa de tempo (ex.: alarms_huawei por time-created), com partições criadas com antecedência
+#   - tabela de eventos dos endpoints com state_tracking (transições de estado dos alarmes) e tabelas de rollup
+# Uso: python schema_manager.py [--endpoints get_alarms,get_devices_msp] [--dry_run]
+# Rodar periodicamente (ex.: cron mensal) para criar as próximas partições: python schema_manager.py --partitions_only
+
+# Tipos aceitos nas colunas geradas
+COLUMN_TYPES = ("text", "boolean", "integer", "bigint", "numeric", "timestamptz")
+
+# Função de conversão de timestamps: IMMUTABLE (exigido em colunas geradas e índices) porque fixa o fuso em UTC;
+# textos que não parecem um timestamp ISO 8601 viram NULL em vez de abortar a gravação da página
+TIMESTAMP_FUNCTION_SQL = rf"""
+    CREATE OR REPLACE FUNCTION {TIMESTAMP_FUNCTION}(value text) RETURNS timestamptz
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE SET TimeZone = 'UTC' AS $$
+        SELECT CASE WHEN value ~ '^\d{{4}}-\d{{2}}-\d{{2}}([ T]\d{{2}}:\d{{2}}|$)' THEN value::timestamptz END
+    $$;"""
+
+# Função para montar a expressão SQL de uma coluna gerada, convertida para o tipo configurado
+def column_expression(column):
+    expression, column_type = field_expression(column["field"]), column.get("type", "text")
+    if column_type not in COLUMN_TYPES:
+        raise ValueError(f"Tipo de coluna {column_type} não suportado, use um de {COLUMN_TYPES}")
+    if column_type == "text":
+        return expression
+    if column_type == "timestamptz":
+        return f"{TIMESTAMP_FUNCTION}({expression})"
+    return f"({expression})::{column_type}"
+
+# Função para calcular o início do período (dia ou mês) que contém um instante
+def period_start(moment, interval):
+    if interval == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == "month":
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Intervalo de partição {interval} desconhecido, use 'day' ou 'month'")
+
+def next_period(start, interval):
+    if interval == "day":
+        return datetime.fromordinal(start.toordinal() + 1).replace(tzinfo=timezone.utc)
+    return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+
+# Definição desejada de uma tabela, derivada do database_settings de um endpoint
+class TableSpec:
+    def __init__(self, database_settings):
+        self.table = database_settings["table"]
+        unique_field = database_settings.get("unique_field")
+        self.unique_field = [unique_field] if isinstance(unique_field, str) else unique_field
+        self.change_detection = database_settings.get("change_detection", False)
+        schema = database_settings.get("schema", {})
+        self.columns = schema.get("columns", {})
+        self.indexes = schema.get("indexes", [])
+        self.partition = schema.get("partition")
+        self.partition_column = self.partition["column"] if self.partition else None
+        # Tabela de eventos do rastreamento de estado de alarmes (AlarmStateOutputHandler)
+        state_tracking = database_settings.get("state_tracking")
+        self.events_table = (state_tracking.get("events_table", f"{self.table}_events")
+                             if state_tracking and state_tracking.get("enabled", True) else None)
+        self.rollups = rollup_settings(state_tracking, self.table) if self.events_table else None
+        if self.partition_column and self.columns.get(self.partition_column, {}).get("type") != "timestamptz":
+            raise ValueError(f"A coluna de partição {self.partition_column} de {self.table} deve ser timestamptz em schema.columns")
+
+    # Colunas geradas: todas as configuradas, menos a de partição (o PostgreSQL não aceita coluna gerada na chave)
+    @property
+    def generated_columns(self):
+        return {name: column for name, column in self.columns.items() if name != self.partition_column}
+
+    # Colunas gravadas pelo handler (as demais são geradas ou têm valor padrão)
+    @property
+    def stored_columns(self):
+        columns = ["data", "collected_at"]
+        if self.change_detection:
+            columns.append("data_hash")
+        if self.partition_column:
+            columns += [self.partition_column, "inserted_at"]
+        return columns
+
+    @property
+    def unique_index(self):
+        if not self.unique_field:
+            return None
+        conflict_fields = build_conflict_clause(self.unique_field)
+        if self.partition_column:
+            # Em tabelas particionadas, o índice único precisa incluir a chave de partição (o handler faz o mesmo no ON CONFLICT)
+            conflict_fields += f", {self.partition_column}"
+        return f"{self.table}_unique_key", conflict_fields
+
+    @property
+    def secondary_indexes(self):
+        return [(f"{self.table}_{'_'.join(columns)}_idx", ", ".join(columns)) for columns in self.indexes]
+
+    def column_definitions(self):
+        definitions = ["id bigserial", "data jsonb NOT NULL", "collected_at timestamptz NOT NULL DEFAULT NOW()"]
+        if self.change_detection:
+            definitions.append("data_hash text")
+        if self.partition_column:
+            # inserted_at não muda no upsert: é como o handler distingue inserções de atualizações na tabela particionada
+            definitions += [f"{self.partition_column} timestamptz NOT NULL", "inserted_at timestamptz NOT NULL DEFAULT NOW()"]
+        definitions += [self.generated_definition(name, column) for name, column in self.generated_columns.items()]
+        return definitions
+
+    def generated_definition(self, name, column):
+        return f"{name} {column.get('type', 'text')} GENERATED ALWAYS AS ({column_expression(column)}) STORED"
+
+# Aplica (ou, com dry_run, apenas lista) os comandos para deixar as tabelas como na configuração
+class SchemaManager:
+    def __init__(self, conn, dry_run=False):
+        self.conn = conn
+        self.dry_run = dry_run
+        self.cursor = conn.cursor()
+        self.statements = []
+
+    # always=True executa também no dry_run (comandos baratos dos quais as consultas seguintes dependem;
+    # a transação do dry_run é desfeita no final)
+    def execute(self, sql, params=None, always=False):
+        statement = self.cursor.mogrify(sql, params).decode("utf-8") if params else sql
+        self.statements.append(" ".join(statement.split()))
+        if always or not self.dry_run:
+            self.cursor.execute(sql, params)
+
+    # Consultas de leitura rodam também no dry_run (para decidir o que seria feito)
+    def query(self, sql, params=None):
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+
+    def relation_kind(self, name):
+        rows = self.query("SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                          "WHERE n.nspname = current_schema() AND c.relname = %s", (name,))
+        return rows[0][0] if rows else None
+
+    def existing_columns(self, table):
+        return {name for (name,) in self.query("SELECT column_name FROM information_schema.columns "
+                                               "WHERE table_schema = current_schema() AND table_name = %s", (table,))}
+
+    def existing_partitions(self, table):
+        return {name for (name,) in self.query("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                                               "WHERE i.inhparent = %s::regclass", (table,))}
+
+    def migrate(self, spec):
+        self.execute(TIMESTAMP_FUNCTION_SQL, always=True)
+        kind = self.relation_kind(spec.table)
+        if kind is None:
+            self.create_table(spec, spec.table, self.current_period(spec))
+        elif kind == "r" and spec.partition:
+            self.convert_to_partitioned(spec)
+        elif kind in ("r", "p"):
+            self.ensure_columns(spec)
+            self.ensure_indexes(spec)
+            if spec.partition:
+                self.ensure_partitions(spec)
+        else:
+            raise ValueError(f"{spec.table} existe, mas não é uma tabela (relkind {kind})")
+        if spec.events_table:
+            self.ensure_events_table(spec)
+            for statement in rollup_tables_sql(spec.rollups) if spec.rollups else []:
+                self.execute(statement)
+
+    def current_period(self, spec):
+        return period_start(datetime.now(timezone.utc), spec.partition.get("interval", "month")) if spec.partition else None
+
+    def create_table(self, spec, table, first_period):
+        primary_key = f"PRIMARY KEY (id, {spec.partition_column})" if spec.partition else "PRIMARY KEY (id)"
+        partition_clause = f" PARTITION BY RANGE ({spec.partition_column})" if spec.partition else ""
+        definitions = ",\n    ".join(spec.column_definitions() + [primary_key])
+        self.execute(f"CREATE TABLE {table} (\n    {definitions}\n){partition_clause};")
+        self.ensure_indexes(spec)
+        if spec.partition:
+            self.ensure_partitions(spec, first_period)
+
+    def ensure_columns(self, spec):
+        existing = self.existing_columns(spec.table)
+        if "collected_at" not in existing:
+            self.execute(f"ALTER TABLE {spec.table} ADD COLUMN collected_at timestamptz NOT NULL DEFAULT NOW();")
+        if spec.change_detection and "data_hash" not in existing:
+            self.execute(f"ALTER TABLE {spec.table} ADD COLUMN data_hash text;")
+        for name, column in spec.generated_columns.items():
+            if name not in existing:
+                # Reescreve a tabela: em tabelas grandes, rodar fora do horário de coleta
+                self.execute(f"ALTER TABLE {spec.table} ADD COLUMN {spec.generated_definition(name, column)};")
+
+    def ensure_events_table(self, spec):
+        # Tabela de eventos anterior aos rollups: só as colunas que faltam são acrescentadas
+        if self.relation_kind(spec.events_table) is not None:
+            existing = self.existing_columns(spec.events_table)
+            for name, column_type in ALARM_EVENT_ROLLUP_COLUMNS.items():
+                if name not in existing:
+                    self.execute(f"ALTER TABLE {spec.events_table} ADD COLUMN {name} {column_type};")
+        for statement in alarm_events_table_sql(spec.events_table):
+            self.execute(statement)
+
+    def ensure_indexes(self, spec):
+        # Em tabelas particionadas, o índice criado na tabela principal é replicado em cada partição
+        if spec.unique_index:
+            name, expressions = spec.unique_index
+            self.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {spec.table} ({expressions});")
+        for name, columns in spec.secondary_indexes:
+            self.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {spec.table} ({columns});")
+
+    def ensure_partitions(self, spec, first_period=None):
+        interval = spec.partition.get("interval", "month")
+        suffix_format = "%Y_%m_%d" if interval == "day" else "%Y_%m"
+        existing = set() if self.dry_run and self.relation_kind(spec.table) != "p" else self.existing_partitions(spec.table)
+        default_partition = f"{spec.table}_default"
+
+        period = first_period or self.current_period(spec)
+        last = self.current_period(spec)
+        for _ in range(spec.partition.get("premake", 3)):
+            last = next_period(last, interval)
+        while period <= last:
+            end = next_period(period, interval)
+            name = f"{spec.table}_p{period.strftime(suffix_format)}"
+            if name not in existing:
+                self.create_partition(spec, name, period, end, default_partition if default_partition in existing else None)
+            period = end
+        if default_partition not in existing:
+            # Linhas fora das partições criadas (ex.: alarmes muito antigos) vão para a partição padrão
+            self.execute(f"CREATE TABLE {default_partition} PARTITION OF {spec.table} DEFAULT;")
+
+    def create_partition(self, spec, name, start, end, default_partition):
+        bounds = f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        has_rows = default_partition and self.query(
+            f"SELECT 1 FROM {default_partition} WHERE {spec.partition_column} >= %s AND {spec.partition_column} < %s LIMIT 1",
+            (start, end))
+        if not has_rows:
+            self.execute(f"CREATE TABLE {name} PARTITION OF {spec.table} FOR VALUES {bounds};")
+            return
+        # A partição padrão já tem linhas da faixa: desanexá-la, criar a partição e mover as linhas antes de reanexar
+        columns = ", ".join(["id"] + spec.stored_columns)
+        self.execute(f"ALTER TABLE {spec.table} DETACH PARTITION {default_partition};")
+        self.execute(f"CREATE TABLE {name} PARTITION OF {spec.table} FOR VALUES {bounds};")
+        self.execute(f"""
+            WITH moved AS (
+                DELETE FROM {default_partition} WHERE {spec.partition_column} >= %s AND {spec.partition_column} < %s
+                RETURNING {columns}
+            )
+            INSERT INTO {spec.table} ({columns}) SELECT {columns} FROM moved;""", (start, end))
+        self.execute(f"ALTER TABLE {spec.table} ATTACH PARTITION {default_partition} DEFAULT;")
+
+    def convert_to_partitioned(self, spec):
+        # Tabela comum existente: renomeada para _legacy, recriada particionada e com os dados copiados
+        legacy = f"{spec.table}_legacy"
+        if self.relation_kind(legacy):
+            raise ValueError(f"{legacy} já existe; remova-a (ou renomeie) antes de migrar {spec.table}")
+        time_field = field_expression(spec.columns[spec.partition_column]["field"])
+        oldest = self.query(f"SELECT min({TIMESTAMP_FUNCTION}({time_field})) FROM {spec.table}")[0][0]
+        interval = spec.partition.get("interval", "month")
+        first_period = period_start(oldest.astimezone(timezone.utc), interval) if oldest else self.current_period(spec)
+        if spec.partition.get("start"):
+            # Início mínimo configurado: dados mais antigos ficam na partição padrão
+            first_period = max(first_period, period_start(datetime.fromisoformat(spec.partition["start"]).replace(tzinfo=timezone.utc), interval))
+
+        legacy_columns = self.existing_columns(spec.table)
+        # Índices com os nomes que a nova tabela vai usar (ex.: de uma execução anterior sem particionamento) são renomeados
+        managed_indexes = {name for name, _ in ([spec.unique_index] if spec.unique_index else []) + spec.secondary_indexes}
+        legacy_indexes = [name for (name,) in self.query("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() "
+                                                         "AND tablename = %s", (spec.table,)) if name in managed_indexes]
+        self.execute(f"ALTER TABLE {spec.table} RENAME TO {legacy};")
+        for index_name in legacy_indexes:
+            self.execute(f"ALTER INDEX {index_name} RENAME TO {index_name[:56]}_legacy;")
+        self.create_table(spec, spec.table, first_period)
+
+        values = {
+            "data": "data",
+            "collected_at": "collected_at" if "collected_at" in legacy_columns else "NOW()",
+            "data_hash": "data_hash" if "data_hash" in legacy_columns else "NULL",
+            # Linhas sem o campo de tempo vão para a partição padrão, como na gravação (ver MISSING_PARTITION_VALUE)
+            spec.partition_column: partition_expression(time_field),
+            "inserted_at": "collected_at" if "collected_at" in legacy_columns else "NOW()",
+        }
+        columns = spec.stored_columns
+        self.execute(f"""
+            INSERT INTO {spec.table} ({', '.join(columns)})
+            SELECT {', '.join(values[column] for column in columns)}
+            FROM {legacy}
+            ON CONFLICT DO NOTHING;""")
+        if not self.dry_run:
+            logger.info("%s migrada para tabela particionada (%d linhas copiadas); dados originais mantidos em %s",
+                        spec.table, self.cursor.rowcount, legacy)
+
+# Função para listar as tabelas (database_settings com db_name) configuradas, por banco
+def configured_tables(output_config, endpoints=None):
+    tables = {}
+    for endpoint_name, handler_config in output_config.items():
+        if endpoint_name in ("databases", "default") or (endpoints and endpoint_name not in endpoints):
+            continue
+        settings = handler_config.get("database_settings")
+        if handler_config.get("type") == "database" and settings and settings.get("table"):
+            tables.setdefault(settings["db_name"], {})[settings["table"]] = settings
+    return tables
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Criar ou migrar as tabelas dos handlers de banco a partir do output_handler_config.json")
+    parser.add_argument('--endpoints', help="Endpoints cujas tabelas serão migradas (use vírgula para separar valores; padrão: todos)")
+    parser.add_argument('--db_connection', help="String de conexão que substitui a do output_handler_config.json")
+    parser.add_argument('--dry_run', action='store_true', help="Apenas mostrar os comandos, sem alterar o banco")
+    parser.add_argument('--partitions_only', action='store_true', help="Apenas criar as próximas partições das tabelas particionadas")
+    args = parser.parse_args()
+
+    output_config = load_output_config()
+    failed = False
+    for db_name, tables in configured_tables(output_config, args.endpoints.split(",") if args.endpoints else None).items():
+        db_connection = args.db_connection or output_config["databases"][db_name]["db_connection"]
+        conn = psycopg2.connect(encode_db_connection(db_connection))
+        try:
+            for table, settings in tables.items():
+                spec = TableSpec(settings)
+                if args.partitions_only and not spec.partition:
+                    continue
+                manager = SchemaManager(conn, dry_run=args.dry_run)
+                try:
+                    if args.partitions_only:
+                        manager.ensure_partitions(spec)
+                    else:
+                        manager.migrate(spec)
+                except Exception as e:
+                    # Cada tabela em sua transação: uma falha (ex.: duplicatas impedindo o índice único) não desfaz as outras
+                    conn.rollback()
+                    failed = True
+                    logger.error("Falha ao migrar %s: %s", table, e)
+                    logger.debug(traceback.format_exc())
+                    print(f"-- {table}: FALHA: {e}", file=sys.stderr)
+                    continue
+                if args.dry_run:
+                    conn.rollback()
+                else:
+                    conn.commit()
+                    logger.info("Tabela %s migrada: %d comandos", table, len(manager.statements))
+                print(f"-- {table} ({db_name}): {len(manager.statements)} comandos{' (dry run)' if args.dry_run else ''}")
+                for statement in manager.statements:
+                    print(f"{statement};" if not statement.endswith(";") else statement)
+        finally:
+            conn.close()
+    sys.exit(1 if failed else 0)
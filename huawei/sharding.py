@@ -0,0 +1,291 @@
+import os
+import sys
+import json
+import time
+import bisect
+import socket
+import hashlib
+import argparse
+import threading
+import traceback
+
+import logging_config
+import metrics
+import access_manager
+from api_manager import load_endpoints_config, output_config
+from output_handler import encode_db_connection, invalidate_alarm_state
+from db_pool import get_pool
+
+# Carregar a configuração de log para a divisão de tenants entre coletores
+logger = logging_config.load_log_config('sharding')
+
+# Divisão dos tenants entre vários coletores (nós): cada nó registra um heartbeat na tabela collector_nodes do
+# monitoring_db, monta um anel de hash consistente com os nós vivos e fica com os tenants que caem no seu trecho.
+# Antes de coletar, o nó obtém um lease de cada tenant em tenant_leases: o lease só muda de dono quando o atual o
+# libera (o tenant saiu do seu trecho) ou deixa expirar (o nó morreu), então um tenant nunca é coletado por dois
+# nós ao mesmo tempo durante o rebalanceamento. Os leases são renovados pelo heartbeat enquanto o nó está vivo.
+# Todos os prazos usam o relógio do PostgreSQL (NOW()), não o de cada nó.
+# Cada nó guarda seus tokens em um diretório próprio (token_dir), sem disputar os arquivos de config/.
+# Com watermarks em arquivo ("store": "file"), um tenant que muda de nó recomeça pela janela inicial; com vários
+# nós, use "store": "database" na coleta incremental.
+# Desligada por padrão: com um só coletor não há o que dividir, e ligada ela exige as tabelas de nós e leases no
+# monitoring_db e move os tokens para token_dir (execuções avulsas do api_manager.py seguem usando os de config/).
+# Configuração na chave "sharding" do endpoints_config.json ("enabled": true em todos os nós). Em execuções avulsas
+# (cron), use node_ttl maior que o intervalo entre as execuções, para o nó continuar no anel entre uma e outra.
+# Uso: python sharding.py (estado dos nós) | --leave [--node_id coletor-2]
+
+DEFAULT_SHARDING_SETTINGS = {
+    "enabled": False,
+    "db_name": "monitoring_db",
+    "node_id": None,                      # padrão: hostname
+    "vnodes": 64,                         # pontos de cada nó no anel
+    "heartbeat_interval": 15,
+    "node_ttl": 60,                       # sem heartbeat há node_ttl s, o nó sai do anel
+    "lease_ttl": 120,                     # lease não renovado há lease_ttl s pode ser tomado por outro nó
+    "token_dir": "state/tokens/{node_id}"
+}
+
+NODES_TABLE = "collector_nodes"
+LEASES_TABLE = "tenant_leases"
+
+# Anel de hash consistente: cada nó ocupa vnodes pontos; a entrada de um nó ou a saída de outro só move os
+# tenants dos trechos vizinhos
+class HashRing:
+    def __init__(self, nodes, vnodes=64):
+        self.points = sorted((ring_hash(f"{node}#{replica}"), node) for node in nodes for replica in range(vnodes))
+        self.hashes = [point for point, _ in self.points]
+
+    def node_for(self, key):
+        if not self.points:
+            return None
+        position = bisect.bisect(self.hashes, ring_hash(key)) % len(self.points)
+        return self.points[position][1]
+
+# Função para posicionar uma chave no anel (64 bits do MD5, estável entre processos e versões do Python)
+def ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+# Função para carregar a configuração "sharding", mesclada com os valores padrão
+def load_sharding_settings():
+    return {**DEFAULT_SHARDING_SETTINGS, **load_endpoints_config().get("sharding", {})}
+
+class ShardCoordinator:
+    def __init__(self, settings):
+        self.settings = {**DEFAULT_SHARDING_SETTINGS, **settings}
+        self.node_id = self.settings["node_id"] or socket.gethostname()
+        database_config = output_config['databases'][self.settings["db_name"]]
+        self.pool = get_pool(self.settings["db_name"], encode_db_connection(database_config['db_connection']),
+                             **database_config.get('pool', {}))
+        self.stats = {"hostname": socket.gethostname(), "pid": os.getpid(), "tenants_assigned": 0, "tenants_leased": 0,
+                      "sweeps": 0, "last_sweep_seconds": None, "items_per_second": None}
+        self.stats_lock = threading.Lock()
+        self.last_nodes = None
+        self.started = False
+        self.last_items = (time.monotonic(), self.items_total())
+        self.stop_event = threading.Event()
+        self.heartbeat_thread = None
+
+    def ensure_tables(self):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {NODES_TABLE} (
+                        node_id text PRIMARY KEY,
+                        started_at timestamptz NOT NULL DEFAULT NOW(),
+                        heartbeat_at timestamptz NOT NULL DEFAULT NOW(),
+                        stats jsonb NOT NULL DEFAULT '{{}}'
+                    );
+                    CREATE TABLE IF NOT EXISTS {LEASES_TABLE} (
+                        tenant_id text PRIMARY KEY,
+                        node_id text NOT NULL,
+                        acquired_at timestamptz NOT NULL DEFAULT NOW(),
+                        expires_at timestamptz NOT NULL
+                    );
+                    CREATE INDEX IF NOT EXISTS {LEASES_TABLE}_node_id_idx ON {LEASES_TABLE} (node_id);""")
+            conn.commit()
+
+    def start(self):
+        # Tokens no diretório do nó: nós que compartilham o diretório de instalação não disputam os mesmos arquivos
+        # (antes do banco: vale também enquanto o registro falha e é refeito no claim seguinte)
+        if self.settings["token_dir"]:
+            access_manager.set_token_dir(self.settings["token_dir"].format(node_id=self.node_id))
+        self.ensure_tables()
+        self.heartbeat()
+        self.heartbeat_thread = threading.Thread(target=self.run_heartbeat, name="shard-heartbeat", daemon=True)
+        self.heartbeat_thread.start()
+        self.started = True
+        logger.info("Nó %s registrado em %s (%s)", self.node_id, NODES_TABLE, self.settings)
+
+    def items_total(self):
+        return sum(value for name, _, value in metrics.registry.snapshot()["counters"] if name == "items_total")
+
+    def heartbeat(self):
+        # Vazão do nó: itens recebidos desde o heartbeat anterior
+        now, items = time.monotonic(), self.items_total()
+        with self.stats_lock:
+            since, previous = self.last_items
+            if now - since >= 1:
+                self.stats["items_per_second"] = round((items - previous) / (now - since), 1)
+                self.last_items = (now, items)
+            stats = json.dumps(self.stats)
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    INSERT INTO {NODES_TABLE} (node_id, heartbeat_at, stats) VALUES (%s, NOW(), %s)
+                    ON CONFLICT (node_id) DO UPDATE SET heartbeat_at = NOW(), stats = EXCLUDED.stats;""", (self.node_id, stats))
+                cursor.execute(f"UPDATE {LEASES_TABLE} SET expires_at = NOW() + make_interval(secs => %s) WHERE node_id = %s",
+                               (self.settings["lease_ttl"], self.node_id))
+            conn.commit()
+
+    def run_heartbeat(self):
+        while not self.stop_event.wait(self.settings["heartbeat_interval"]):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error("Erro no heartbeat do nó %s: %r", self.node_id, e)
+                logger.debug(traceback.format_exc())
+
+    def live_nodes(self, cursor):
+        cursor.execute(f"SELECT node_id FROM {NODES_TABLE} WHERE heartbeat_at > NOW() - make_interval(secs => %s)",
+                       (self.settings["node_ttl"],))
+        return sorted({row[0] for row in cursor.fetchall()} | {self.node_id})
+
+    # Função para obter os tenants que este nó deve coletar agora: os do seu trecho do anel cujo lease ele obteve
+    def claim(self, tenant_ids, execution_id):
+        try:
+            if not self.started:
+                self.start()
+            else:
+                self.heartbeat()
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    nodes = self.live_nodes(cursor)
+                    ring = HashRing(nodes, self.settings["vnodes"])
+                    assigned = [tenant_id for tenant_id in tenant_ids if ring.node_for(tenant_id) == self.node_id]
+                    # Tenants que saíram do trecho do nó: o lease é liberado para o novo dono
+                    cursor.execute(f"DELETE FROM {LEASES_TABLE} WHERE node_id = %s AND NOT (tenant_id = ANY(%s))",
+                                   (self.node_id, assigned))
+                    released = cursor.rowcount
+                    # O lease só é tomado se for deste nó ou já tiver expirado (nó anterior morto)
+                    cursor.execute(f"""
+                        INSERT INTO {LEASES_TABLE} (tenant_id, node_id, acquired_at, expires_at)
+                        SELECT tenant_id, %s, NOW(), NOW() + make_interval(secs => %s) FROM unnest(%s::text[]) AS tenant_id
+                        ON CONFLICT (tenant_id) DO UPDATE SET node_id = EXCLUDED.node_id, expires_at = EXCLUDED.expires_at,
+                            acquired_at = CASE WHEN {LEASES_TABLE}.node_id = EXCLUDED.node_id THEN {LEASES_TABLE}.acquired_at ELSE NOW() END
+                        WHERE {LEASES_TABLE}.node_id = EXCLUDED.node_id OR {LEASES_TABLE}.expires_at < NOW()
+                        RETURNING tenant_id, acquired_at = NOW();""", (self.node_id, self.settings["lease_ttl"], assigned))
+                    rows = cursor.fetchall()
+                    leased = {row[0] for row in rows}
+                    acquired = {tenant_id for tenant_id, new in rows if new}
+                conn.commit()
+        except Exception as e:
+            # Sem o banco, só o trecho do nó no último anel conhecido, sem leases; sem anel conhecido (o banco nunca
+            # respondeu), nenhum tenant: coletar todos duplicaria a coleta dos outros nós
+            metrics.inc("shard_claim_errors_total", node=self.node_id)
+            fallback = []
+            if self.last_nodes is not None:
+                ring = HashRing(self.last_nodes, self.settings["vnodes"])
+                fallback = [tenant_id for tenant_id in tenant_ids if ring.node_for(tenant_id) == self.node_id]
+            logger.error("[UUID: %s] Erro ao obter os leases do nó %s: %r; usando %d de %d tenants (%s)", execution_id, self.node_id,
+                         e, len(fallback), len(tenant_ids), "último anel conhecido" if self.last_nodes is not None else "varredura pulada")
+            logger.debug(traceback.format_exc())
+            return fallback
+
+        claimed = [tenant_id for tenant_id in tenant_ids if tenant_id in leased]
+        self.last_nodes = nodes
+        # Tenants que acabaram de mudar para este nó foram gravados por outro: o estado de alarmes em memória é descartado
+        if acquired:
+            dropped = invalidate_alarm_state(acquired)
+            logger.info("[UUID: %s] Nó %s assumiu %d tenants; %d alarmes descartados do índice de estado", execution_id,
+                        self.node_id, len(acquired), dropped)
+        with self.stats_lock:
+            self.stats["tenants_assigned"], self.stats["tenants_leased"] = len(assigned), len(claimed)
+        metrics.set_gauge("shard_nodes", len(nodes), node=self.node_id)
+        metrics.set_gauge("shard_tenants", len(assigned), node=self.node_id, state="assigned")
+        metrics.set_gauge("shard_tenants", len(claimed), node=self.node_id, state="leased")
+        logger.info("[UUID: %s] Nó %s: %d nós vivos, %d de %d tenants no trecho, %d com lease, %d aguardando lease, %d liberados",
+                    execution_id, self.node_id, len(nodes), len(assigned), len(tenant_ids), len(claimed),
+                    len(assigned) - len(claimed), released)
+        return claimed
+
+    def record_sweep(self, elapsed):
+        with self.stats_lock:
+            self.stats["sweeps"] += 1
+            self.stats["last_sweep_seconds"] = round(elapsed, 3)
+        metrics.observe("shard_sweep_seconds", elapsed, node=self.node_id)
+
+    # Saída do nó (encerramento do daemon): remove o heartbeat e libera os leases na hora, sem esperar os prazos
+    def leave(self):
+        self.stop_event.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join(timeout=5)
+        release_node(self.pool, self.node_id)
+        logger.info("Nó %s saiu do anel", self.node_id)
+
+# Função para remover um nó e liberar seus leases
+def release_node(pool, node_id):
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {LEASES_TABLE} WHERE node_id = %s", (node_id,))
+            cursor.execute(f"DELETE FROM {NODES_TABLE} WHERE node_id = %s", (node_id,))
+        conn.commit()
+
+_coordinator = None
+_coordinator_lock = threading.Lock()
+
+# Função para obter o coordenador do processo (registrado e com heartbeat); None se a divisão estiver desligada
+# node_id sobrepõe o da configuração (ex.: vários coletores no mesmo host); vale na primeira chamada
+def get_coordinator(node_id=None):
+    global _coordinator
+    with _coordinator_lock:
+        if _coordinator is None:
+            settings = load_sharding_settings()
+            if node_id:
+                settings["node_id"] = node_id
+            if not settings["enabled"]:
+                _coordinator = False
+                return None
+            coordinator = ShardCoordinator(settings)
+            try:
+                coordinator.start()
+            except Exception as e:
+                # Sem o banco o nó fica sem tenants (ver claim) e o registro é tentado de novo a cada varredura
+                logger.error("Erro ao registrar o nó coletor: %r", e)
+                logger.debug(traceback.format_exc())
+            _coordinator = coordinator
+        return _coordinator or None
+
+# Após um fork, o processo filho não herda o coordenador (o heartbeat é do pai)
+def _reset_after_fork():
+    global _coordinator, _coordinator_lock
+    _coordinator_lock = threading.Lock()
+    _coordinator = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consultar os nós coletores e a divisão dos tenants")
+    parser.add_argument('--leave', action='store_true', help="Remover o nó do anel e liberar seus leases (ex.: nó desativado)")
+    parser.add_argument('--node_id', help="Nó removido por --leave (padrão: o deste host)")
+    args = parser.parse_args()
+
+    settings = load_sharding_settings()
+    database_config = output_config['databases'][settings["db_name"]]
+    pool = get_pool(settings["db_name"], encode_db_connection(database_config['db_connection']), **database_config.get('pool', {}))
+    if args.leave:
+        release_node(pool, args.node_id or settings["node_id"] or socket.gethostname())
+        sys.exit(0)
+
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT n.node_id, EXTRACT(EPOCH FROM NOW() - n.heartbeat_at), n.stats, COUNT(l.tenant_id)
+                FROM {NODES_TABLE} n LEFT JOIN {LEASES_TABLE} l ON l.node_id = n.node_id AND l.expires_at > NOW()
+                GROUP BY n.node_id ORDER BY n.node_id""")
+            rows = cursor.fetchall()
+        conn.rollback()
+    for node_id, age, stats, leases in rows:
+        state = "vivo" if age <= settings["node_ttl"] else "inativo"
+        print(f"{node_id}: {state} (heartbeat há {age:.0f}s), {leases} leases, {stats.get('tenants_assigned')} tenants no trecho, "
+              f"{stats.get('items_per_second')} itens/s, última varredura: {stats.get('last_sweep_seconds')} s")
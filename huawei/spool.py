@@ -0,0 +1,337 @@
+import os
+import sys
+import json
+import time
+import uuid
+import fcntl
+import argparse
+import threading
+import traceback
+from datetime import datetime, timezone
+
+import logging_config
+import metrics
+
+# Carregar a configuração de log para o spool
+logger = logging_config.load_log_config('spool')
+
+# Spool local, somente acréscimo, das páginas que não puderam ser gravadas no banco (PostgreSQL fora do ar,
+# lento ou em manutenção): em vez de descartar a página e buscá-la de novo no controlador no próximo ciclo,
+# o DatabaseOutputHandler a grava aqui e a considera salva. Só falhas de conexão vão para o spool; erros do próprio
+# comando (ver is_connection_error em output_handler.py) se repetiriam no replay e deixam a página como não gravada.
+# O replay drena o spool em lote, do segmento mais antigo para o mais novo, quando o banco volta; um registro que o
+# banco recusa (mesmo sozinho) vai para rejected/ em vez de bloquear os seguintes. Enquanto houver segmentos pendentes,
+# o handler drena o spool antes de voltar a gravar direto no banco, para uma página nova nunca passar à frente de uma antiga.
+# Formato: segmentos NDJSON ({seq}-{pid}.ndjson), um registro (página) por linha; o segmento ativo de cada
+# processo tem o sufixo .open e é selado ao atingir segment_bytes ou segment_seconds.
+# Configuração em output_handler_config.json, na chave "spool" do banco (ao lado de "pool").
+# Uso: python spool.py --status | --replay [--db_name monitoring_db]
+
+DEFAULT_SPOOL_SETTINGS = {
+    "enabled": True,
+    "directory": "spool/{db_name}",
+    "segment_bytes": 64 * 1024 * 1024,
+    "segment_seconds": 300,           # idade máxima do segmento ativo antes de ser selado (e poder ser drenado)
+    "max_bytes": 2 * 1024 * 1024 * 1024,
+    "fsync": "always",                # always (a cada registro), interval (a cada fsync_interval s) ou never
+    "fsync_interval": 1.0,
+    "retry_interval": 30,             # após uma falha ou replay incompleto, por quanto tempo (s) as páginas vão direto para o spool
+    "replay_batch_items": 5000,
+    # Páginas em streaming: itens copiados em memória durante a gravação, para ir ao spool se ela falhar (o custo é o
+    # da página decodificada por inteiro); uma página maior que isso que falhe fica como não gravada
+    "buffer_items": 50000
+}
+
+FSYNC_POLICIES = ("always", "interval", "never")
+SEALED_SUFFIX = ".ndjson"
+OPEN_SUFFIX = ".ndjson.open"
+REJECTED_DIR = "rejected"         # registros recusados pelo banco no replay (ex.: item que viola uma restrição)
+
+class SpoolFull(Exception):
+    """O spool atingiu max_bytes; a página não foi guardada."""
+
+class DatabaseUnavailable(Exception):
+    """Sem conexão com o banco durante o replay; o segmento fica para a próxima tentativa."""
+
+# Função para verificar se um processo ainda existe (dono de um segmento .open)
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class Spool:
+    def __init__(self, name, settings):
+        self.name = name
+        self.settings = {**DEFAULT_SPOOL_SETTINGS, **settings}
+        if self.settings["fsync"] not in FSYNC_POLICIES:
+            raise ValueError(f"Política de fsync {self.settings['fsync']} desconhecida, use uma de {FSYNC_POLICIES}")
+        self.directory = self.settings["directory"].format(db_name=name)
+        self.lock = threading.Lock()
+        self.active = None          # arquivo do segmento ativo deste processo
+        self.active_path = None
+        self.active_bytes = 0
+        self.active_since = 0.0
+        self.last_fsync = 0.0
+        self.pid = os.getpid()
+        self.bypass_until = 0.0     # até quando as páginas vão direto para o spool (após uma falha no banco)
+
+    def segments(self, include_open=False):
+        if not os.path.isdir(self.directory):
+            return []
+        suffixes = (SEALED_SUFFIX, OPEN_SUFFIX) if include_open else (SEALED_SUFFIX,)
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(suffixes))
+
+    def size(self):
+        total = 0
+        for path in self.segments(include_open=True):
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return total
+
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Nome ordenável pelo instante de criação: o replay segue a ordem dos nomes (mais antigo primeiro)
+        self.active_path = os.path.join(self.directory, f"{time.time_ns():020d}-{self.pid}{OPEN_SUFFIX}")
+        self.active = open(self.active_path, "ab")
+        self.active_bytes = 0
+        self.active_since = time.monotonic()
+
+    def _seal(self):
+        if self.active is None:
+            return
+        self.active.flush()
+        if self.settings["fsync"] != "never":
+            os.fsync(self.active.fileno())
+        self.active.close()
+        if self.active_bytes:
+            os.replace(self.active_path, self.active_path[:-len(".open")])
+        else:
+            os.unlink(self.active_path)
+        self.active = self.active_path = None
+
+    def seal(self):
+        with self.lock:
+            self._seal()
+
+    # Acrescenta uma página ao spool; devolve o número de bytes gravados ou levanta SpoolFull
+    def append(self, endpoint_name, response_key, items, tenant_id=None):
+        record = {"endpoint": endpoint_name, "response_key": response_key, "tenant_id": tenant_id or None,
+                  "spooled_at": datetime.now(timezone.utc).isoformat(), "items": items}
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self.lock:
+            if os.getpid() != self.pid:
+                # Processo filho (fork): segmento próprio, o do pai continua sendo do pai
+                self.pid, self.active, self.active_path = os.getpid(), None, None
+            size = self.size()
+            if size + len(line) > self.settings["max_bytes"]:
+                metrics.inc("spool_records_total", spool=self.name, endpoint=endpoint_name, result="full")
+                raise SpoolFull(f"Spool {self.name} cheio ({self.settings['max_bytes']} bytes)")
+            if self.active is not None and (self.active_bytes >= self.settings["segment_bytes"]
+                                            or time.monotonic() - self.active_since >= self.settings["segment_seconds"]):
+                self._seal()
+            if self.active is None:
+                self._open_segment()
+            self.active.write(line)
+            self.active.flush()
+            self.active_bytes += len(line)
+            now = time.monotonic()
+            if self.settings["fsync"] == "always" or (self.settings["fsync"] == "interval"
+                                                      and now - self.last_fsync >= self.settings["fsync_interval"]):
+                os.fsync(self.active.fileno())
+                self.last_fsync = now
+        metrics.set_gauge("spool_bytes", size + len(line), spool=self.name)
+        metrics.inc("spool_records_total", spool=self.name, endpoint=endpoint_name, result="spooled")
+        metrics.inc("spool_items_total", len(items), spool=self.name, endpoint=endpoint_name)
+        return len(line)
+
+    # Segmentos prontos para o replay: os selados e os .open de processos que já terminaram
+    def replayable_segments(self):
+        self.seal()
+        for path in self.segments(include_open=True):
+            if path.endswith(OPEN_SUFFIX):
+                pid = int(os.path.basename(path).split("-")[1].split(".")[0])
+                if process_alive(pid):
+                    continue
+                sealed = path[:-len(".open")]
+                os.replace(path, sealed)
+                path = sealed
+            yield path
+
+    # Guarda em rejected/ um registro recusado pelo banco no replay, para análise (e, corrigida a causa, novo replay manual)
+    def reject(self, path, record):
+        directory = os.path.join(self.directory, REJECTED_DIR)
+        os.makedirs(directory, exist_ok=True)
+        line = json.dumps({**record, "rejected_at": datetime.now(timezone.utc).isoformat()}, separators=(",", ":")) + "\n"
+        with open(os.path.join(directory, os.path.basename(path)), "ab") as rejected:
+            rejected.write(line.encode("utf-8"))
+            rejected.flush()
+            if self.settings["fsync"] != "never":
+                os.fsync(rejected.fileno())
+        metrics.inc("spool_records_total", spool=self.name, endpoint=record["endpoint"], result="rejected")
+        logger.error("Registro de %s (%d itens) recusado pelo banco no replay do spool %s; movido para %s",
+                     record["endpoint"], len(record["items"]), self.name, directory)
+
+    def rejected_records(self):
+        directory = os.path.join(self.directory, REJECTED_DIR)
+        if not os.path.isdir(directory):
+            return 0
+        total = 0
+        for name in os.listdir(directory):
+            with open(os.path.join(directory, name), "rb") as rejected:
+                total += sum(1 for _ in rejected)
+        return total
+
+    # Drena o spool em lote, do segmento mais antigo para o mais novo; save(endpoint, response_key, items) deve
+    # devolver True se gravou, False se o banco recusou os itens e levantar DatabaseUnavailable sem conexão com o banco.
+    # Sem conexão, o replay para e mantém o segmento atual; itens recusados vão para rejected/ e o replay continua.
+    def replay(self, save):
+        os.makedirs(self.directory, exist_ok=True)
+        summary = {"segments": 0, "records": 0, "items": 0, "rejected": 0, "skipped_lines": 0, "complete": True}
+        with open(os.path.join(self.directory, ".replay.lock"), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info("Replay do spool %s já em andamento em outro processo", self.name)
+                summary["complete"] = False
+                return summary
+            started = time.perf_counter()
+            try:
+                for path in sorted(self.replayable_segments()):
+                    self.replay_segment(path, save, summary)
+                    os.unlink(path)
+                    summary["segments"] += 1
+            except DatabaseUnavailable as e:
+                logger.warning("Replay do spool %s interrompido, banco indisponível: %s", self.name, e)
+                summary["complete"] = False
+            metrics.observe("spool_replay_seconds", time.perf_counter() - started, spool=self.name)
+        metrics.set_gauge("spool_bytes", self.size(), spool=self.name)
+        if summary["records"] or summary["rejected"] or not summary["complete"]:
+            logger.info("Replay do spool %s: %s", self.name, summary)
+        return summary
+
+    def replay_segment(self, path, save, summary):
+        batch_items = self.settings["replay_batch_items"]
+        pending = {}  # (endpoint, response_key) -> [registros, itens acumulados]
+
+        def replayed(key, records, items):
+            summary["records"] += len(records)
+            summary["items"] += items
+            metrics.inc("spool_records_total", len(records), spool=self.name, endpoint=key[0], result="replayed")
+            metrics.inc("spool_items_replayed_total", items, spool=self.name, endpoint=key[0])
+
+        def flush(key):
+            records, items = pending.pop(key)
+            if save(key[0], key[1], items):
+                replayed(key, records, len(items))
+                return
+            # Lote recusado pelo banco: cada registro é tentado sozinho e o que falhar de novo vai para rejected/,
+            # sem bloquear o restante do segmento nem os segmentos seguintes
+            for record in records:
+                if save(key[0], key[1], record["items"]):
+                    replayed(key, [record], len(record["items"]))
+                else:
+                    self.reject(path, record)
+                    summary["rejected"] += 1
+
+        with open(path, "rb") as segment:
+            for line in segment:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Última linha incompleta (processo encerrado no meio da escrita)
+                    summary["skipped_lines"] += 1
+                    continue
+                key = (record["endpoint"], record["response_key"])
+                group = pending.setdefault(key, [[], []])
+                group[0].append(record)
+                group[1].extend(record["items"])
+                if len(group[1]) >= batch_items:
+                    flush(key)
+        # Registros já gravados antes de uma queda do banco são gravados de novo no próximo replay (absorvidos pelo ON CONFLICT)
+        for key in list(pending):
+            flush(key)
+
+_spools = {}
+_spools_lock = threading.Lock()
+
+# Função para obter o spool compartilhado de um banco; None se desligado
+def get_spool(db_name, settings):
+    if not settings or not settings.get("enabled", True):
+        return None
+    with _spools_lock:
+        if db_name not in _spools:
+            _spools[db_name] = Spool(db_name, settings)
+        return _spools[db_name]
+
+# Função para drenar o spool dos bancos configurados, gravando com os handlers de cada endpoint
+def replay_spools(execution_id, db_names=None):
+    from api_manager import output_config, resolve_output_handler
+
+    summaries = {}
+    for db_name, database_config in output_config.get("databases", {}).items():
+        if db_names and db_name not in db_names:
+            continue
+        spool = get_spool(db_name, database_config.get("spool"))
+        if spool is None or not spool.segments(include_open=True):
+            continue
+        handlers = {}
+
+        def save(endpoint_name, response_key, items):
+            if endpoint_name not in handlers:
+                handlers[endpoint_name] = resolve_output_handler(endpoint_name, execution_id)
+            handler = handlers[endpoint_name]
+            if handler is None:
+                # Erro de configuração, não dos itens: o replay para sem descartar o segmento
+                raise RuntimeError(f"Handler de {endpoint_name} não pôde ser criado")
+            # spool=False: uma falha no replay não volta para o spool (sem conexão, o handler levanta DatabaseUnavailable)
+            return handler.save(endpoint_name, {response_key: items}, tenant_id="", execution_id=execution_id,
+                                response_key=response_key, spool=False) is not None
+
+        try:
+            summaries[db_name] = spool.replay(save)
+        except Exception as e:
+            logger.error("[UUID: %s] Erro no replay do spool %s: %s", execution_id, db_name, e)
+            logger.debug(traceback.format_exc())
+            summaries[db_name] = {"complete": False, "error": repr(e)}
+    return summaries
+
+# Após um fork, o processo filho não herda os spools do pai (segmentos ativos e locks são do pai)
+def _reset_after_fork():
+    global _spools_lock
+    _spools_lock = threading.Lock()
+    _spools.clear()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consultar ou drenar o spool de páginas não gravadas no banco")
+    parser.add_argument('--db_name', help="Banco cujo spool será usado (use vírgula para separar valores; padrão: todos)")
+    parser.add_argument('--replay', action='store_true', help="Gravar no banco as páginas do spool, da mais antiga para a mais nova")
+    args = parser.parse_args()
+
+    from api_manager import output_config
+
+    db_names = args.db_name.split(",") if args.db_name else None
+    if args.replay:
+        summaries = replay_spools(str(uuid.uuid4()), db_names)
+        for db_name, summary in summaries.items():
+            print(f"{db_name}: {summary}")
+        sys.exit(0 if all(summary.get("complete") for summary in summaries.values()) else 1)
+
+    for db_name, database_config in output_config.get("databases", {}).items():
+        if db_names and db_name not in db_names:
+            continue
+        spool = get_spool(db_name, database_config.get("spool"))
+        if spool is None:
+            print(f"{db_name}: spool desligado")
+            continue
+        segments = spool.segments(include_open=True)
+        print(f"{db_name}: {len(segments)} segmentos, {spool.size() / 2**20:.1f} MB em {spool.directory}, "
+              f"{spool.rejected_records()} registros recusados em {os.path.join(spool.directory, REJECTED_DIR)}")
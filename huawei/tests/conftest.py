@@ -0,0 +1,62 @@
+import os
+import sys
+
+import pytest
+
+# Os módulos do coletor ficam direto em huawei/ (sem pacote): os testes os importam pelo nome
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tokens, spool, watermarks e logs usam caminhos relativos ao diretório atual: cada teste roda em um diretório temporário
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+# Cursor falso do psycopg2: guarda os comandos executados e devolve os resultados enfileirados em results
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        self.connection.executed.append((" ".join(query.split()), params))
+
+    def copy_expert(self, query, buffer):
+        self.connection.copied.append((" ".join(query.split()), buffer.getvalue()))
+
+    def fetchall(self):
+        return self.connection.results.pop(0) if self.connection.results else []
+
+    def fetchone(self):
+        rows = self.fetchall()
+        return rows[0] if rows else None
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+class FakeConnection:
+    def __init__(self, results=None):
+        self.executed = []
+        self.copied = []
+        self.results = list(results or [])
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self, name=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+@pytest.fixture
+def fake_connection():
+    return FakeConnection
@@ -0,0 +1,142 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from alarm_rollups import RollupAccumulator, compact_raw, event_hour, flag, partition_bounds, prune_events, rollup_settings
+from output_handler import ALARM_EVENT_FIELDS, ALARM_KEY_FIELDS, ALARM_STATE_FIELDS, field_expression
+
+from conftest import FakeConnection, FakeCursor
+
+SETTINGS = rollup_settings({"rollups": {"delete_batch_size": 3}}, "alarms")
+EXPRESSIONS = {name: field_expression(field) for name, field in {**ALARM_KEY_FIELDS, **ALARM_STATE_FIELDS, **ALARM_EVENT_FIELDS}.items()}
+HOUR = datetime(2026, 10, 18, 10, tzinfo=timezone.utc)
+
+def event(event_type, severity="major", previous_severity=None, is_cleared=False, previous_is_cleared=None,
+          last_changed="2026-10-18T10:15:00Z", tenant="t1"):
+    # Alarme já conhecido sem mudança de severidade: a anterior é a atual
+    if previous_severity is None and previous_is_cleared is not None:
+        previous_severity = severity
+    return {"tenant_id": tenant, "event_type": event_type, "severity": severity, "previous_severity": previous_severity,
+            "is_cleared": is_cleared, "previous_is_cleared": previous_is_cleared, "last_changed": last_changed,
+            "time_created": "2026-10-18T09:00:00Z", "ne_name": "ne1", "probable_cause": "c1"}
+
+def counters(accumulator, severity="major"):
+    return accumulator.hourly.get((HOUR, ("t1", severity, "ne1", "c1")))
+
+# Conexão falsa cujos DELETE afetam o número de linhas enfileirado em rowcounts
+class CountingCursor(FakeCursor):
+    def execute(self, query, params=None):
+        super().execute(query, params)
+        rowcounts = self.connection.rowcounts
+        self.rowcount = rowcounts.pop(0) if "DELETE" in query and rowcounts else 0
+
+class CountingConnection(FakeConnection):
+    def __init__(self, results=None, rowcounts=None):
+        super().__init__(results)
+        self.rowcounts = list(rowcounts or [])
+
+    def cursor(self, name=None):
+        return CountingCursor(self)
+
+def test_flag_accepts_page_and_database_values():
+    assert flag(True) and flag("true")
+    assert not flag(False) and not flag("false") and not flag(None)
+
+def test_event_hour_truncates_to_utc_hour():
+    assert event_hour("2026-10-18T10:35:12Z") == HOUR
+    assert event_hour("2026-10-18T07:35:12-03:00") == HOUR
+    assert event_hour(datetime(2026, 10, 18, 10, 59)) == HOUR
+    # Sem data válida, a hora atual
+    current = event_hour("invalid")
+    assert current.tzinfo == timezone.utc and (current.minute, current.second) == (0, 0)
+
+def test_rollup_settings():
+    assert rollup_settings(None, "alarms") is None
+    assert rollup_settings({"rollups": {"enabled": False}}, "alarms") is None
+    assert (SETTINGS["hourly_table"], SETTINGS["daily_table"], SETTINGS["active_table"]) == (
+        "alarms_rollup_hourly", "alarms_rollup_daily", "alarms_active_counts")
+    assert SETTINGS["raw_retention_days"] == 90 and SETTINGS["delete_batch_size"] == 3
+
+@pytest.mark.parametrize("transition, expected", [
+    # raised, cleared, reraised, acked, active_delta
+    (event("raised"), [1, 0, 0, 0, 1]),
+    (event("cleared", is_cleared=True), [1, 1, 0, 0, 0]),
+    (event("cleared", is_cleared=True, previous_is_cleared="false"), [0, 1, 0, 0, -1]),
+    (event("reraised", previous_is_cleared="true"), [1, 0, 1, 0, 1]),
+    (event("acked", previous_is_cleared="false"), [0, 0, 0, 1, 0]),
+])
+def test_accumulator_counts_transitions(transition, expected):
+    accumulator = RollupAccumulator()
+    accumulator.add(transition)
+    assert counters(accumulator) == expected
+
+def test_severity_change_moves_active_alarm_between_groups():
+    accumulator = RollupAccumulator()
+    accumulator.add(event("severity", severity="critical", previous_severity="major", previous_is_cleared="false"))
+    assert counters(accumulator, "major")[-1] == -1
+    assert counters(accumulator, "critical")[-1] == 1
+    assert accumulator.active_rows() == [("t1", "critical", "ne1", "c1", 1), ("t1", "major", "ne1", "c1", -1)]
+
+def test_purged_tombstone_is_not_counted():
+    accumulator = RollupAccumulator()
+    accumulator.add(event("purged", is_cleared=True, previous_is_cleared=True))
+    assert (accumulator.events, accumulator.hourly) == (0, {})
+
+def test_rows_merge_hours_into_days_and_skip_empty_groups():
+    accumulator = RollupAccumulator()
+    accumulator.add(event("raised"))
+    accumulator.add(event("cleared", is_cleared=True, previous_is_cleared="false", last_changed="2026-10-18T14:00:00Z"))
+    accumulator.add(event("raised", tenant="t2"))
+    accumulator.add(event("cleared", is_cleared=True, previous_is_cleared="false", tenant="t2"))
+    assert accumulator.rows("hour") == [
+        (HOUR, "t1", "major", "ne1", "c1", 1, 0, 0, 0, 1),
+        (HOUR.replace(hour=14), "t1", "major", "ne1", "c1", 0, 1, 0, 0, -1),
+        (HOUR, "t2", "major", "ne1", "c1", 1, 1, 0, 0, 0),
+    ]
+    assert accumulator.rows("day") == [(HOUR.replace(hour=0), "t1", "major", "ne1", "c1", 1, 1, 0, 0, 0),
+                                       (HOUR.replace(hour=0), "t2", "major", "ne1", "c1", 1, 1, 0, 0, 0)]
+    # Os ativos se anulam nos dois tenants: nada a somar na tabela de ativos
+    assert accumulator.active_rows() == []
+
+def test_partition_bounds(fake_connection):
+    conn = fake_connection(results=[[
+        ("alarms_2026_10", "FOR VALUES FROM ('2026-10-01 00:00:00+00') TO ('2026-11-01 00:00:00+00')"),
+        ("alarms_default", "DEFAULT"),
+    ]])
+    assert partition_bounds(conn.cursor(), "alarms") == [
+        ("alarms_2026_10", "2026-10-01 00:00:00+00", "2026-11-01 00:00:00+00"), ("alarms_default", None, None)]
+
+def test_compact_raw_leaves_tombstones_and_drops_empty_partitions():
+    cutoff = datetime(2026, 7, 20, tzinfo=timezone.utc)
+    conn = CountingConnection(results=[
+        [(True, cutoff)],
+        [("alarms_2026_05", "FOR VALUES FROM ('2026-05-01 00:00:00+00') TO ('2026-06-01 00:00:00+00')"),
+         ("alarms_2026_07", "FOR VALUES FROM ('2026-07-01 00:00:00+00') TO ('2026-08-01 00:00:00+00')"),
+         ("alarms_2026_08", "FOR VALUES FROM ('2026-08-01 00:00:00+00') TO ('2026-09-01 00:00:00+00')"),
+         ("alarms_default", "DEFAULT")],
+        [(False,)],
+    ], rowcounts=[4, 2, 1])
+    summary = compact_raw(conn, "alarms", "alarm_events", EXPRESSIONS, SETTINGS)
+    assert summary == {"deleted": 7, "partitions_dropped": 1}
+
+    purges = [(query, params) for query, params in conn.executed if query.startswith("WITH purged")]
+    # Partições criadas depois do corte não são lidas
+    assert [query.split()[6] for query, _ in purges] == ["alarms_2026_05", "alarms_2026_07", "alarms_default"]
+    query, params = purges[0]
+    assert params == (cutoff,)
+    assert "WHERE (data->'resource-alarm-parameters'->>'is-cleared') = 'true' AND collected_at < %s" in query
+    # Tombstone com o último estado do alarme removido, sempre encerrado
+    assert ("'purged', data->'resource-alarm-parameters'->>'perceived-severity', NULL, "
+            "(data->'resource-alarm-parameters'->>'is-cleared')::boolean, (data->>'is-acked')::boolean, "
+            "nce_timestamp(data->'resource-alarm-parameters'->>'last-changed')") in query
+    assert query.endswith("true FROM purged")
+    assert ("ALTER TABLE alarms DETACH PARTITION alarms_2026_05", None) in conn.executed
+    assert ("DROP TABLE alarms_2026_05", None) in conn.executed
+    assert not any("alarms_2026_07" in query for query, _ in conn.executed if query.startswith(("ALTER", "DROP")))
+
+def test_prune_events_deletes_in_batches():
+    conn = CountingConnection(rowcounts=[3, 3, 1])
+    assert prune_events(conn, "alarm_events", SETTINGS) == 7
+    deletes = [params for query, params in conn.executed if query.startswith("DELETE FROM alarm_events")]
+    assert deletes == [(365, 3)] * 3
+    assert conn.commits == 3
@@ -0,0 +1,141 @@
+import time
+
+import pytest
+
+import output_handler
+from output_handler import (AlarmStateIndex, AlarmStateOutputHandler, DatabaseOutputHandler, ALARM_STATE_FIELDS,
+                            invalidate_alarm_state, state_value, transition_type)
+
+STATE_NAMES = list(ALARM_STATE_FIELDS)
+
+def state(is_cleared="false", severity="major", is_acked="false", last_changed="2026-10-18T10:00:00Z"):
+    return (is_cleared, severity, is_acked, last_changed)
+
+def alarm(serial, is_cleared=False, severity="major", is_acked=False, last_changed="2026-10-18T10:00:00Z", tenant="t1"):
+    return {"time-created": "2026-10-18T09:00:00Z", "is-acked": is_acked,
+            "resource-alarm-parameters": {"is-cleared": is_cleared, "perceived-severity": severity, "last-changed": last_changed},
+            "alarm-parameters": {"alarm-serial-number": serial, "tenant-id": tenant, "ne-name": "ne1", "native-probable-cause": "c1"}}
+
+@pytest.mark.parametrize("previous, current, expected", [
+    (None, state(), "raised"),
+    (None, state(is_cleared="true"), "cleared"),
+    (state(), state(is_cleared="true"), "cleared"),
+    (state(is_cleared="true"), state(), "reraised"),
+    (state(), state(is_acked="true"), "acked"),
+    (state(is_acked="true"), state(), "unacked"),
+    (state(), state(severity="critical"), "severity"),
+    (state(), state(last_changed="2026-10-18T11:00:00Z"), "changed"),
+])
+def test_transition_type(previous, current, expected):
+    assert transition_type(previous, current, STATE_NAMES) == expected
+
+def test_state_value_matches_postgres_text():
+    assert state_value(True) == "true"
+    assert state_value(None) is None
+    assert state_value("major") == "major"
+
+def test_index_evicts_least_recently_used_and_drops_tenants():
+    index = AlarmStateIndex(max_size=2, tenant_position=1, refresh_seconds=3600)
+    index.update([(("1", "t1"), "a"), (("2", "t2"), "b")])
+    index.get(("1", "t1"))
+    index.update([(("3", "t1"), "c")])
+    assert index.get(("2", "t2")) is None
+    assert index.drop_tenants({"t1"}) == 2
+    assert len(index) == 0
+    assert index.needs_warm()
+    index.warmed_at = time.monotonic()
+    assert not index.needs_warm()
+
+# Handler sem banco: estados anteriores vêm de db_states (no lugar do SELECT ... FOR UPDATE) e as gravações são registradas
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setattr(output_handler, "_alarm_state_indexes", {})
+    handler = AlarmStateOutputHandler("postgresql://localhost/db", "alarms_test", "upsert",
+                                      ["alarm-parameters->>alarm-serial-number", "alarm-parameters->>tenant-id"], "nothing", "values",
+                                      state_tracking={"events_table": "alarm_events_test"})
+    handler.db_states, handler.lookups, handler.events, handler.written = {}, [], [], []
+    monkeypatch.setattr(handler, "check_events_schema", lambda cursor: None)
+    monkeypatch.setattr(handler, "warm_index", lambda conn: None)
+    monkeypatch.setattr(handler, "purged_states", lambda cursor, keys: {})
+
+    def lookup_states(cursor, keys):
+        handler.lookups.append(sorted(keys))
+        return {key: handler.db_states[key] for key in keys if key in handler.db_states}
+
+    def save_changed(self, conn, data, **kwargs):
+        handler.written.append(list(data["data"]))
+        return {"items": len(data["data"]), "inserted": 0, "updated": len(data["data"]), "unchanged": 0}
+
+    monkeypatch.setattr(handler, "lookup_states", lookup_states)
+    monkeypatch.setattr(handler, "save_events", lambda cursor, rows: handler.events.extend(rows))
+    monkeypatch.setattr(DatabaseOutputHandler, "save_with_connection", save_changed)
+    return handler
+
+def test_new_alarms_raise_events_and_are_written(handler, fake_connection):
+    counts = handler.save_with_connection(fake_connection(), {"data": [alarm("1"), alarm("2", is_cleared=True)]})
+    assert [(row[1], row[2], row[-1]) for row in handler.events] == [("1", "raised", None), ("2", "cleared", None)]
+    assert len(handler.written[0]) == 2
+    assert (counts["items"], counts["events"], counts["unchanged"]) == (2, 2, 0)
+
+def test_unchanged_alarms_in_index_skip_the_database(handler, fake_connection):
+    handler.save_with_connection(fake_connection(), {"data": [alarm("1")]})
+    handler.lookups.clear()
+    counts = handler.save_with_connection(fake_connection(), {"data": [alarm("1")]})
+    assert handler.lookups == []
+    assert (counts["events"], counts["unchanged"]) == (0, 1)
+
+def test_previous_state_comes_from_database_not_index(handler, fake_connection):
+    # Outro processo já gravou o clear: o índice local diz "ativo", o banco diz "encerrado"
+    handler.state_index.update([(("1", "t1"), state())])
+    handler.db_states[("1", "t1")] = state(is_cleared="true", last_changed="2026-10-18T10:30:00Z")
+    counts = handler.save_with_connection(fake_connection(), {"data": [alarm("1", is_cleared=True, last_changed="2026-10-18T10:30:00Z")]})
+    assert handler.lookups == [[("1", "t1")]]
+    assert handler.events == []
+    assert counts["unchanged"] == 1
+    assert handler.state_index.get(("1", "t1")) == state(is_cleared="true", last_changed="2026-10-18T10:30:00Z")
+
+def test_transition_records_previous_state(handler, fake_connection):
+    handler.db_states[("1", "t1")] = state(severity="minor")
+    handler.save_with_connection(fake_connection(), {"data": [alarm("1", severity="critical")]})
+    (event,) = handler.events
+    assert (event[2], event[3], event[4], event[-1]) == ("severity", "critical", "minor", "false")
+
+def test_repeated_alarm_in_page_compares_with_previous_occurrence(handler, fake_connection):
+    page = [alarm("1"), alarm("1", is_cleared=True, last_changed="2026-10-18T11:00:00Z")]
+    handler.save_with_connection(fake_connection(), {"data": page})
+    assert [row[2] for row in handler.events] == ["raised", "cleared"]
+    assert handler.state_index.get(("1", "t1"))[0] == "true"
+
+def test_invalidate_alarm_state_drops_tenant_entries(handler):
+    handler.state_index.update([(("1", "t1"), state()), (("2", "t2"), state())])
+    assert invalidate_alarm_state(["t1"]) == 1
+    assert handler.state_index.get(("1", "t1")) is None
+
+def test_purged_alarm_reported_cleared_again_is_skipped(handler, fake_connection, monkeypatch):
+    # Alarme removido pela retenção (só o tombstone na tabela de eventos) e reportado de novo, ainda encerrado
+    monkeypatch.setattr(handler, "purged_states", lambda cursor, keys: {("1", "t1"): ("true", "major", "false", None)})
+    counts = handler.save_with_connection(fake_connection(), {"data": [alarm("1", is_cleared=True)]})
+    assert (handler.events, handler.written) == ([], [[]])
+    assert counts["unchanged"] == 1
+    assert handler.state_index.get(("1", "t1"))[0] == "true"
+
+def test_purged_alarm_reported_active_is_reraised(handler, fake_connection, monkeypatch):
+    monkeypatch.setattr(handler, "purged_states", lambda cursor, keys: {("1", "t1"): ("true", "major", "false", None)})
+    handler.save_with_connection(fake_connection(), {"data": [alarm("1", severity="critical")]})
+    (event,) = handler.events
+    assert (event[2], event[3], event[4], event[-1]) == ("reraised", "critical", "major", "true")
+    assert len(handler.written[0]) == 1
+
+def test_missing_events_schema_asks_for_schema_manager(fake_connection, monkeypatch):
+    monkeypatch.setattr(output_handler, "_events_tables_ready", set())
+    handler = AlarmStateOutputHandler("postgresql://localhost/db", "alarms_schema", "upsert", ["alarm-parameters->>alarm-serial-number"],
+                                      "nothing", "values", state_tracking={"events_table": "alarm_events_schema"})
+    conn = fake_connection(results=[[("nce_timestamp(text)",)], []])
+    with pytest.raises(RuntimeError, match="nce_timestamp.*schema_manager.py"):
+        handler.check_events_schema(conn.cursor())
+    # Com tudo criado, a verificação não se repete no processo
+    handler.check_events_schema(conn.cursor())
+    handler.check_events_schema(conn.cursor())
+    assert len(conn.executed) == 2
+    assert conn.executed[0][1][0] == ["alarm_events_schema"]
+    assert not any(query.startswith(("CREATE", "ALTER")) for query, _ in conn.executed)
@@ -0,0 +1,53 @@
+import csv
+import io
+
+import pytest
+
+from output_handler import DatabaseOutputHandler, content_hash
+
+def make_handler(table="network_link_huawei"):
+    return DatabaseOutputHandler("postgresql://localhost/db", table, "upsert", ["linkdn"], "update", "copy", change_detection=True)
+
+def test_content_hash_ignores_key_order_and_whitespace():
+    assert content_hash({"a": 1, "b": {"c": [1, 2]}}) == content_hash({"b": {"c": [1, 2]}, "a": 1})
+    assert content_hash({"a": 1}) != content_hash({"a": 2})
+    assert len(content_hash({})) == 32
+
+def test_update_only_when_hash_differs():
+    query = make_handler().build_conflict_query("update")
+    assert query == ("ON CONFLICT ((data->>'linkdn')) DO UPDATE SET data = EXCLUDED.data, data_hash = EXCLUDED.data_hash, "
+                     "collected_at = NOW() WHERE network_link_huawei.data_hash IS DISTINCT FROM EXCLUDED.data_hash")
+    # on_conflict "nothing" não depende do hash
+    assert make_handler().build_conflict_query("nothing") == "ON CONFLICT ((data->>'linkdn')) DO NOTHING"
+
+def test_hash_travels_with_each_row():
+    handler = make_handler()
+    item = {"linkdn": "l1", "status": "up"}
+    assert handler.columns == "data, data_hash"
+    assert handler.placeholders == "%s, %s"
+    assert handler.row_values(item)[1] == content_hash(item)
+    assert "data jsonb, data_hash text" in handler.create_staging_query()
+    assert "SELECT DISTINCT ON ((data->>'linkdn')) data, data_hash, NOW()" in " ".join(handler.merge_staging_query("").split())
+
+def test_every_row_is_sent_and_unchanged_rows_are_counted(fake_connection):
+    # O banco decide o que mudou: todas as linhas vão para o staging; as que não retornam do upsert ficam inalteradas
+    conn = fake_connection(results=[[(True,)], [(False,)]])
+    items = [{"linkdn": f"l{n}", "status": "up"} for n in range(3)]
+    counts = make_handler("links_a").save_with_connection(conn, {"data": items})
+    rows = [row for _, data in conn.copied for row in csv.reader(io.StringIO(data))]
+    assert [row[2] for row in rows] == [content_hash(item) for item in items]
+    assert counts == {"items": 3, "inserted": 0, "updated": 1, "unchanged": 2}
+
+def test_hash_column_is_checked_once_per_table(fake_connection):
+    handler = make_handler("links_b")
+    first, second = fake_connection(results=[[(True,)]]), fake_connection()
+    handler.save_with_connection(first, {"data": [{"linkdn": "l1"}]})
+    handler.save_with_connection(second, {"data": [{"linkdn": "l1"}]})
+    # Só leitura do catálogo, sem ALTER TABLE na coleta
+    assert first.executed[0] == (handler.hash_column_query(), ("links_b",))
+    assert not any(query.startswith("ALTER TABLE") for conn in (first, second) for query, _ in conn.executed)
+    assert not any("pg_attribute" in query for query, _ in second.executed)
+
+def test_missing_hash_column_asks_for_schema_manager(fake_connection):
+    with pytest.raises(RuntimeError, match="schema_manager.py"):
+        make_handler("links_c").save_with_connection(fake_connection(results=[[(False,)]]), {"data": [{"linkdn": "l1"}]})
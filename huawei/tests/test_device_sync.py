@@ -0,0 +1,77 @@
+import pytest
+
+import device_sync
+from device_sync import DEFAULT_TENANT_BATCH_SETTINGS, chunk_tenants, split_by_tenant, sync_tenant_batches
+from output_handler import FileOutputHandler
+
+SETTINGS = {**DEFAULT_TENANT_BATCH_SETTINGS, "chunk_size": 2, "workers": 1}
+
+def device(tenant_id, name):
+    return {"tenantId": tenant_id, "name": name}
+
+def test_chunk_tenants():
+    assert chunk_tenants(["t1", "t2", "t3", "t4", "t5"], 2) == [["t1", "t2"], ["t3", "t4"], ["t5"]]
+    assert chunk_tenants(["t1", "t2"], 2) == [["t1", "t2"]]
+    assert chunk_tenants([], 2) == []
+
+def test_split_by_tenant_keeps_order():
+    items = [device("t1", "a"), device("t2", "b"), device("t1", "c"), {"name": "d"}]
+    assert split_by_tenant(items, "tenantId") == {"t1": [device("t1", "a"), device("t1", "c")], "t2": [device("t2", "b")],
+                                                  None: [{"name": "d"}]}
+    nested = [{"owner": {"tenantId": "t1"}}, {"owner": None}]
+    assert split_by_tenant(nested, "owner->>tenantId") == {"t1": [nested[0]], None: [nested[1]]}
+
+# Handler de arquivo que só registra as gravações; fail_tenant simula a falha na gravação de um tenant
+class RecordingFileHandler(FileOutputHandler):
+    def __init__(self, fail_tenant=None):
+        super().__init__("output")
+        self.saved = []
+        self.fail_tenant = fail_tenant
+
+    def save(self, endpoint, data, **kwargs):
+        self.saved.append((kwargs["tenant_id"], kwargs["page"], [item["name"] for item in data["data"]]))
+        return None if kwargs["tenant_id"] == self.fail_tenant else {"items": len(data["data"])}
+
+@pytest.fixture
+def batch(monkeypatch):
+    # pages: {tuple(lote): [itens de cada página]}
+    def run(tenant_ids, pages, handler):
+        calls = []
+
+        def iter_api_pages(endpoint_name, url_base, username, password, execution_id, **kwargs):
+            calls.append(kwargs["tenantIdList"])
+            for page_number, items in enumerate(pages[tuple(kwargs["tenantIdList"])], 1):
+                yield page_number, {"data": items}, kwargs
+
+        monkeypatch.setattr(device_sync, "get_endpoint_config", lambda endpoint_name, execution_id: {"response_key": "data"})
+        monkeypatch.setattr(device_sync, "iter_api_pages", iter_api_pages)
+        monkeypatch.setattr(device_sync, "resolve_output_handler", lambda endpoint_name, execution_id: handler)
+        results = sync_tenant_batches("get_devices_msp", tenant_ids, "https://nce.example", "user", "secret", "uuid", SETTINGS)
+        return results, calls
+    return run
+
+def test_batches_are_split_back_by_tenant(batch):
+    handler = RecordingFileHandler()
+    pages = {("t1", "t2"): [[device("t1", "a"), device("t2", "b")], [device("t1", "c")]], ("t3",): [[]]}
+    results, calls = batch(["t1", "t2", "t3"], pages, handler)
+    assert calls == [["t1", "t2"], ["t3"]]
+    assert {tenant_id: (result["status"], result["items"]) for tenant_id, result in results.items()} == {
+        "t1": ("ok", 2), "t2": ("ok", 1), "t3": ("ok", 0)}
+    # Um arquivo por tenant, com a numeração de páginas de cada tenant
+    assert handler.saved == [("t1", 1, ["a"]), ("t2", 1, ["b"]), ("t1", 2, ["c"])]
+
+def test_items_outside_the_batch_have_no_result(batch):
+    handler = RecordingFileHandler()
+    pages = {("t1", "t2"): [[device("t1", "a"), device("t9", "x"), {"name": "y"}]]}
+    results, _ = batch(["t1", "t2"], pages, handler)
+    # Os itens do tenant fora do lote (e sem tenantId) são gravados, mas não viram resultado
+    assert set(results) == {"t1", "t2"}
+    assert (results["t1"]["items"], results["t2"]["items"]) == (1, 0)
+    assert [tenant_id for tenant_id, _, _ in handler.saved] == ["t1", "t9", ""]
+
+def test_failed_save_fails_the_whole_batch(batch):
+    handler = RecordingFileHandler(fail_tenant="t2")
+    pages = {("t1", "t2"): [[device("t1", "a"), device("t2", "b")]], ("t3",): [[device("t3", "c")]]}
+    results, _ = batch(["t1", "t2", "t3"], pages, handler)
+    assert [results[tenant_id]["status"] == "ok" for tenant_id in ("t1", "t2", "t3")] == [False, False, True]
+    assert results["t1"]["items"] == 0
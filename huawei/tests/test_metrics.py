@@ -0,0 +1,64 @@
+import json
+import os
+import time
+
+import pytest
+
+import metrics
+from metrics import MetricsRegistry
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics, "registry", registry)
+    return registry
+
+def config(workdir, **overrides):
+    return {"textfile": str(workdir / "prom" / "nce_collector_{script}.prom"), "summary_dir": str(workdir / "runs"), **overrides}
+
+def test_textfile_per_script():
+    assert metrics.textfile_path({}, "collector") == "metrics/nce_collector_collector.prom"
+    assert metrics.textfile_path({"textfile": "m/nce.prom"}, "scheduler") == "m/nce_scheduler.prom"
+
+def test_single_shot_runs_accumulate(registry, workdir, monkeypatch):
+    monkeypatch.setattr(metrics, "textfile_path", lambda metrics_config: metrics_config["textfile"].format(script="collector"))
+    for execution_id in ("run-1", "run-2"):
+        registry.reset()
+        registry.inc("items_total", 5, endpoint="get_alarms")
+        registry.observe("save_seconds", 0.02, endpoint="get_alarms")
+        metrics.export(config(workdir), execution_id)
+    with open(workdir / "prom" / "nce_collector_collector.prom") as textfile:
+        content = textfile.read()
+    # Os contadores somam as duas execuções em vez de refletir só a última
+    assert 'nce_collector_items_total{endpoint="get_alarms"} 10' in content
+    assert 'nce_collector_save_seconds_count{endpoint="get_alarms"} 2' in content
+    assert sorted(os.listdir(workdir / "runs")) == ["run-1.json", "run-2.json"]
+
+def test_cumulative_export_rewrites_the_file(registry, workdir, monkeypatch):
+    monkeypatch.setattr(metrics, "textfile_path", lambda metrics_config: metrics_config["textfile"].format(script="scheduler"))
+    registry.inc("items_total", 5)
+    metrics.export(config(workdir), "daemon", summary=False, cumulative=True)
+    metrics.export(config(workdir), "daemon", summary=False, cumulative=True)
+    with open(workdir / "prom" / "nce_collector_scheduler.prom") as textfile:
+        assert "nce_collector_items_total 5" in textfile.read()
+    assert not os.path.exists(workdir / "runs")
+
+def test_histograms_with_other_buckets_restart(registry, workdir, monkeypatch):
+    textfile = str(workdir / "nce_collector_collector.prom")
+    with open(workdir / "nce_collector_collector.json", "w") as state:
+        json.dump({"counters": [], "gauges": [],
+                   "histograms": [["save_seconds", [], {"buckets": [1, 2], "counts": [3, 0], "sum": 1.5, "count": 3}]]}, state)
+    registry.observe("save_seconds", 0.5)
+    metrics.accumulate(textfile)
+    with open(textfile) as prom:
+        assert "nce_collector_save_seconds_count 1" in prom.read()
+
+def test_old_summaries_are_pruned(workdir):
+    os.makedirs(workdir / "runs")
+    for name, age_days in (("old.json", 10), ("new.json", 1), ("notes.txt", 10)):
+        path = workdir / "runs" / name
+        path.write_text("{}")
+        stamp = time.time() - age_days * 86400
+        os.utime(path, (stamp, stamp))
+    assert metrics.prune_summaries(str(workdir / "runs"), 7) == 1
+    assert sorted(os.listdir(workdir / "runs")) == ["new.json", "notes.txt"]
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+
+import api_manager
+from api_manager import iter_api_pages, next_page_kwargs
+
+PAGE_INDEX = {"type": "page_index", "page_size": 2}
+MARKER = {"type": "marker", "page_size": 2, "marker_item_field": "id"}
+
+def items(*ids):
+    return [{"id": item_id} for item_id in ids]
+
+# Controlador falso: devolve as páginas de pages(kwargs) e registra os argumentos de cada busca
+@pytest.fixture
+def controller(monkeypatch):
+    def make(pagination, pages):
+        calls = []
+
+        def fetch_page(endpoint_name, endpoint_config, url_base, username, password, execution_id, tenant_id=None, stream=False, **kwargs):
+            calls.append(kwargs)
+            return pages(kwargs)
+
+        config = SimpleNamespace(pagination=pagination, response_key="data", stream=False, array_params=[])
+        monkeypatch.setattr(api_manager, "get_endpoint_config", lambda endpoint_name, execution_id: config)
+        monkeypatch.setattr(api_manager, "fetch_page", fetch_page)
+        return calls
+    return make
+
+def collect(**kwargs):
+    return [page["data"] for _, page, _ in iter_api_pages("get_alarms", "https://nce.example", "user", "secret", "uuid", **kwargs)]
+
+def test_page_index_advances_until_short_page(controller):
+    data = {1: items(1, 2), 2: items(3, 4), 3: items(5)}
+    calls = controller(PAGE_INDEX, lambda kwargs: {"data": data[kwargs["pageIndex"]]})
+    assert collect() == [items(1, 2), items(3, 4), items(5)]
+    assert [(call["pageIndex"], call["pageSize"]) for call in calls] == [(1, 2), (2, 2), (3, 2)]
+
+def test_page_index_stops_at_total_records():
+    # O controlador limitou o pageSize: a página curta não encerra enquanto totalRecords não foi atingido
+    assert next_page_kwargs(PAGE_INDEX, {"totalRecords": 6}, {"pageIndex": 1, "pageSize": 3}, 2, None) == {"pageIndex": 2, "pageSize": 3}
+    assert next_page_kwargs(PAGE_INDEX, {"totalRecords": "6"}, {"pageIndex": 2, "pageSize": 3}, 3, None) is None
+
+def test_empty_page_ends_pagination():
+    assert next_page_kwargs(PAGE_INDEX, {}, {"pageIndex": 1, "pageSize": 2}, 0, None) is None
+    assert next_page_kwargs(MARKER, {}, {"pageSize": 2}, 0, None) is None
+
+def test_marker_from_response_or_last_item(controller):
+    data = {None: items(1, 2), 2: items(3, 4), 4: items(5)}
+    calls = controller(MARKER, lambda kwargs: {"data": data[kwargs.get("marker")]})
+    assert collect() == [items(1, 2), items(3, 4), items(5)]
+    assert [call.get("marker") for call in calls] == [None, 2, 4]
+    # O marcador informado pelo controlador tem precedência sobre o do último item
+    assert next_page_kwargs(MARKER, {"marker": "m2"}, {"pageSize": 2}, 2, {"id": 2})["marker"] == "m2"
+
+def test_repeated_marker_ends_pagination():
+    assert next_page_kwargs(MARKER, {"marker": "m1"}, {"pageSize": 2, "marker": "m1"}, 2, {"id": 2}) is None
+
+def test_repeated_page_ends_pagination(controller):
+    # Controlador que ignora o pageIndex e devolve sempre a mesma página cheia: para na primeira repetição
+    calls = controller(PAGE_INDEX, lambda kwargs: {"data": items(1, 2)})
+    assert collect() == [items(1, 2), items(1, 2)]
+    assert len(calls) == 2
+
+def test_max_pages_caps_pagination(controller):
+    calls = controller({**PAGE_INDEX, "max_pages": 3}, lambda kwargs: {"data": items(kwargs["pageIndex"] * 2, kwargs["pageIndex"] * 2 + 1)})
+    assert len(collect()) == 3
+    assert len(calls) == 3
+
+def test_without_pagination_fetches_once(controller):
+    calls = controller(None, lambda kwargs: {"data": items(1, 2)})
+    assert collect(tenantIdList=["t1"]) == [items(1, 2)]
+    assert calls == [{"tenantIdList": ["t1"]}]
+
+def test_failed_page_raises(controller):
+    controller(PAGE_INDEX, lambda kwargs: {"data": items(1, 2)} if kwargs["pageIndex"] == 1 else None)
+    pages = iter_api_pages("get_alarms", "https://nce.example", "user", "secret", "uuid")
+    next(pages)
+    with pytest.raises(RuntimeError, match="página 2"):
+        next(pages)
+
+def test_unknown_pagination_type():
+    with pytest.raises(ValueError):
+        next_page_kwargs({"type": "cursor"}, {}, {}, 1, None)
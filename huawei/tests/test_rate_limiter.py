@@ -0,0 +1,123 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+import rate_limiter
+from rate_limiter import AdaptiveLimiter, DEFAULT_RATE_LIMIT_SETTINGS, parse_retry_after
+
+def make_limiter(**overrides):
+    return AdaptiveLimiter("nce/tenant", {**DEFAULT_RATE_LIMIT_SETTINGS, **overrides})
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after("-3") == 0.0
+    assert parse_retry_after("soon") is None
+    http_date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 <= parse_retry_after(http_date) <= 30
+
+def test_concurrency_limit_blocks_until_release():
+    limiter = make_limiter(rate=0, initial_concurrency=2)
+    now = time.monotonic()
+    assert limiter._try_acquire(now) == 0
+    assert limiter._try_acquire(now) == 0
+    assert limiter._try_acquire(now) is None
+    limiter.release(200, 0.1)
+    assert limiter._try_acquire(now) == 0
+
+def test_token_bucket_returns_wait_time():
+    limiter = make_limiter(rate=10, burst=1, max_concurrency=32, initial_concurrency=32)
+    now = limiter.refilled_at
+    assert limiter._try_acquire(now) == 0
+    assert limiter._try_acquire(now) == pytest.approx(0.1)
+    assert limiter._try_acquire(now + 0.1) == 0
+
+def test_healthy_window_increases_additively():
+    limiter = make_limiter(rate=10, initial_concurrency=4, window=5)
+    limiter.rate = 5.0
+    for _ in range(5):
+        limiter._try_acquire(time.monotonic())
+        limiter.release(200, 0.1)
+    assert (limiter.limit, limiter.rate) == (5, 6.0)
+    assert limiter.stats()["increases"] == 1
+
+def test_error_window_decreases_multiplicatively():
+    limiter = make_limiter(rate=10, initial_concurrency=8, window=4, cooldown=0)
+    for status in (200, 500, None, 200):
+        limiter._try_acquire(time.monotonic())
+        limiter.release(status, 0.1)
+    assert (limiter.limit, limiter.rate) == (4, 5.0)
+    assert limiter.stats()["errors"] == 2
+
+def test_high_latency_window_decreases():
+    limiter = make_limiter(initial_concurrency=8, window=2, latency_target=1.0, cooldown=0)
+    for _ in range(2):
+        limiter._try_acquire(time.monotonic())
+        limiter.release(200, 3.0)
+    assert limiter.limit == 4
+
+def test_throttling_pauses_for_retry_after_and_decreases_once():
+    limiter = make_limiter(rate=20, initial_concurrency=8, cooldown=60, max_retry_after=10)
+    for _ in range(3):
+        limiter._try_acquire(time.monotonic())
+    # Várias respostas 429 simultâneas contam como uma única redução (cooldown)
+    limiter.release(429, 0.1, retry_after=4)
+    limiter.release(429, 0.1, retry_after=30)
+    limiter.release(503, 0.1, retry_after=None)
+    assert (limiter.limit, limiter.rate) == (4, 10.0)
+    assert limiter.stats()["throttled"] == 2
+    # Retry-After limitado a max_retry_after; enquanto pausado, ninguém adquire
+    wait = limiter._try_acquire(time.monotonic())
+    assert 9 < wait <= 10
+
+def test_throttle_without_retry_after_uses_default():
+    limiter = make_limiter(retry_after_default=2.0)
+    limiter._try_acquire(time.monotonic())
+    limiter.release(429, 0.1)
+    assert 1.5 < limiter._try_acquire(time.monotonic()) <= 2.0
+
+def test_never_below_minimums():
+    limiter = make_limiter(rate=2, min_rate=1.0, initial_concurrency=1, min_concurrency=1, cooldown=0)
+    for _ in range(3):
+        limiter._decrease(time.monotonic(), "teste")
+    assert (limiter.limit, limiter.rate) == (1, 1.0)
+
+def test_acquire_async_waits_for_release():
+    limiter = make_limiter(rate=0, initial_concurrency=1)
+
+    async def scenario():
+        await limiter.acquire_async()
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.1)
+        assert not waiter.done()
+        limiter.release(200, 0.01)
+        await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(scenario())
+    assert limiter.in_flight == 1
+
+def test_settings_per_controller_and_token_type(monkeypatch):
+    config = {"rate": 5, "tenant": {"burst": 7}, "controllers": {"nce-b:443": {"rate": 2, "msp": {"enabled": False}}}}
+    monkeypatch.setattr(rate_limiter, "_settings", config)
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    assert rate_limiter.get_limiter("https://nce-a:443/x", "tenant").settings["rate"] == 5
+    assert rate_limiter.get_limiter("https://nce-a:443/x", "tenant").settings["burst"] == 7
+    assert rate_limiter.get_limiter("https://nce-b:443/x", "tenant").settings["rate"] == 2
+    assert rate_limiter.get_limiter("https://nce-b:443/x", "msp") is None
+
+def test_process_workers_share_the_configured_limits(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_settings", {"rate": 20, "burst": 40, "initial_concurrency": 8, "max_concurrency": 30})
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    monkeypatch.setattr(rate_limiter, "_process_share", 1)
+    rate_limiter.share_among_processes(4)
+    settings = rate_limiter.get_limiter("https://nce-a:443/x", "tenant").settings
+    # Os 4 processos juntos respeitam a taxa e o balde configurados
+    assert (settings["rate"], settings["burst"], settings["min_rate"], settings["rate_increase"]) == (5, 10, 0.25, 0.25)
+    assert (settings["initial_concurrency"], settings["max_concurrency"]) == (2, 8)
+    # A taxa 0 (sem controle de taxa) continua desligada
+    monkeypatch.setattr(rate_limiter, "_settings", {"rate": 0})
+    rate_limiter.share_among_processes(4)
+    assert rate_limiter.get_limiter("https://nce-a:443/x", "tenant").settings["rate"] == 0
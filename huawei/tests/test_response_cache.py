@@ -0,0 +1,132 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import api_manager
+import response_cache
+from response_cache import CachedResponse, ResponseCache, cache_key, endpoint_cache_settings
+
+ENDPOINT = {"token_type": "msp", "cache": {"ttl": 60}}
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ResponseCache({"path": "cache/responses.sqlite"})
+    monkeypatch.setattr(response_cache, "_cache", cache)
+    return cache
+
+def lookup(endpoint_config=ENDPOINT, **params):
+    return response_cache.lookup("get_tenants", endpoint_config, "https://nce.example/tenants", params, None)
+
+def test_endpoint_without_cache_is_not_looked_up(cache):
+    assert endpoint_cache_settings({}) is None
+    assert lookup({"cache": {"enabled": False}}) is None
+    assert endpoint_cache_settings(ENDPOINT)["ttl"] == 60 and endpoint_cache_settings(ENDPOINT)["conditional"]
+
+def test_key_depends_on_tenant_only_for_tenant_tokens(cache):
+    assert cache_key("get_tenants", "u", {}, None, "t1") != cache_key("get_tenants", "u", {}, None, "t2")
+    msp = response_cache.lookup("get_tenants", ENDPOINT, "u", {}, None, "t1")
+    assert msp.key == response_cache.lookup("get_tenants", ENDPOINT, "u", {}, None, "t2").key
+    tenant = {**ENDPOINT, "token_type": "tenant"}
+    assert response_cache.lookup("get_tenants", tenant, "u", {}, None, "t1").key != msp.key
+
+def test_page_is_served_while_fresh(cache):
+    miss = lookup()
+    assert (miss.entry, miss.fresh) == (None, False)
+    page = miss.store({"data": [{"id": 1}]})
+    assert (page.cache_status, response_cache.needs_save(page)) == ("miss", True)
+
+    cached = lookup()
+    assert cached.fresh
+    hit = cached.hit()
+    assert hit == {"data": [{"id": 1}]} and hit.cache_status == "hit"
+    # A página já foi gravada quando chegou do controlador
+    assert not response_cache.needs_save(hit)
+    assert cache.stats()["get_tenants"]["hits"] == 1
+
+def test_save_on_hit_sends_cached_pages_to_the_output_handler(cache):
+    endpoint = {**ENDPOINT, "cache": {"ttl": 60, "save_on_hit": True}}
+    lookup(endpoint).store({"data": []})
+    assert response_cache.needs_save(lookup(endpoint).hit())
+    # Páginas sem cache (dict comum) sempre são gravadas
+    assert response_cache.needs_save({"data": []})
+
+def test_expired_page_is_revalidated_with_its_validators(cache):
+    endpoint = {**ENDPOINT, "cache": {"ttl": -1}}
+    lookup(endpoint).store({"data": [1]}, headers={"ETag": '"v1"', "Last-Modified": "Sun, 18 Oct 2026 10:00:00 GMT"})
+    expired = lookup(endpoint)
+    assert expired.entry is not None and not expired.fresh
+    assert expired.conditional_headers() == {"If-None-Match": '"v1"', "If-Modified-Since": "Sun, 18 Oct 2026 10:00:00 GMT"}
+    assert not lookup({**ENDPOINT, "cache": {"ttl": -1, "conditional": False}}).conditional_headers()
+
+    # 304: mais um TTL a partir de agora
+    expired.settings["ttl"] = 60
+    assert expired.revalidated().cache_status == "revalidated"
+    assert lookup(endpoint).fresh
+
+def test_expired_page_without_validators_is_evicted(cache):
+    lookup(ENDPOINT, page=1).store({"data": [1]}, headers={"ETag": '"v1"'})
+    expired = lookup(page=2)
+    expired.store({"data": [2]})
+    cache.connection().execute("UPDATE responses SET expires_at = 0 WHERE key = ?", (expired.key,))
+    assert lookup(page=2).entry is not None and not lookup(page=2).fresh
+    # A próxima gravação remove a página expirada que não pode ser revalidada
+    lookup(page=3).store({"data": [3]})
+    assert lookup(page=2).entry is None
+    assert lookup(page=1).entry is not None
+
+def test_lru_eviction_respects_max_entries(cache):
+    cache.settings["max_entries"] = 2
+    for page in (1, 2):
+        lookup(page=page).store({"data": [page]})
+    lookup(page=1).hit()
+    cache.connection().execute("UPDATE responses SET last_access = last_access + 10 WHERE key = ?", (lookup(page=1).key,))
+    lookup(page=3).store({"data": [3]})
+    assert [lookup(page=page).entry is not None for page in (1, 2, 3)] == [True, False, True]
+
+def test_discard_removes_the_page(cache):
+    page = lookup().store({"data": [1]})
+    response_cache.discard(page)
+    assert lookup().entry is None
+    # Páginas sem chave de cache são ignoradas
+    response_cache.discard({"data": [1]})
+
+def test_failed_save_discards_the_cached_page(cache, monkeypatch):
+    def fetch_page(endpoint_name, endpoint_config, url_base, username, password, execution_id, tenant_id=None, **kwargs):
+        cached = lookup()
+        return cached.hit() if cached.fresh else cached.store({"data": [{"id": 1}]})
+
+    saved = []
+
+    class Handler:
+        def save(self, endpoint_name, data, **kwargs):
+            saved.append(data)
+            return None if len(saved) == 1 else {"items": 1}
+
+    config = SimpleNamespace(response_key="data", array_params=[])
+    monkeypatch.setattr(api_manager, "get_endpoint_config", lambda endpoint_name, execution_id: config)
+    monkeypatch.setattr(api_manager, "fetch_page", fetch_page)
+    monkeypatch.setattr(api_manager, "resolve_output_handler", lambda endpoint_name, execution_id: Handler())
+
+    def call():
+        return api_manager.make_api_call("get_tenants", "https://nce.example", "user", "secret", "uuid")
+
+    # A gravação falhou: a página sai do cache para que a próxima coleta a busque (e grave) de novo
+    assert call().cache_status == "miss"
+    assert lookup().entry is None
+    assert call().cache_status == "miss"
+    assert lookup().fresh
+    # Gravada com sucesso: a próxima coleta usa o cache e não grava de novo
+    assert call().cache_status == "hit"
+    assert len(saved) == 2
+
+def test_sqlite_errors_do_not_stop_the_collection(cache, monkeypatch):
+    def broken(*args, **kwargs):
+        raise response_cache.sqlite3.OperationalError("database is locked")
+
+    cached = lookup()
+    monkeypatch.setattr(cache, "put", broken)
+    page = cached.store({"data": [1]})
+    assert isinstance(page, CachedResponse) and json.loads(json.dumps(page)) == {"data": [1]}
+    monkeypatch.setattr(cache, "get", broken)
+    assert lookup() is None
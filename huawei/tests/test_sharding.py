@@ -0,0 +1,103 @@
+from contextlib import contextmanager
+
+import pytest
+
+import sharding
+from sharding import HashRing, ShardCoordinator, ring_hash
+
+TENANTS = [f"tenant-{n}" for n in range(40)]
+
+# Pool falso: todas as conexões são a mesma FakeConnection; com down=True, connection() falha como o banco fora do ar
+class FakePool:
+    def __init__(self, connection):
+        self.conn = connection
+        self.down = False
+
+    @contextmanager
+    def connection(self):
+        if self.down:
+            raise OSError("connection refused")
+        yield self.conn
+
+@pytest.fixture
+def coordinator(monkeypatch, fake_connection):
+    def make(node_id="node-a", results=None):
+        pool = FakePool(fake_connection(results=results))
+        monkeypatch.setattr(sharding, "output_config", {"databases": {"monitoring_db": {"db_connection": {}}}})
+        monkeypatch.setattr(sharding, "encode_db_connection", lambda config: "postgresql://localhost/monitoring_db")
+        monkeypatch.setattr(sharding, "get_pool", lambda name, dsn, **settings: pool)
+        # Sem a thread de heartbeat: o heartbeat é chamado pelo claim
+        monkeypatch.setattr(ShardCoordinator, "run_heartbeat", lambda self: None)
+        return ShardCoordinator({"node_id": node_id, "vnodes": 16, "token_dir": None})
+    return make
+
+def assigned_to(node_id, nodes, tenant_ids=TENANTS):
+    ring = HashRing(nodes, 16)
+    return [tenant_id for tenant_id in tenant_ids if ring.node_for(tenant_id) == node_id]
+
+def test_ring_hash_is_stable():
+    assert ring_hash("tenant-1") == ring_hash("tenant-1")
+    assert ring_hash("tenant-1") != ring_hash("tenant-2")
+    assert 0 <= ring_hash("tenant-1") < 2 ** 64
+
+def test_empty_ring_has_no_owner():
+    assert HashRing([]).node_for("tenant-1") is None
+    assert {HashRing(["node-a"]).node_for(tenant_id) for tenant_id in TENANTS} == {"node-a"}
+
+def test_every_tenant_has_one_owner_and_nodes_share_the_load():
+    nodes = ["node-a", "node-b", "node-c"]
+    shares = [assigned_to(node, nodes) for node in nodes]
+    assert sorted(tenant_id for share in shares for tenant_id in share) == sorted(TENANTS)
+    assert all(share for share in shares)
+
+def test_new_node_only_takes_tenants_from_others():
+    before = HashRing(["node-a", "node-b"], 16)
+    after = HashRing(["node-a", "node-b", "node-c"], 16)
+    moved = [tenant_id for tenant_id in TENANTS if before.node_for(tenant_id) != after.node_for(tenant_id)]
+    # Só mudam de dono os tenants que passam para o nó novo
+    assert moved and all(after.node_for(tenant_id) == "node-c" for tenant_id in moved)
+
+def test_claim_returns_assigned_tenants_with_lease(coordinator, monkeypatch):
+    nodes = ["node-a", "node-b"]
+    assigned = assigned_to("node-a", nodes)
+    # O lease do primeiro tenant do trecho ainda é de outro nó; o segundo acabou de ser obtido
+    leased = [(tenant_id, tenant_id == assigned[1]) for tenant_id in assigned[1:]]
+    node = coordinator(results=[[("node-b",)], leased])
+    invalidated = []
+    monkeypatch.setattr(sharding, "invalidate_alarm_state", lambda tenant_ids: invalidated.append(set(tenant_ids)) or 0)
+
+    assert node.claim(TENANTS, "uuid") == assigned[1:]
+    assert invalidated == [{assigned[1]}]
+    assert node.last_nodes == nodes
+    assert (node.stats["tenants_assigned"], node.stats["tenants_leased"]) == (len(assigned), len(assigned) - 1)
+    queries = node.pool.conn.executed
+    (release,) = [params for query, params in queries if query.startswith(f"DELETE FROM {sharding.LEASES_TABLE}")]
+    (acquire,) = [params for query, params in queries if query.startswith(f"INSERT INTO {sharding.LEASES_TABLE}")]
+    assert release == ("node-a", assigned)
+    assert acquire == ("node-a", node.settings["lease_ttl"], assigned)
+
+def test_claim_registers_node_on_first_call(coordinator):
+    node = coordinator(results=[[], []])
+    node.claim(TENANTS, "uuid")
+    queries = [query for query, _ in node.pool.conn.executed]
+    assert queries[0].startswith(f"CREATE TABLE IF NOT EXISTS {sharding.NODES_TABLE}")
+    assert any(query.startswith(f"INSERT INTO {sharding.NODES_TABLE}") for query in queries)
+    assert node.started
+
+def test_claim_without_database_never_returns_all_tenants(coordinator):
+    node = coordinator()
+    node.pool.down = True
+    # O banco nunca respondeu: sem anel conhecido, nenhum tenant
+    assert node.claim(TENANTS, "uuid") == []
+
+def test_claim_without_database_uses_last_known_ring(coordinator):
+    node = coordinator(results=[[("node-b",), ("node-c",)], []])
+    node.claim(TENANTS, "uuid")
+    node.pool.down = True
+    assert node.claim(TENANTS, "uuid") == assigned_to("node-a", ["node-a", "node-b", "node-c"])
+
+def test_get_coordinator_disabled(monkeypatch):
+    monkeypatch.setattr(sharding, "_coordinator", None)
+    monkeypatch.setattr(sharding, "load_sharding_settings", lambda: dict(sharding.DEFAULT_SHARDING_SETTINGS))
+    assert sharding.get_coordinator() is None
+    assert sharding._coordinator is False
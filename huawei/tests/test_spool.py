@@ -0,0 +1,183 @@
+import json
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+import output_handler
+from output_handler import DatabaseOutputHandler, ItemTee
+from spool import DatabaseUnavailable, Spool, SpoolFull, OPEN_SUFFIX, REJECTED_DIR
+
+def make_spool(**settings):
+    return Spool("test_db", {"fsync": "never", **settings})
+
+# Gravação falsa do replay: registra os lotes, recusa itens marcados com "bad" e simula o banco fora do ar
+class FakeSave:
+    def __init__(self, down=False):
+        self.batches = []
+        self.down = down
+
+    def __call__(self, endpoint_name, response_key, items):
+        if self.down:
+            raise DatabaseUnavailable("connection refused")
+        if any(item.get("bad") for item in items):
+            return False
+        self.batches.append((endpoint_name, response_key, [item["id"] for item in items]))
+        return True
+
+def test_append_and_replay_in_order_and_in_batches():
+    spool = make_spool(replay_batch_items=3)
+    for page in range(3):
+        spool.append("get_devices_msp", "data", [{"id": page * 2}, {"id": page * 2 + 1}], tenant_id="t1")
+    spool.append("get_alarms", "alarm", [{"id": "a"}])
+    assert len(spool.segments(include_open=True)) == 1
+
+    save = FakeSave()
+    summary = spool.replay(save)
+    # Registros do mesmo endpoint acumulados até replay_batch_items, na ordem em que foram guardados
+    assert save.batches == [("get_devices_msp", "data", [0, 1, 2, 3]), ("get_devices_msp", "data", [4, 5]),
+                            ("get_alarms", "alarm", ["a"])]
+    assert summary == {"segments": 1, "records": 4, "items": 7, "rejected": 0, "skipped_lines": 0, "complete": True}
+    assert spool.segments(include_open=True) == []
+
+def test_poison_record_goes_to_rejected_and_replay_continues():
+    spool = make_spool()
+    spool.append("get_devices_msp", "data", [{"id": 1}])
+    spool.append("get_devices_msp", "data", [{"id": 2, "bad": True}])
+    spool.append("get_devices_msp", "data", [{"id": 3}])
+
+    save = FakeSave()
+    summary = spool.replay(save)
+    # O lote é recusado; cada registro é tentado sozinho e só o ruim fica em rejected/
+    assert save.batches == [("get_devices_msp", "data", [1]), ("get_devices_msp", "data", [3])]
+    assert (summary["records"], summary["rejected"], summary["complete"]) == (2, 1, True)
+    assert spool.rejected_records() == 1
+    (name,) = os.listdir(os.path.join(spool.directory, REJECTED_DIR))
+    with open(os.path.join(spool.directory, REJECTED_DIR, name)) as rejected:
+        record = json.loads(rejected.readline())
+    assert record["items"] == [{"id": 2, "bad": True}] and "rejected_at" in record
+    assert spool.segments(include_open=True) == []
+
+def test_database_unavailable_keeps_segment():
+    spool = make_spool()
+    spool.append("get_devices_msp", "data", [{"id": 1}])
+    summary = spool.replay(FakeSave(down=True))
+    assert summary["complete"] is False
+    assert len(spool.segments()) == 1
+    assert spool.rejected_records() == 0
+    # Com o banco de volta, o mesmo registro é gravado
+    save = FakeSave()
+    assert spool.replay(save)["records"] == 1
+    assert save.batches == [("get_devices_msp", "data", [1])]
+
+def test_truncated_last_line_is_skipped():
+    spool = make_spool()
+    spool.append("get_devices_msp", "data", [{"id": 1}])
+    spool.seal()
+    (path,) = spool.segments()
+    with open(path, "ab") as segment:
+        segment.write(b'{"endpoint":"get_devices_msp","resp')
+    summary = spool.replay(FakeSave())
+    assert (summary["records"], summary["skipped_lines"]) == (1, 1)
+
+def test_open_segment_of_dead_process_is_replayed():
+    spool = make_spool()
+    process = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    os.makedirs(spool.directory)
+    path = os.path.join(spool.directory, f"{1:020d}-{process.stdout.strip()}{OPEN_SUFFIX}")
+    with open(path, "w") as segment:
+        segment.write(json.dumps({"endpoint": "get_devices_msp", "response_key": "data", "items": [{"id": 9}]}) + "\n")
+    save = FakeSave()
+    spool.replay(save)
+    assert save.batches == [("get_devices_msp", "data", [9])]
+
+def test_spool_full():
+    spool = make_spool(max_bytes=200)
+    spool.append("get_devices_msp", "data", [{"id": 1}])
+    with pytest.raises(SpoolFull):
+        spool.append("get_devices_msp", "data", [{"id": n} for n in range(50)])
+
+def test_segment_sealed_by_size():
+    spool = make_spool(segment_bytes=1)
+    spool.append("get_devices_msp", "data", [{"id": 1}])
+    spool.append("get_devices_msp", "data", [{"id": 2}])
+    assert len(spool.segments()) == 1
+    assert len(spool.segments(include_open=True)) == 2
+
+def test_item_tee_keeps_copy_until_max_items():
+    tee = ItemTee(iter(range(5)), max_items=10)
+    assert next(iter(tee)) == 0
+    assert tee.items() == [0, 1, 2, 3, 4]
+    overflowed = ItemTee(iter(range(5)), max_items=2)
+    assert list(overflowed) == [0, 1, 2, 3, 4]
+    assert overflowed.items() is None
+
+# Erros do driver usados nos testes de falha na gravação; sem o psycopg2 instalado, só esses testes são pulados
+@pytest.fixture
+def psycopg2():
+    return pytest.importorskip("psycopg2")
+
+# Handler com spool cujo banco falha com o erro dado (ou grava normalmente com error=None)
+@pytest.fixture
+def failing_handler(monkeypatch):
+    def make(error):
+        monkeypatch.setattr(output_handler, "get_spool", lambda name, settings: make_spool(retry_interval=60))
+        handler = DatabaseOutputHandler("postgresql://localhost/db", "devices_test", "upsert", ["id"], "update", "copy",
+                                        spool_settings={"enabled": True})
+
+        @contextmanager
+        def connection():
+            if error is not None:
+                raise error
+            yield None
+        monkeypatch.setattr(handler, "connection", connection)
+        monkeypatch.setattr(handler, "save_with_connection", lambda conn, data, **kwargs: {
+            "items": len(list(data["data"])), "inserted": 0, "updated": 0, "unchanged": 0})
+        return handler
+    return make
+
+def test_connection_error_spools_the_page(failing_handler, psycopg2):
+    handler = failing_handler(psycopg2.OperationalError("server closed the connection"))
+    counts = handler.save("get_devices_msp", {"data": [{"id": 1}, {"id": 2}]}, response_key="data", tenant_id="t1")
+    assert counts["spooled"] == 2
+    assert handler.spool.bypass_until > 0
+    # Logo após a falha, a página seguinte vai direto para o spool, sem tentar o banco
+    assert handler.save("get_devices_msp", {"data": [{"id": 3}]}, response_key="data")["spooled"] == 1
+    assert len(handler.spool.segments(include_open=True)) == 1
+
+def test_streamed_page_is_spooled_from_the_tee(failing_handler, psycopg2):
+    handler = failing_handler(psycopg2.InterfaceError("connection already closed"))
+    counts = handler.save("get_devices_msp", {"data": iter([{"id": 1}, {"id": 2}])}, response_key="data")
+    assert counts["spooled"] == 2
+
+def test_statement_error_is_not_spooled(failing_handler, psycopg2):
+    handler = failing_handler(psycopg2.ProgrammingError("there is no unique constraint matching ON CONFLICT"))
+    assert handler.save("get_devices_msp", {"data": [{"id": 1}]}, response_key="data") is None
+    assert handler.spool.segments(include_open=True) == []
+
+def test_connection_error_during_replay_raises_database_unavailable(failing_handler, psycopg2):
+    handler = failing_handler(psycopg2.OperationalError("connection refused"))
+    with pytest.raises(DatabaseUnavailable):
+        handler.save("get_devices_msp", {"data": [{"id": 1}]}, response_key="data", spool=False)
+
+def test_pending_spool_is_drained_before_direct_writes(failing_handler, monkeypatch):
+    handler = failing_handler(None)
+    handler.spool.append("get_devices_msp", "data", [{"id": 0}])
+    drained = []
+
+    def replay_spools(execution_id, db_names):
+        drained.append(db_names)
+        return {handler.spool.name: handler.spool.replay(FakeSave(down=True))}
+    monkeypatch.setattr(output_handler, "replay_spools", replay_spools)
+    # Replay incompleto: a página nova vai para o fim do spool, atrás da antiga
+    assert handler.save("get_devices_msp", {"data": [{"id": 1}]}, response_key="data")["spooled"] == 1
+    assert drained == [[handler.spool.name]]
+
+    handler.spool.bypass_until = 0
+    monkeypatch.setattr(output_handler, "replay_spools",
+                        lambda execution_id, db_names: {handler.spool.name: handler.spool.replay(FakeSave())})
+    counts = handler.save("get_devices_msp", {"data": [{"id": 2}]}, response_key="data")
+    assert "spooled" not in counts
+    assert handler.spool.segments(include_open=True) == []
@@ -0,0 +1,164 @@
+import fcntl
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import access_manager
+from access_manager import (TokenError, TokenManager, read_token_file, request_msp_token, request_tenant_token, request_with_attempts,
+                            token_file_lock, write_token_file)
+
+KEY = ("msp", "nce.example", "user")
+
+def expired_date(seconds):
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+# Busca falsa no controlador: conta as chamadas e devolve token-1, token-2, ...
+class FakeFetch:
+    def __init__(self, expires_in=3600, delay=0):
+        self.calls = 0
+        self.expires_in = expires_in
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def __call__(self, execution_id):
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls += 1
+            return f"token-{self.calls}", expired_date(self.expires_in)
+
+@pytest.fixture
+def manager(monkeypatch):
+    # Sem a thread de renovação em segundo plano: refresh_expiring é chamado direto nos testes
+    monkeypatch.setattr(TokenManager, "_start_refresher", lambda self: None)
+    return TokenManager(refresh_margin=300)
+
+@pytest.fixture
+def token_path(workdir):
+    return str(workdir / "config" / "token.json")
+
+def test_concurrent_threads_fetch_once(manager, token_path):
+    fetch = FakeFetch(delay=0.05)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager._get(KEY, token_path, "token_id", fetch, "t")))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert fetch.calls == 1
+    assert results == ["token-1"] * 8
+    assert read_token_file(token_path)["token_id"] == "token-1"
+    # Depois da primeira busca, o token sai da memória sem tocar no arquivo
+    assert manager._get(KEY, token_path, "token_id", fetch, "t") == "token-1"
+    assert manager.stats()["hits"] >= 1
+
+def test_token_file_written_by_other_process_is_reused(manager, token_path):
+    write_token_file(token_path, {"token_id": "from-file", "expiredDate": expired_date(3600)})
+    fetch = FakeFetch()
+    assert manager._get(KEY, token_path, "token_id", fetch, "t") == "from-file"
+    assert fetch.calls == 0
+    assert manager.stats()["file_hits"] == 1
+
+def test_token_file_near_expiry_is_ignored(manager, token_path):
+    write_token_file(token_path, {"token_id": "old", "expiredDate": expired_date(10)})
+    fetch = FakeFetch()
+    assert manager._get(KEY, token_path, "token_id", fetch, "t") == "token-1"
+    assert fetch.calls == 1
+
+def test_force_new_token_replaces_cached_token(manager, token_path):
+    fetch = FakeFetch()
+    assert manager._get(KEY, token_path, "token_id", fetch, "t") == "token-1"
+    assert manager._get(KEY, token_path, "token_id", fetch, "t", force_new_token=True) == "token-2"
+    assert read_token_file(token_path)["token_id"] == "token-2"
+
+def test_refresh_expiring_renews_only_tokens_inside_margin(manager, workdir):
+    expiring, fresh = FakeFetch(expires_in=120), FakeFetch(expires_in=3600)
+    manager._get(("tenant", "nce.example", "a"), str(workdir / "a.json"), "tokenId", expiring, "t")
+    manager._get(("tenant", "nce.example", "b"), str(workdir / "b.json"), "tokenId", fresh, "t")
+    manager.refresh_expiring()
+    assert (expiring.calls, fresh.calls) == (2, 1)
+    assert manager.stats()["background_refreshes"] == 1
+    assert manager._get(("tenant", "nce.example", "a"), str(workdir / "a.json"), "tokenId", expiring, "t") == "token-2"
+
+def test_idle_tokens_are_evicted_instead_of_refreshed(manager, workdir):
+    used, idle = FakeFetch(expires_in=120), FakeFetch(expires_in=120)
+    manager._get(("tenant", "nce.example", "used"), str(workdir / "used.json"), "tokenId", used, "t")
+    manager._get(("tenant", "nce.example", "idle"), str(workdir / "idle.json"), "tokenId", idle, "t")
+    # Tenant que deixou de ser coletado (removido do get_tenants ou assumido por outro nó)
+    manager._tokens[("tenant", "nce.example", "idle")]["last_used"] -= manager.idle_timeout + 1
+    last_used = manager._tokens[("tenant", "nce.example", "used")]["last_used"]
+    manager.refresh_expiring()
+    assert (used.calls, idle.calls) == (2, 1)
+    assert ("tenant", "nce.example", "idle") not in manager._tokens
+    assert manager.stats()["evictions"] == 1
+    # A renovação em segundo plano não conta como uso
+    assert manager._tokens[("tenant", "nce.example", "used")]["last_used"] == last_used
+
+def test_failed_background_refresh_drops_the_token(manager, token_path):
+    fetch = FakeFetch(expires_in=120)
+    manager._get(KEY, token_path, "token_id", fetch, "t")
+
+    def failing(execution_id):
+        raise TokenError("503")
+    manager._tokens[KEY]["fetch"] = failing
+    manager.refresh_expiring()
+    assert KEY not in manager._tokens
+    assert manager.stats()["background_refreshes"] == 0
+
+def test_fetch_error_is_counted_and_raised(manager, token_path):
+    def fetch(execution_id):
+        raise TokenError("401")
+    with pytest.raises(TokenError):
+        manager._get(KEY, token_path, "token_id", fetch, "t")
+    assert manager.stats()["errors"] == 1
+
+def test_token_file_lock_times_out_while_held(monkeypatch, token_path):
+    monkeypatch.setattr(access_manager, "LOCK_POLL_INTERVAL", 0.01)
+    with token_file_lock(token_path):
+        # Outra descrição de arquivo (como a de outro processo) não consegue o flock
+        with open(f"{token_path}.lock", "a") as other:
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        with pytest.raises(TokenError):
+            with token_file_lock(token_path, timeout=0.05):
+                pass
+    with token_file_lock(token_path, timeout=0.05):
+        pass
+
+# Resposta HTTP falsa do controlador: body é o JSON devolvido (ou o texto, se não for JSON)
+class FakeResponse:
+    def __init__(self, body, status_code=200):
+        self.status_code = status_code
+        self.text = body if isinstance(body, str) else json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+@pytest.fixture
+def controller(monkeypatch):
+    responses = []
+    monkeypatch.setattr(access_manager, "get_endpoint", lambda name: type("Endpoint", (), {"path": f"/{name}"}))
+    monkeypatch.setattr(access_manager.http_session, "request", lambda *args, **kwargs: responses.pop(0))
+    monkeypatch.setattr(access_manager, "LOCK_WAIT_TIME", 0)
+    return responses
+
+@pytest.mark.parametrize("body", ["<html>502 Bad Gateway</html>", {"errcode": "0"}, {"errcode": "0", "data": None},
+                                  {"errcode": "0", "data": {"token_id": "x", "expiredDate": "amanhã"}}, ["errcode"]])
+def test_malformed_msp_response_is_token_error(controller, body):
+    controller.append(FakeResponse(body))
+    with pytest.raises(TokenError):
+        request_msp_token("https://nce.example", "user", "secret", "t")
+
+@pytest.mark.parametrize("body", ["not json", {"data": {"tokenId": "x"}}, {"data": "x"}])
+def test_malformed_tenant_response_is_token_error(controller, body):
+    controller.append(FakeResponse(body))
+    with pytest.raises(TokenError):
+        request_tenant_token("https://nce.example", "t1", "msp-token", "t")
+
+def test_malformed_response_is_retried(controller):
+    controller.extend([FakeResponse("not json"), FakeResponse({"errcode": "0", "data": {"token_id": "ok", "expiredDate": expired_date(3600)}})])
+    token, _ = request_with_attempts(request_msp_token, "t", "https://nce.example", "user", "secret")
+    assert token == "ok"
@@ -0,0 +1,128 @@
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import watermarks
+from watermarks import FileWatermarkStore, ISO_FORMAT, RECONCILE_SUFFIX, close_window, make_incremental_call, open_window, track_newest
+
+INCREMENTAL = {"store": "file", "state_file": "state/alarm_watermarks.json", "overlap_seconds": 300, "initial_lookback_hours": 24,
+               "reconcile_interval_hours": 24, "watermark_fields": ["time-created", "resource-alarm-parameters->>last-changed"]}
+
+def stamp(moment):
+    return moment.strftime(ISO_FORMAT)
+
+def alarm(created, last_changed=None):
+    return {"time-created": stamp(created), "resource-alarm-parameters": {"last-changed": stamp(last_changed or created)}}
+
+@pytest.fixture(autouse=True)
+def stores(monkeypatch):
+    monkeypatch.setattr(watermarks, "_stores", {})
+
+@pytest.fixture
+def store():
+    return FileWatermarkStore(INCREMENTAL["state_file"])
+
+def test_first_window_uses_initial_lookback(store):
+    window = open_window(INCREMENTAL, "t1")
+    assert (window["watermark"], window["reconcile"]) == (None, False)
+    assert window["params"] == {"start-time": stamp(window["now"] - timedelta(hours=24)), "end-time": stamp(window["now"])}
+    created = window["now"] - timedelta(hours=2)
+    track_newest(window, [alarm(created), alarm(created - timedelta(hours=1))])
+    assert close_window(window, "t1") == {"reconciled": False, "watermark": stamp(created)}
+    assert store.get("t1") == created
+    # A primeira coleta marca a reconciliação: a próxima vem reconcile_interval_hours depois
+    assert store.get(f"t1{RECONCILE_SUFFIX}") == window["now"]
+
+def test_next_window_overlaps_the_watermark(store):
+    watermark = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(hours=1)
+    store.set("t1", watermark)
+    store.set(f"t1{RECONCILE_SUFFIX}", watermark)
+    window = open_window(INCREMENTAL, "t1")
+    assert window["params"]["start-time"] == stamp(watermark - timedelta(seconds=300))
+    assert window["params"]["end-time"] == stamp(window["now"])
+
+def test_newest_never_passes_the_end_of_the_window():
+    window = open_window(INCREMENTAL, "t1")
+    later = window["now"] + timedelta(minutes=5)
+    track_newest(window, [alarm(window["now"] - timedelta(minutes=1), last_changed=later)])
+    assert window["newest"] == window["now"] - timedelta(minutes=1)
+
+def test_watermark_never_moves_back(store):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    store.set("t1", now)
+    store.set("t1", now - timedelta(hours=1))
+    assert store.get("t1") == now
+
+@pytest.mark.parametrize("hours_since, reconcile", [(25, True), (23, False)])
+def test_reconciliation_schedule(store, hours_since, reconcile):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    store.set("t1", now - timedelta(minutes=10))
+    store.set(f"t1{RECONCILE_SUFFIX}", now - timedelta(hours=hours_since))
+    window = open_window(INCREMENTAL, "t1")
+    assert window["reconcile"] is reconcile
+    # Reconciliação sem janela de criação nem end-time
+    assert ("end-time" not in window["params"] and "start-time" not in window["params"]) is reconcile
+    close_window(window, "t1")
+    assert (store.get(f"t1{RECONCILE_SUFFIX}") == window["now"]) is reconcile
+
+def test_reconciliation_with_lookback(store):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    store.set("t1", now)
+    store.set(f"t1{RECONCILE_SUFFIX}", now - timedelta(days=2))
+    window = open_window({**INCREMENTAL, "reconcile_lookback_hours": 72}, "t1")
+    assert window["params"] == {"start-time": stamp(window["now"] - timedelta(hours=72))}
+
+# Coleta incremental com paginação e gravação falsas: pages é a lista de páginas (None simula a falha na busca)
+@pytest.fixture
+def collect(monkeypatch):
+    def run(pages, saved=lambda page_number: True, pipeline=None):
+        def iter_api_pages(endpoint_name, url_base, username, password, execution_id, tenant_id, **kwargs):
+            for page_number, page in enumerate(pages, 1):
+                if page is None:
+                    raise RuntimeError(f"Falha ao obter a página {page_number}")
+                yield page_number, {"data": page}, kwargs
+
+        class Handler:
+            def save(self, endpoint_name, data, page=None, **kwargs):
+                items = list(data["data"])
+                return {"items": len(items)} if saved(page) else None
+
+        monkeypatch.setattr(watermarks, "get_endpoint_config", lambda endpoint_name, execution_id: {"incremental": INCREMENTAL})
+        monkeypatch.setattr(watermarks, "iter_api_pages", iter_api_pages)
+        monkeypatch.setattr(watermarks, "resolve_output_handler", lambda endpoint_name, execution_id: Handler())
+        return make_incremental_call("get_alarms", "https://nce.example", "user", "secret", "uuid", "t1", pipeline=pipeline)
+    return run
+
+def test_watermark_advances_after_all_pages_are_saved(collect, store):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    summary = collect([[alarm(now - timedelta(hours=3))], [alarm(now - timedelta(hours=1))]])
+    assert (summary["pages"], summary["items"]) == (2, 2)
+    assert store.get("t1") == now - timedelta(hours=1)
+
+@pytest.mark.parametrize("fetch_fails", [False, True])
+def test_no_advance_on_failure(collect, store, fetch_fails):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    # A primeira página foi gravada; a segunda falhou na gravação ou na busca: o watermark não pode pular a segunda
+    second = None if fetch_fails else [alarm(now - timedelta(hours=1))]
+    assert collect([[alarm(now - timedelta(hours=3))], second], saved=lambda page_number: page_number == 1) is None
+    assert store.get("t1") is None
+
+# Pipeline falso: consome os itens como o gravador e resolve o futuro com o resultado da gravação
+class FakePipeline:
+    def __init__(self, results):
+        self.results = list(results)
+
+    def submit(self, endpoint_name, data, response_key, **kwargs):
+        list(data[response_key])
+        future = Future()
+        future.set_result(self.results.pop(0))
+        return future
+
+def test_pipeline_failure_keeps_watermark(collect, store):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    pages = [[alarm(now - timedelta(hours=3))], [alarm(now - timedelta(hours=1))]]
+    assert collect(pages, pipeline=FakePipeline([True, False])) is None
+    assert store.get("t1") is None
+    assert collect(pages, pipeline=FakePipeline([True, True]))["pages"] == 2
+    assert store.get("t1") == now - timedelta(hours=1)
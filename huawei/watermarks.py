@@ -0,0 +1,222 @@
+import os
+import json
+import fcntl
+import tempfile
+import traceback
+from datetime import datetime, timedelta, timezone
+
+from api_manager import (get_endpoint_config, iter_api_pages, resolve_output_handler, output_config, logger)
+from output_handler import get_nested_field, encode_db_connection
+from db_pool import get_pool
+
+# Formato de data aceito pelos parâmetros start-time/end-time do alarm-list
+ISO_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# A janela start-time/end-time filtra pela criação do alarme: clear, ack e mudança de severidade de um alarme criado
+# antes da janela não voltam nela. A cada reconcile_interval_hours o tenant é coletado sem a janela (ou só com
+# reconcile_lookback_hours), para o rastreamento de estado ver essas transições. O instante da última reconciliação fica
+# no mesmo store dos watermarks, na chave do tenant com este sufixo
+RECONCILE_SUFFIX = ":reconcile"
+
+# Função para converter um timestamp ISO 8601 (ex.: 2024-10-19T16:07:05.092Z) em datetime UTC
+def parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+# Watermarks por tenant em um arquivo JSON local, gravado de forma atômica e com lock entre processos
+class FileWatermarkStore:
+    def __init__(self, state_file):
+        self.state_file = state_file
+
+    def _read(self):
+        try:
+            with open(self.state_file, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def get(self, tenant_id):
+        return parse_timestamp(self._read().get(tenant_id))
+
+    def set(self, tenant_id, watermark):
+        directory = os.path.dirname(self.state_file) or "."
+        os.makedirs(directory, exist_ok=True)
+        with open(f"{self.state_file}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Reler sob o lock: outros processos podem ter avançado outros tenants
+                state = self._read()
+                current = parse_timestamp(state.get(tenant_id))
+                if current and current >= watermark:
+                    return
+                state[tenant_id] = watermark.strftime(ISO_FORMAT)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_watermarks_")
+                with os.fdopen(fd, "w") as file:
+                    json.dump(state, file, indent=4, sort_keys=True)
+                os.replace(tmp_path, self.state_file)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# Watermarks por tenant em uma tabela do PostgreSQL (compartilhada entre coletores)
+class DatabaseWatermarkStore:
+    def __init__(self, db_name, table="alarm_watermarks"):
+        database_config = output_config['databases'][db_name]
+        dsn = encode_db_connection(database_config['db_connection'])
+        self.pool = get_pool(db_name, dsn, **database_config.get('pool', {}))
+        self.table = table
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.table} (
+                        tenant_id text PRIMARY KEY,
+                        watermark timestamptz NOT NULL,
+                        updated_at timestamptz NOT NULL DEFAULT NOW()
+                    );""")
+            conn.commit()
+
+    def get(self, tenant_id):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"SELECT watermark FROM {self.table} WHERE tenant_id = %s", (tenant_id,))
+                row = cursor.fetchone()
+            conn.rollback()
+        return row[0] if row else None
+
+    def set(self, tenant_id, watermark):
+        # GREATEST impede que uma execução atrasada faça o watermark retroceder
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    INSERT INTO {self.table} (tenant_id, watermark, updated_at)
+                    VALUES (%s, %s, NOW())
+                    ON CONFLICT (tenant_id) DO UPDATE
+                    SET watermark = GREATEST({self.table}.watermark, EXCLUDED.watermark), updated_at = NOW();""",
+                               (tenant_id, watermark))
+            conn.commit()
+
+_stores = {}
+
+# Função para obter o store de watermarks configurado (um por processo)
+def get_watermark_store(incremental_config):
+    store_type = incremental_config.get("store", "file")
+    key = (store_type, incremental_config.get("state_file"), incremental_config.get("db_name"), incremental_config.get("table"))
+    if key not in _stores:
+        if store_type == "file":
+            _stores[key] = FileWatermarkStore(incremental_config.get("state_file", "state/alarm_watermarks.json"))
+        elif store_type == "database":
+            _stores[key] = DatabaseWatermarkStore(incremental_config["db_name"], incremental_config.get("table", "alarm_watermarks"))
+        else:
+            raise ValueError(f"Tipo de store de watermark {store_type} desconhecido")
+    return _stores[key]
+
+# Função para indicar se o endpoint tem coleta incremental habilitada
+def is_incremental(endpoint_name, execution_id):
+    return get_endpoint_config(endpoint_name, execution_id).get("incremental", {}).get("enabled", False)
+
+# Função para abrir a janela incremental do tenant: lê o watermark, decide se é uma reconciliação e monta os
+# parâmetros start-time/end-time da consulta. O dicionário devolvido acompanha a coleta até close_window
+def open_window(incremental, tenant_id):
+    store = get_watermark_store(incremental)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    watermark = store.get(tenant_id)
+    reconcile_interval = incremental.get("reconcile_interval_hours")
+    reconciled = store.get(f"{tenant_id}{RECONCILE_SUFFIX}") if reconcile_interval else None
+    reconcile = bool(watermark and reconciled and now - reconciled >= timedelta(hours=reconcile_interval))
+    if reconcile:
+        # Reconciliação: sem janela de criação (ou só a de reconcile_lookback_hours) e sem end-time
+        start = now - timedelta(hours=incremental["reconcile_lookback_hours"]) if incremental.get("reconcile_lookback_hours") else None
+    elif watermark:
+        # Sobreposição para alarmes que chegam ao controlador com atraso (duplicatas são absorvidas pelo ON CONFLICT)
+        start = watermark - timedelta(seconds=incremental.get("overlap_seconds", 300))
+    elif incremental.get("initial_lookback_hours"):
+        start = now - timedelta(hours=incremental["initial_lookback_hours"])
+    else:
+        start = None
+
+    params = {}
+    if start:
+        params[incremental.get("start_param", "start-time")] = start.strftime(ISO_FORMAT)
+    if not reconcile:
+        params[incremental.get("end_param", "end-time")] = now.strftime(ISO_FORMAT)
+    return {"incremental": incremental, "store": store, "now": now, "watermark": watermark, "reconciled": reconciled,
+            "reconcile": reconcile, "start": start, "params": params, "newest": watermark}
+
+# Função para acompanhar o maior timestamp visto nos itens coletados dentro da janela
+def track_newest(window, items):
+    watermark_fields = window["incremental"].get("watermark_fields", ["time-created"])
+    for item in items:
+        for field in watermark_fields:
+            seen = parse_timestamp(get_nested_field(item, field))
+            # Nunca além do fim da janela consultada, para não pular alarmes criados depois da consulta
+            if seen and seen <= window["now"] and (window["newest"] is None or seen > window["newest"]):
+                window["newest"] = seen
+
+# Função para fechar a janela depois que todas as páginas foram gravadas: avança o watermark e a marca de reconciliação
+def close_window(window, tenant_id):
+    store, newest = window["store"], window["newest"]
+    if newest and newest != window["watermark"]:
+        store.set(tenant_id, newest)
+    # A primeira coleta já cobre a janela inicial: a primeira reconciliação vem reconcile_interval_hours depois
+    if window["incremental"].get("reconcile_interval_hours") and (window["reconcile"] or window["reconciled"] is None):
+        store.set(f"{tenant_id}{RECONCILE_SUFFIX}", window["now"])
+    return {"reconciled": window["reconcile"], "watermark": newest.strftime(ISO_FORMAT) if newest else None}
+
+# Coleta apenas a janela desde o último watermark do tenant e só avança o watermark após todas as páginas serem gravadas
+def make_incremental_call(endpoint_name, url_base, username, password, execution_id, tenant_id, pipeline=None, **kwargs):
+    endpoint_config = get_endpoint_config(endpoint_name, execution_id)
+    response_key = endpoint_config.get('response_key', 'data')
+    window = open_window(endpoint_config["incremental"], tenant_id)
+    watermark = window["watermark"]
+    kwargs.update(window["params"])
+    logger.info("[UUID: %s] %s %s para tenant %s: watermark %s, janela %s -> %s", execution_id, endpoint_name,
+                "reconciliação" if window["reconcile"] else "incremental", tenant_id, watermark, window["start"],
+                None if window["reconcile"] else window["now"])
+
+    output_handler = resolve_output_handler(endpoint_name, execution_id) if pipeline is None else None
+    summary = {"pages": 0, "items": 0}
+
+    # Observa os itens no caminho até o handler, para funcionar também com páginas decodificadas de forma incremental
+    def observe(items):
+        for item in items:
+            track_newest(window, (item,))
+            summary["items"] += 1
+            yield item
+
+    pending = []
+    try:
+        for page_number, page, page_kwargs in iter_api_pages(endpoint_name, url_base, username, password, execution_id, tenant_id, **kwargs):
+            observed_page = {**page, response_key: observe(page.get(response_key) or [])}
+            if pipeline is not None:
+                # O watermark só avança depois que todas as páginas enfileiradas forem gravadas (verificado abaixo)
+                pending.append(pipeline.submit(endpoint_name, observed_page, response_key, tenant_id=tenant_id or "",
+                                               page=page_number, **page_kwargs))
+                summary["pages"] = page_number
+                continue
+            result = output_handler.save(endpoint_name, observed_page, tenant_id=tenant_id or "", execution_id=execution_id,
+                                         response_key=response_key, page=page_number, **page_kwargs)
+            if result is None:
+                logger.error(f"[UUID: {execution_id}] Falha ao gravar a página {page_number}; watermark do tenant {tenant_id} mantido em {watermark}")
+                return None
+            summary["pages"] = page_number
+    except RuntimeError as e:
+        logger.error(str(e))
+        return None
+    finally:
+        saved = all([future.result() for future in pending])
+    if not saved:
+        logger.error(f"[UUID: {execution_id}] Falha ao gravar páginas enfileiradas; watermark do tenant {tenant_id} mantido em {watermark}")
+        return None
+
+    try:
+        summary.update(close_window(window, tenant_id))
+    except Exception as e:
+        logger.error(f"[UUID: {execution_id}] Erro ao gravar o watermark do tenant {tenant_id}: {e}")
+        logger.error(traceback.format_exc())
+        return None
+    logger.info("[UUID: %s] %s incremental para tenant %s: %s", execution_id, endpoint_name, tenant_id, summary)
+    return summary